@@ -0,0 +1,71 @@
+'''Benchmark merging many small assay frames with constant factor columns.
+
+Compares adding the constant columns to every frame followed by
+`pd.concat(..., ignore_index=True)`, with `merge.merge_frames`.
+
+Usage::
+
+    python benchmarks/assay_merge.py [n_assays ...]
+
+'''
+
+# Generic Python imports.
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from isadream.models import merge
+
+
+def build_assays(n_assays, rows=50, seed=0):
+    '''Small frames with some missing columns, and per assay factors.'''
+    random = np.random.RandomState(seed)
+    frames, constants = list(), list()
+    for i in range(n_assays):
+        frame = pd.DataFrame({'OH_concentration': random.rand(rows),
+                              'Al_ppm': 80 - random.rand(rows)})
+        if i % 3 == 0:
+            frame['Al_concentration'] = random.rand(rows)
+        frames.append(frame)
+        constants.append({'metadata_key': f'node-{i // 10}',
+                          'temperature': 25.0 + i % 5,
+                          'counter_ion': ('K+', 'Na+', 'Li+')[i % 3]})
+    return frames, constants
+
+
+def with_concat(frames, constants):
+    tagged = list()
+    for frame, frame_constants in zip(frames, constants):
+        frame = frame.copy()
+        for name, value in frame_constants.items():
+            frame[name] = value
+        tagged.append(frame)
+    return pd.concat(tagged, ignore_index=True)
+
+
+def with_merge(frames, constants):
+    return merge.merge_frames(frames, constants)
+
+
+def best_of(function, *args, repeat=3):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+if __name__ == '__main__':
+    for n_assays in [int(arg) for arg in sys.argv[1:]] or [100, 1000, 5000]:
+        frames, constants = build_assays(n_assays)
+        concat_time = best_of(with_concat, frames, constants)
+        merge_time = best_of(with_merge, frames, constants)
+        print(f'{n_assays:>6} assays: concat {concat_time * 1e3:8.1f} ms, '
+              f'merge {merge_time * 1e3:8.1f} ms '
+              f'({concat_time / merge_time:.1f}x)')
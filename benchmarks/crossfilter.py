@@ -0,0 +1,108 @@
+'''Benchmark brushing one dimension of a multi-dimension filter.
+
+Compares recomputing a pandas boolean mask over every filtered dimension,
+and the histograms of the other dimensions from it, with
+`crossfilter.CrossFilter`, which only flips the filter bits (and updates the
+histogram counts) of the rows between the old and new range of the brushed
+dimension.
+
+Usage::
+
+    python benchmarks/crossfilter.py [n_rows ...]
+
+'''
+
+# Generic Python imports.
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from isadream.models import crossfilter
+
+DIMENSIONS = ('OH_concentration', 'Al_concentration', 'Al_ppm', 'temperature')
+
+
+def build_frame(n_rows, seed=0):
+    random = np.random.RandomState(seed)
+    return pd.DataFrame({name: random.rand(n_rows) for name in DIMENSIONS})
+
+
+def brush_steps(steps=50):
+    '''A brush sliding across the first dimension.'''
+    lows = np.linspace(0.0, 0.7, steps)
+    return list(zip(lows, lows + 0.3))
+
+
+def with_pandas(data_frame, steps, edges):
+    counts, histograms = list(), list()
+    brushed = data_frame['OH_concentration']
+    for low, high in steps:
+        masks = dict(OH_concentration=brushed.between(low, high),
+                     Al_concentration=data_frame['Al_concentration']
+                     .between(0.2, 0.8),
+                     temperature=data_frame['temperature'].between(0.1, 0.9))
+        selected = masks['OH_concentration'] & masks['Al_concentration'] \
+            & masks['temperature']
+        counts.append(int(selected.sum()))
+        # The histogram of a dimension ignores its own filter.
+        step = dict()
+        for name in DIMENSIONS:
+            others = np.ones(len(data_frame), dtype=bool)
+            for other, mask in masks.items():
+                if other != name:
+                    others &= mask.to_numpy()
+            step[name] = np.histogram(data_frame[name].to_numpy()[others],
+                                      edges[name])[0]
+        histograms.append(step)
+    return counts, histograms
+
+
+def with_crossfilter(engine, steps):
+    brushed = engine.dimension('OH_concentration')
+    counts, histograms = list(), list()
+    for low, high in steps:
+        brushed.filter_range(low, high)
+        counts.append(engine.count())
+        histograms.append({name: counts_ for name, (counts_, _)
+                           in engine.histograms().items()})
+    return counts, histograms
+
+
+if __name__ == '__main__':
+    for n_rows in [int(arg) for arg in sys.argv[1:]] or [100000, 1000000]:
+        data_frame = build_frame(n_rows)
+        steps = brush_steps()
+
+        start = time.perf_counter()
+        engine = crossfilter.CrossFilter(data_frame)
+        for name in DIMENSIONS:
+            engine.dimension(name)
+        engine.dimension('Al_concentration').filter_range(0.2, 0.8)
+        engine.dimension('temperature').filter_range(0.1, 0.9)
+        index_time = time.perf_counter() - start
+
+        edges = {name: engine.dimension(name).edges for name in DIMENSIONS}
+
+        start = time.perf_counter()
+        expected = with_pandas(data_frame, steps, edges)
+        pandas_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        counts, histograms = with_crossfilter(engine, steps)
+        crossfilter_time = time.perf_counter() - start
+        assert counts == expected[0]
+        for step, expected_step in zip(histograms, expected[1]):
+            for name in DIMENSIONS:
+                assert (step[name] == expected_step[name]).all()
+
+        per_step = 1e3 / len(steps)
+        print(f'{n_rows:>8} rows: index build {index_time * 1e3:7.1f} ms, '
+              f'brush and histograms: pandas '
+              f'{pandas_time * per_step:6.2f} ms/step, '
+              f'crossfilter {crossfilter_time * per_step:6.2f} ms/step '
+              f'({pandas_time / crossfilter_time:.1f}x)')
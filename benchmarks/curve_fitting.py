@@ -0,0 +1,63 @@
+'''Benchmark fitting a trend line to every series of a corpus.
+
+Compares a `np.polyfit` call per group of a pandas groupby with
+`fitting.fit`, which solves the normal equations of every group in one
+batch. The coefficients of both are checked to agree.
+
+Usage::
+
+    python benchmarks/curve_fitting.py [n_groups ...]
+
+'''
+
+# Generic Python imports.
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from isadream.models import fitting
+
+DEGREE = 2
+
+
+def build_frame(n_groups, points=50, seed=0):
+    '''Noisy quadratic ppm trends against hydroxide concentration.'''
+    random = np.random.RandomState(seed)
+    group = np.repeat(np.arange(n_groups), points)
+    hydroxide = random.uniform(0.5, 12.0, len(group))
+    curvature = random.uniform(-0.02, 0.0, n_groups)[group]
+    ppm = (80.0 - 0.03 * hydroxide + curvature * hydroxide ** 2
+           + random.normal(0.0, 0.01, len(group)))
+    return pd.DataFrame(dict(OH_concentration=hydroxide, Al_ppm=ppm,
+                             series=group))
+
+
+def with_polyfit(data_frame):
+    coefficients = [np.polyfit(rows['OH_concentration'], rows['Al_ppm'],
+                               DEGREE)[::-1]
+                    for _, rows in data_frame.groupby('series', sort=False)]
+    return np.array(coefficients)
+
+
+if __name__ == '__main__':
+    for n_groups in [int(arg) for arg in sys.argv[1:]] or [100, 10000]:
+        data_frame = build_frame(n_groups)
+
+        start = time.perf_counter()
+        expected = with_polyfit(data_frame)
+        polyfit_time = time.perf_counter() - start
+        start = time.perf_counter()
+        fits = fitting.fit(data_frame['OH_concentration'],
+                           data_frame['Al_ppm'], data_frame['series'],
+                           DEGREE)
+        batch_time = time.perf_counter() - start
+
+        assert np.allclose(fits.coefficients(), expected, atol=1e-6)
+        print(f'{n_groups:>6} groups: polyfit {polyfit_time:7.3f} s, '
+              f'batched {batch_time:7.3f} s '
+              f'({polyfit_time / batch_time:.0f}x)')
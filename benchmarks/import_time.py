@@ -0,0 +1,87 @@
+'''Enforce an import time budget for the isadream modules.
+
+Each module is imported in a fresh interpreter with `-X importtime`, and its
+cumulative import time (the best of several runs) is compared with its
+budget. The heavy dependencies, which should only load on first use, must
+not be imported at all.
+
+Exits with status 1 if any budget is exceeded, so it can run in CI.
+
+Usage::
+
+    python benchmarks/import_time.py [--runs 5] [--scale 1.0]
+
+'''
+
+# Generic Python imports.
+import os
+import re
+import sys
+import argparse
+import subprocess
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+# Cumulative import time budgets, in milliseconds.
+BUDGETS = {
+    'isadream.models.lazy': 25,
+    'isadream.models.jsonparse': 75,
+    'isadream.models.cache': 100,
+    'isadream.models.catalog': 130,
+    'isadream.models.query': 110,
+    'isadream.models.drupalnode': 150,
+    'isadream.server.metrics': 140,
+    'isadream.server.sessions': 80,
+    'isadream.server.loader': 200,
+    'isadream.server.watcher': 200,
+}
+
+# Modules that must only be imported on first use.
+DEFERRED = ('pandas', 'numpy', 'bokeh', 'pyarrow')
+
+_LINE = re.compile(r'import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)')
+
+
+def import_times(module):
+    '''Cumulative import times in microseconds, by module, of one import.'''
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=ROOT, env=dict(os.environ, PYTHONPATH=ROOT),
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+        universal_newlines=True, check=True)
+    times = dict()
+    for line in result.stderr.splitlines():
+        match = _LINE.match(line)
+        if match:
+            times[match.group(4)] = int(match.group(2))
+    return times
+
+
+def measure(module, runs):
+    '''The best cumulative time in ms, and the deferred modules imported.'''
+    best, deferred = float('inf'), set()
+    for _ in range(runs):
+        times = import_times(module)
+        best = min(best, times.get(module, 0) / 1e3)
+        deferred.update(name for name in times
+                        if name.split('.')[0] in DEFERRED)
+    return best, sorted({name.split('.')[0] for name in deferred})
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--scale', type=float, default=1.0,
+                        help='Multiply every budget, for slower machines.')
+    args = parser.parse_args()
+
+    failed = False
+    for module, budget in BUDGETS.items():
+        budget *= args.scale
+        elapsed, deferred = measure(module, args.runs)
+        over = elapsed > budget or deferred
+        failed = failed or over
+        note = f' imports {", ".join(deferred)}' if deferred else ''
+        print(f'{"FAIL" if over else "ok":>4} {module:<28} '
+              f'{elapsed:7.1f} ms (budget {budget:5.0f} ms){note}')
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,84 @@
+'''Benchmark the JSON parser backends on large synthetic nodes.
+
+Builds nodes from the Sipos demo node with many assays and long embedded
+comments, then times eager parsing with every installed backend and, when
+simdjson is installed, lazy parsing both for a metadata-only read and for
+the keys a `DrupalNode` uses.
+
+Usage::
+
+    python benchmarks/json_parsing.py [n_assays ...]
+
+'''
+
+# Generic Python imports.
+import os
+import sys
+import json
+import timeit
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from isadream.models import jsonparse
+
+DEMO_JSON = os.path.join(
+    os.path.dirname(__file__), '..', 'isadream', 'demo_data', 'demo_json',
+    'sipos_2006_talanta_nmr_figs.json')
+
+NODE_KEYS = ('nodeInformation', 'studyFactors', 'studySamples', 'assays',
+             'comments')
+
+
+def build_node(n_assays, comment_size=2000):
+    '''Return the bytes of a node with n_assays copies of the demo assays.'''
+    with open(DEMO_JSON) as json_file:
+        node = json.load(json_file)
+
+    assays = list()
+    for i in range(n_assays):
+        assay = dict(node['assays'][i % len(node['assays'])])
+        assay['comments'] = [{'name': f'Comment {i}',
+                              'body': 'x' * comment_size}]
+        assays.append(assay)
+    node['assays'] = assays
+    node['comments'] = [{'name': f'Note {i}', 'body': 'y' * comment_size}
+                        for i in range(n_assays // 10 + 1)]
+    return json.dumps(node).encode('utf-8')
+
+
+def best_of(function, repeat=5):
+    timer = timeit.Timer(function)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+
+def run(n_assays):
+    data = build_node(n_assays)
+    print(f'\n{n_assays} assays, {len(data) / 1e6:.1f} MB')
+    baseline = best_of(lambda: jsonparse.loads(data, 'json'))
+
+    rows = [('json (eager, baseline)', baseline)]
+    for backend in jsonparse.available_backends()[:-1]:
+        rows.append((f'{backend} (eager)',
+                     best_of(lambda: jsonparse.loads(data, backend))))
+
+    if 'simdjson' in jsonparse.available_backends():
+        rows.append(('simdjson (lazy, nodeInformation)',
+                     best_of(lambda: jsonparse.LazyDocument(
+                         data)['nodeInformation'])))
+
+        def lazy_node_keys():
+            document = jsonparse.LazyDocument(data)
+            for key in NODE_KEYS:
+                document.get(key)
+
+        rows.append(('simdjson (lazy, node keys)', best_of(lazy_node_keys)))
+
+    for name, seconds in rows:
+        print(f'  {name:<38} {seconds * 1e3:9.2f} ms  '
+              f'{baseline / seconds:5.1f}x')
+
+
+if __name__ == '__main__':
+    for n_assays in [int(arg) for arg in sys.argv[1:]] or [100, 1000, 10000]:
+        run(n_assays)
@@ -0,0 +1,74 @@
+'''Benchmark parallel `DrupalNode` construction against the worker count.
+
+Writes a corpus of distinct synthetic nodes (variants of the Sipos demo node
+with many assays) to a temporary folder, and times
+`parallel.build_nodes` for an increasing number of worker processes.
+
+Usage::
+
+    python benchmarks/parallel_ingest.py [n_nodes] [n_assays] [max_workers]
+
+'''
+
+# Generic Python imports.
+import os
+import sys
+import json
+import time
+import tempfile
+import warnings
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from isadream.models import cache
+from isadream.models import parallel
+
+DEMO_JSON = os.path.join(
+    os.path.dirname(__file__), '..', 'isadream', 'demo_data', 'demo_json',
+    'sipos_2006_talanta_nmr_figs.json')
+
+
+def write_corpus(folder, n_nodes, n_assays):
+    with open(DEMO_JSON) as json_file:
+        node = json.load(json_file)
+    demo_assays = node['assays']
+
+    paths = list()
+    for i in range(n_nodes):
+        # Vary the contents, so the content cache cannot share nodes.
+        node['nodeInformation']['title'] = f'Synthetic node {i}'
+        node['assays'] = [dict(demo_assays[j % len(demo_assays)],
+                               dataFile=f'node_{i}_assay_{j}.csv')
+                          for j in range(n_assays)]
+        path = os.path.join(folder, f'node_{i}.json')
+        with open(path, 'w') as json_file:
+            json.dump(node, json_file)
+        paths.append(path)
+    return paths
+
+
+def main(n_nodes=48, n_assays=200, max_workers=None):
+    warnings.simplefilter('ignore')
+    with tempfile.TemporaryDirectory() as folder:
+        paths = write_corpus(folder, n_nodes, n_assays)
+        print(f'{n_nodes} nodes with {n_assays} assays each, '
+              f'{os.cpu_count()} CPUs')
+
+        max_workers = max_workers or os.cpu_count() or 1
+        counts = [1]
+        while counts[-1] * 2 <= max_workers:
+            counts.append(counts[-1] * 2)
+
+        serial = None
+        for workers in counts:
+            cache.CONTENT_CACHE.clear()
+            start = time.perf_counter()
+            parallel.build_nodes(paths, workers=workers)
+            seconds = time.perf_counter() - start
+            serial = serial or seconds
+            print(f'  {workers:>3} workers: {seconds:7.2f} s  '
+                  f'speedup {serial / seconds:4.1f}x')
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:4]])
@@ -0,0 +1,70 @@
+'''Benchmark measuring the peaks of many spectra.
+
+Compares calling `peaks.find_peaks` once per spectrum, as a per-assay
+callback would, with one call over the whole padded stack. The features of
+both are checked to agree.
+
+Usage::
+
+    python benchmarks/peak_detection.py [n_spectra ...]
+
+'''
+
+# Generic Python imports.
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from isadream.models import peaks
+
+
+def build_spectra(n_spectra, points=4000, seed=0):
+    '''Noisy spectra with two peaks, of slightly different lengths.'''
+    random = np.random.RandomState(seed)
+    spectra = list()
+    for _ in range(n_spectra):
+        length = points - random.randint(0, points // 10)
+        x = np.linspace(0.0, 100.0, length)
+        y = 0.01 * random.rand(length)
+        for height in (1.0, 0.4):
+            center, width = random.uniform(10, 90), random.uniform(0.3, 2.0)
+            y += height * np.exp(-((x - center) / width) ** 2 / 2)
+        spectra.append((x, y))
+    return spectra
+
+
+def one_by_one(spectra):
+    results = list()
+    for x, y in spectra:
+        x_stack, y_stack = peaks.pad([(x, y)])
+        results.append(peaks.find_peaks(x_stack, y_stack, max_peaks=2))
+    return {name: np.vstack([result[name] for result in results])
+            for name in peaks.FEATURES}
+
+
+def batched(spectra):
+    x_stack, y_stack = peaks.pad(spectra)
+    return peaks.find_peaks(x_stack, y_stack, max_peaks=2)
+
+
+if __name__ == '__main__':
+    for n_spectra in [int(arg) for arg in sys.argv[1:]] or [100, 1000]:
+        spectra = build_spectra(n_spectra)
+
+        start = time.perf_counter()
+        expected = one_by_one(spectra)
+        loop_time = time.perf_counter() - start
+        start = time.perf_counter()
+        result = batched(spectra)
+        batch_time = time.perf_counter() - start
+
+        for name in peaks.FEATURES:
+            assert np.allclose(result[name], expected[name],
+                               equal_nan=True), name
+        print(f'{n_spectra:>6} spectra: one by one {loop_time:7.3f} s, '
+              f'batched {batch_time:7.3f} s '
+              f'({loop_time / batch_time:.1f}x)')
@@ -0,0 +1,95 @@
+'''Benchmark session throughput against the number of pre-forked workers.
+
+For each worker count a `isadream.server.prefork` server is started, and
+concurrent clients request the app page (each request builds a new session
+document) for a fixed time, spread evenly over the worker ports. Requests
+are sent to the workers directly, as a page request needs no affinity.
+
+Needs bokeh installed.
+
+Usage::
+
+    python benchmarks/prefork_throughput.py [--app testvis] [--clients 16]
+        [--seconds 10] [workers ...]
+
+'''
+
+# Generic Python imports.
+import os
+import sys
+import time
+import signal
+import argparse
+import itertools
+import subprocess
+import urllib.request
+import concurrent.futures
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+
+from isadream.server import prefork
+
+PORT = 5106
+
+
+def wait_ready(urls, timeout=60.0):
+    deadline = time.monotonic() + timeout
+    for url in urls:
+        while True:
+            try:
+                urllib.request.urlopen(url, timeout=5).read()
+                break
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise RuntimeError(f'{url} did not start.')
+                time.sleep(0.5)
+
+
+def load(urls, clients, seconds):
+    '''Request the urls round robin from clients threads for seconds.'''
+    deadline = time.monotonic() + seconds
+    targets = itertools.cycle(urls)
+
+    def client():
+        done = 0
+        while time.monotonic() < deadline:
+            urllib.request.urlopen(next(targets), timeout=30).read()
+            done += 1
+        return done
+
+    with concurrent.futures.ThreadPoolExecutor(clients) as executor:
+        return sum(executor.map(lambda _: client(), range(clients)))
+
+
+def run(app, workers, clients, seconds):
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'isadream.server.prefork', '--workers',
+         str(workers), '--port', str(PORT), os.path.join(ROOT, app)],
+        cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        name = os.path.basename(app.rstrip('/'))
+        urls = [f'http://127.0.0.1:{port}/{name}'
+                for port in prefork.worker_ports(PORT, workers)]
+        wait_ready(urls)
+        return load(urls, clients, seconds) / seconds
+    finally:
+        process.send_signal(signal.SIGTERM)
+        process.wait()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('workers', type=int, nargs='*')
+    parser.add_argument('--app', default='testvis')
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--seconds', type=float, default=10.0)
+    args = parser.parse_args()
+
+    counts = args.workers or sorted({1, 2, 4, os.cpu_count() or 1})
+    baseline = None
+    for workers in counts:
+        rate = run(args.app, workers, args.clients, args.seconds)
+        baseline = baseline or rate
+        print(f'{workers:>3} workers: {rate:8.1f} sessions/s '
+              f'({rate / baseline:.2f}x)')
@@ -0,0 +1,79 @@
+'''Benchmark lining up many spectra on one x axis.
+
+Compares an outer join of every spectrum on x (the frame the apps would
+otherwise build) with `resample.resample`, which interpolates every
+spectrum on a common grid into one dense array, and is cached by the
+callers. A bare `np.interp` loop is timed as a reference for the cost of the
+interpolation itself, and checks the values.
+
+Usage::
+
+    python benchmarks/resampling.py [n_spectra ...]
+
+'''
+
+# Generic Python imports.
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from isadream.models import resample
+
+
+def build_spectra(n_spectra, points=2000, seed=0):
+    '''Spectra sampled at their own, irregular x values.'''
+    random = np.random.RandomState(seed)
+    spectra = list()
+    for _ in range(n_spectra):
+        x = np.sort(random.uniform(-5.0, 105.0, points))
+        spectra.append((x, np.exp(-((x - random.uniform(0, 100)) / 2) ** 2)))
+    return spectra
+
+
+def with_outer_join(spectra):
+    frame = None
+    for number, (x, y) in enumerate(spectra):
+        right = pd.DataFrame({'x': x, number: y})
+        frame = right if frame is None else frame.merge(right, on='x',
+                                                        how='outer')
+    return frame
+
+
+def with_interp(spectra, grid):
+    values = np.full((len(spectra), len(grid)), np.nan)
+    for row, (x, y) in enumerate(spectra):
+        inside = (grid >= x[0]) & (grid <= x[-1])
+        values[row, inside] = np.interp(grid[inside], x, y)
+    return values
+
+
+if __name__ == '__main__':
+    for n_spectra in [int(arg) for arg in sys.argv[1:]] or [100, 1000]:
+        spectra = build_spectra(n_spectra)
+        grid = resample.choose_grid(spectra, points=2000, bounds='union')
+
+        join_note = ''
+        if n_spectra <= 200:
+            start = time.perf_counter()
+            joined = with_outer_join(spectra)
+            join_time = time.perf_counter() - start
+            join_note = (f'outer join {join_time:7.3f} s '
+                         f'({joined.memory_usage().sum() / 2**20:.0f} MiB), ')
+
+        start = time.perf_counter()
+        expected = with_interp(spectra, grid)
+        interp_time = time.perf_counter() - start
+        start = time.perf_counter()
+        resampled = resample.resample(spectra, grid=grid)
+        batch_time = time.perf_counter() - start
+
+        assert np.allclose(resampled.values, expected, equal_nan=True)
+        print(f'{n_spectra:>6} spectra: {join_note}'
+              f'np.interp loop {interp_time:7.3f} s, '
+              f'resample {batch_time:7.3f} s '
+              f'({resampled.values.nbytes / 2**20:.0f} MiB)')
@@ -0,0 +1,95 @@
+'''Benchmark zoom window reads of a large spectrum.
+
+Compares parsing the `.csv` datafile and masking the window, as every zoom
+used to, with range reads from `spectrumstore.SpectrumStore`, which only
+touch the chunks that overlap the window. Each store read is checked against
+the masked frame.
+
+Usage::
+
+    python benchmarks/spectrum_store.py [n_rows ...]
+
+'''
+
+# Generic Python imports.
+import os
+import sys
+import time
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from isadream.models import cache
+from isadream.models import utils
+from isadream.models import spectrumstore
+
+
+def write_spectrum(path, n_rows, seed=0):
+    '''A noisy spectrum with a few peaks, in random row order.'''
+    random = np.random.RandomState(seed)
+    ppm = np.linspace(-20.0, 120.0, n_rows)
+    intensity = random.rand(n_rows)
+    for center in (10.0, 62.0, 80.0):
+        intensity += 50.0 * np.exp(-((ppm - center) / 0.5) ** 2)
+    order = random.permutation(n_rows)
+    frame = pd.DataFrame({'ppm': ppm[order], 'intensity': intensity[order]})
+    frame.to_csv(path, index=False)
+
+
+def zoom_windows(steps=200, seed=1):
+    random = np.random.RandomState(seed)
+    starts = random.uniform(-20.0, 110.0, steps)
+    return list(zip(starts, starts + random.uniform(0.1, 10.0, steps)))
+
+
+def with_csv(path, windows):
+    rows = 0
+    for start, end in windows:
+        frame = utils.load_csv(path, base_path='')
+        rows += int(frame[0].between(start, end).sum())
+    return rows
+
+
+def with_store(spectrum, windows):
+    rows = 0
+    for start, end in windows:
+        rows += len(spectrum.read(start, end)[0])
+    return rows
+
+
+def check(spectrum, path, windows):
+    frame = utils.load_csv(path, base_path='')
+    for start, end in windows:
+        expected = np.sort(frame[0][frame[0].between(start, end)].to_numpy())
+        assert np.array_equal(spectrum.read(start, end)[0], expected), \
+            (start, end)
+
+
+if __name__ == '__main__':
+    folder = tempfile.mkdtemp()
+    store = spectrumstore.SpectrumStore(os.path.join(folder, 'store'))
+    for n_rows in [int(arg) for arg in sys.argv[1:]] or [100000, 2000000]:
+        path = os.path.join(folder, f'spectrum_{n_rows}.csv')
+        write_spectrum(path, n_rows)
+        windows = zoom_windows()
+
+        start = time.perf_counter()
+        spectrum = store.open(path)
+        build = time.perf_counter() - start
+        check(spectrum, path, windows[:20])
+        cache.CSV_CACHE.clear()
+
+        start = time.perf_counter()
+        csv_rows = with_csv(path, windows[:5])
+        csv_time = (time.perf_counter() - start) / 5
+        start = time.perf_counter()
+        with_store(spectrum, windows)
+        store_time = (time.perf_counter() - start) / len(windows)
+
+        print(f'{n_rows:>9} rows: build {build:7.3f} s, '
+              f'csv {csv_time * 1e3:9.3f} ms/read, '
+              f'store {store_time * 1e3:7.3f} ms/read '
+              f'({csv_time / store_time:,.0f}x)')
@@ -0,0 +1,235 @@
+'''Load test a Bokeh app with simulated browser sessions over websockets.
+
+Starts `bokeh serve` for one app on localhost, with a temporary data mount
+holding a copy of the demo node in one `J` folder per simulated user. For
+each concurrency level, that many users connect at once through the Bokeh
+client (the same websocket protocol a browser uses) and each:
+
+    1. opens a session with its own `J` argument, timing the document
+       creation,
+    2. changes a randomly chosen selector, or taps a random point, a number
+       of times, timing each round trip until the server has run the
+       callback and sent its changes back, and
+    3. closes the session.
+
+The resident memory of the server is sampled while the sessions are open.
+Everything runs on localhost. Needs bokeh installed.
+
+Usage::
+
+    python benchmarks/websocket_load.py [--app testvis] [--actions 20]
+        [concurrency ...]
+
+'''
+
+# Generic Python imports.
+import os
+import sys
+import time
+import random
+import shutil
+import socket
+import argparse
+import tempfile
+import threading
+import subprocess
+import concurrent.futures
+
+import numpy as np
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+DEMO_JSON = os.path.join(ROOT, 'isadream', 'demo_data', 'demo_json',
+                         'sipos_2006_talanta_nmr_figs.json')
+DEMO_CSV = os.path.join(ROOT, 'isadream', 'demo_data')
+
+
+def free_port():
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        return probe.getsockname()[1]
+
+
+def make_folders(data_mount, count, prefix='load'):
+    '''One session folder per user, each with a copy of the demo node.'''
+    folders = list()
+    for index in range(count):
+        folder = f'{prefix}-{index}'
+        path = os.path.join(data_mount, folder)
+        os.makedirs(path, exist_ok=True)
+        shutil.copy(DEMO_JSON, path)
+        for name in os.listdir(DEMO_CSV):
+            if name.endswith('.csv'):
+                shutil.copy(os.path.join(DEMO_CSV, name), path)
+        folders.append(folder)
+    return folders
+
+
+def resident_bytes(pid):
+    '''Resident memory of a process and its children, from /proc.'''
+    total = 0
+    pids = [pid]
+    try:
+        with open(f'/proc/{pid}/task/{pid}/children') as children:
+            pids += [int(child) for child in children.read().split()]
+    except OSError:
+        pass
+    for process in pids:
+        try:
+            with open(f'/proc/{process}/status') as status:
+                for line in status:
+                    if line.startswith('VmRSS:'):
+                        total += int(line.split()[1]) * 1024
+        except OSError:
+            pass
+    return total
+
+
+class MemorySampler(threading.Thread):
+    '''Record the peak resident memory of a process until stopped.'''
+
+    def __init__(self, pid, interval=0.1):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.peak = 0
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            self.peak = max(self.peak, resident_bytes(self.pid))
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+        return self.peak
+
+
+def start_server(app, port, data_mount):
+    env = dict(os.environ, IDREAM_DATA_MOUNT=data_mount,
+               IDREAM_METRICS_PORT=str(free_port()),
+               PYTHONPATH=ROOT)
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'bokeh', 'serve', '--port', str(port),
+         '--address', '127.0.0.1',
+         '--allow-websocket-origin', f'127.0.0.1:{port}',
+         '--allow-websocket-origin', f'localhost:{port}',
+         os.path.join(ROOT, app)],
+        cwd=data_mount, env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return process
+        except OSError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError('The Bokeh server did not start.')
+
+
+def tap(document, rng):
+    '''Select one point of a non-empty data source, as a tap would.'''
+    from bokeh.models import ColumnDataSource
+    sources = [source for source in document.select({'type': ColumnDataSource})
+               if source.data and len(next(iter(source.data.values())))]
+    if not sources:
+        return False
+    source = rng.choice(sources)
+    index = rng.randrange(len(next(iter(source.data.values()))))
+    selected = source.selected
+    if hasattr(selected, 'indices'):
+        selected.indices = [index]
+    else:
+        # Older Bokeh releases hold the selection in a dictionary.
+        source.selected = {'0d': {'glyph': None, 'indices': []},
+                           '1d': {'indices': [index]}, '2d': {}}
+    return True
+
+
+def change_selector(document, rng):
+    '''Pick another option of a randomly chosen selector.'''
+    from bokeh.models import Select
+    selects = [select for select in document.select({'type': Select})
+               if len(select.options) > 1]
+    if not selects:
+        return False
+    select = rng.choice(selects)
+    options = [option for option in select.options if option != select.value]
+    select.value = rng.choice(options)
+    return True
+
+
+def simulate_user(url, folder, actions, seed):
+    '''Run one session, returning its creation and round trip latencies.'''
+    from bokeh.client import pull_session
+
+    rng = random.Random(seed)
+    start = time.perf_counter()
+    session = pull_session(url=url, arguments=dict(J=folder))
+    created = time.perf_counter() - start
+
+    round_trips = list()
+    try:
+        for _ in range(actions):
+            action = rng.choice((change_selector, tap))
+            start = time.perf_counter()
+            if not action(session.document, rng):
+                continue
+            # Returns once the server answered, after the callback changes.
+            session.force_roundtrip()
+            round_trips.append(time.perf_counter() - start)
+    finally:
+        session.close()
+    return created, round_trips
+
+
+def run_level(url, folders, actions, server_pid):
+    sampler = MemorySampler(server_pid)
+    sampler.start()
+    with concurrent.futures.ThreadPoolExecutor(len(folders)) as executor:
+        results = list(executor.map(
+            lambda args: simulate_user(url, args[1], actions, args[0]),
+            enumerate(folders)))
+    peak = sampler.stop()
+    created = np.array([result[0] for result in results])
+    round_trips = np.array([value for result in results
+                            for value in result[1]])
+    return created, round_trips, peak
+
+
+def percentiles(values, points=(50, 95, 99)):
+    if not len(values):
+        return [float('nan')] * len(points)
+    return list(np.percentile(values, points) * 1e3)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('concurrency', type=int, nargs='*')
+    parser.add_argument('--app', default='testvis')
+    parser.add_argument('--actions', type=int, default=20,
+                        help='Actions per simulated user.')
+    args = parser.parse_args()
+    levels = args.concurrency or [1, 5, 10, 25, 50]
+
+    data_mount = tempfile.mkdtemp(prefix='isadream-load-')
+    port = free_port()
+    server = start_server(args.app, port, data_mount)
+    url = f'http://127.0.0.1:{port}/{os.path.basename(args.app.rstrip("/"))}'
+    try:
+        print(f'{"users":>6} {"create p50":>11} {"p95":>8} '
+              f'{"callback p50":>13} {"p95":>8} {"p99":>8} {"rss MB":>8}')
+        for level in levels:
+            # Fresh folders, those of the last level are deleted on release.
+            folders = make_folders(data_mount, level, prefix=f'load{level}')
+            created, round_trips, peak = run_level(
+                url, folders, args.actions, server.pid)
+            create_p50, create_p95 = percentiles(created, (50, 95))
+            p50, p95, p99 = percentiles(round_trips)
+            print(f'{level:>6} {create_p50:>9.1f}ms {create_p95:>6.1f}ms '
+                  f'{p50:>11.1f}ms {p95:>6.1f}ms {p99:>6.1f}ms '
+                  f'{peak / 2**20:>8.1f}')
+    finally:
+        server.terminate()
+        server.wait()
+        shutil.rmtree(data_mount, ignore_errors=True)
@@ -1,12 +1,35 @@
 #!/usr/bin/env bash
-bokeh serve\
-  --port 5006\
-  --use-xheaders\
-  --address 0.0.0.0\
+ORIGINS="\
   --allow-websocket-origin=130.20.47.245:8123\
   --allow-websocket-origin 127.0.0.1:5006\
   --allow-websocket-origin localhost:8123\
   --allow-websocket-origin idreamvisualization.pnl.gov\
-  --allow-websocket-origin lampdev02.pnl.gov:8123\
+  --allow-websocket-origin lampdev02.pnl.gov:8123"
+
+if [ "${IDREAM_WORKERS:-1}" -gt 1 ]; then
+  # Pre-forked workers behind nginx, which keeps each client on one worker.
+  python -c "from isadream.server import prefork;\
+print(prefork.nginx_config(5006, ${IDREAM_WORKERS}))"\
+    > /etc/nginx/conf.d/isadream.conf
+  python -m isadream.server.prefork\
+    --workers "${IDREAM_WORKERS}"\
+    --port 5006\
+    --use-xheaders\
+    ${ORIGINS}\
+    /bokehtest\
+    /testvis\
+    /linkeddualvis &
+  rm -f /etc/nginx/sites-enabled/default
+  nginx -g 'daemon off;' &
+  wait -n
+  exit $?
+fi
+
+bokeh serve\
+  --port 5006\
+  --use-xheaders\
+  --address 0.0.0.0\
+  ${ORIGINS}\
   /bokehtest\
   /testvis\
+  /linkeddualvis\
@@ -21,12 +21,15 @@ AJAX and Bokeh Examples  https://stackoverflow.com/a/38871646
 # General Python imports.
 import os
 import glob
-import json
 import shutil
 
 # Data Science imports.
 import pandas as pd
 
+# isaDream imports.
+from isadream.models import cache
+from isadream.models import merge
+
 
 def get_formatted_session_context(curdoc, endpoint_args='J'):
     """Returns the current session context of the given endpoint in UTF-8
@@ -69,10 +72,10 @@ def find_json_files(path, data_mount):
     json_dicts = list()
 
     # Searth the constructed path for .json files, read those found and
-    # append the contents as a dictionary to the json_dicts list.
+    # append the contents as a dictionary to the json_dicts list. Files
+    # with identical contents are parsed once and shared between sessions.
     for jstr in glob.glob(f"{full_path}/*.json"):
-        with open(jstr, 'r') as curr_jstr:
-            json_dicts.append(json.load(curr_jstr))
+        json_dicts.append(cache.load_json(jstr))
 
     return json_dicts
 
@@ -87,6 +90,7 @@ def construct_dataframes(data_dicts):
     """
     metadata_dict = dict()
     df_list = list()
+    constants_list = list()
 
     for curr_dict in data_dicts:
 
@@ -100,19 +104,17 @@ def construct_dataframes(data_dicts):
         # Build the pandas dataframe.
         new_df = pd.read_csv(curr_datafile)
 
-        # Add a label column to track the associated metadata.
-        new_df['metadata_key'] = curr_id
-
-        # Iterate through the factor values and add them to the dataframe.
-        study_factors = curr_dict.get("study_factors")
-        for factor_name in study_factors:
-            val = curr_dict["study_factors"][factor_name]
-            new_df[factor_name] = val
+        # Add a label column to track the associated metadata, and the
+        # factor values as constant columns. These are filled in by the
+        # merge below rather than added to each small dataframe.
+        constants = dict(curr_dict.get("study_factors"))
+        constants['metadata_key'] = curr_id
 
         df_list.append(new_df)
+        constants_list.append(constants)
 
-    # Concatentate the dataframes generated.
-    data_frame = pd.concat(df_list, ignore_index=True)
+    # Merge the dataframes generated into one contiguous block.
+    data_frame = merge.merge_frames(df_list, constants_list).to_frame()
 
     # Return the dataframe and metadata dictionary.
     return metadata_dict, data_frame
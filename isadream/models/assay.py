@@ -2,12 +2,16 @@
 
 
 '''
-
 # Data science imports.
-import pandas as pd
+from .lazy import lazy_import
+
+pd = lazy_import('pandas')
 
 
 from . import utils
+from . import cache
+from . import profiling
+from . import spectrumstore
 
 from .factor import Factor
 from .sample import Sample
@@ -27,9 +31,15 @@ class Assay:
 
     '''
 
-    def __init__(self, assay_data, samples, factors, comments):
+    def __init__(self, assay_data, samples, factors, comments,
+                 base_path=utils.BASE_PATH):
         '''initialization for an Assay instance.
 
+        Args:
+            base_path (str): The folder the datafile is looked for in first,
+                usually the folder of the parent node's `.json` file, see
+                `utils.data_file_path`.
+
         '''
         self._assay_data = assay_data
         self._parent_samples = samples
@@ -37,6 +47,46 @@ class Assay:
         self._parent_comments = comments
 
         self.data_file = self._assay_data.get('dataFile')
+        if isinstance(self.data_file, pd.Series):
+            # A normalized assay frame repeats the file name on every row.
+            self.data_file = next(iter(self.data_file.dropna()), None)
+        self.base_path = base_path
+
+    @property
+    def data_path(self):
+        '''The full path of the datafile, or None if there is none.'''
+        if self.data_file is None:
+            return None
+        return utils.data_file_path(self.data_file, self.base_path)
+
+    @property
+    def data(self):
+        '''The datafile of this assay as a pandas dataframe.
+
+        The file is only read the first time any assay asks for it. Frames are
+        held by the process wide `cache.CSV_CACHE`, which evicts the
+        least-recently used frames once over its memory budget, so no
+        reference is kept here. The frame is shared and must not be modified.
+
+        '''
+        if self.data_file is None:
+            return None
+        return cache.read_csv(self.data_path, skiprows=1, header=None)
+
+    def spectrum(self, x=0):
+        '''The datafile of this assay from the binary spectrum store.
+
+        Converted once per datafile contents, see
+        `isadream.models.spectrumstore`. Ranges of x values can then be
+        read without parsing the whole file.
+
+        Args:
+            x (int): The position of the column to sort and read ranges on.
+
+        '''
+        if self.data_file is None:
+            return None
+        return spectrumstore.open_spectrum(self.data_path, x)
 
     @property
     def sample_groups(self):
@@ -44,10 +94,12 @@ class Assay:
         '''
         _sample_groups = self._assay_data.copy()
         _sample_groups = _sample_groups.set_index('samples.name').T
-        _sample_groups = utils.split_index(_sample_groups, 'index').T
+        with profiling.stage('assay.split_index'):
+            _sample_groups = utils.split_index(_sample_groups, 'index').T
         _sample_groups.columns = pd.MultiIndex.from_tuples(_sample_groups.columns)
-        _sample_groups = _sample_groups.groupby(level=0)
-        _sample_groups = [data for _, data in _sample_groups]
+        with profiling.stage('assay.groupby'):
+            _sample_groups = _sample_groups.groupby(level=0)
+            _sample_groups = [data for _, data in _sample_groups]
 
         return _sample_groups
 
@@ -0,0 +1,286 @@
+'''Content addressed cache for node and datafile contents.
+
+Drupal writes a new session folder for every visualization request, and most
+of those folders hold byte-identical copies of the same `.json` and `.csv`
+files. Files loaded through this module are keyed by a hash of their
+contents, so a file is parsed and held in memory once, however many session
+folders hold a copy of it.
+
+Values returned from the cache are shared between every caller and must be
+treated as read-only. Copy a frame before adding columns to it.
+
+Attributes:
+    CONTENT_CACHE (ContentCache): The process wide cache used by
+        `load_json`.
+    CSV_CACHE (ContentCache): The process wide cache used by `read_csv`.
+        Parsed frames are evicted, least-recently used first, once they hold
+        more than `IDREAM_CSV_CACHE_MB` megabytes (512 by default).
+
+'''
+
+# Generic Python imports.
+import io
+import os
+import hashlib
+import threading
+import collections
+
+# Data science imports.
+from .lazy import lazy_import
+
+pd = lazy_import('pandas')
+
+# Local imports.
+from . import jsonparse
+
+
+def hash_bytes(data):
+    '''The content address used for a blob of file data.'''
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def frame_size(data_frame):
+    '''The memory held by a pandas dataframe, in bytes.'''
+    return int(data_frame.memory_usage(deep=True).sum())
+
+
+class _Entry:
+    '''A parsed value, and any objects derived from it.'''
+
+    __slots__ = ('value', 'file_size', 'size', 'derived')
+
+    def __init__(self, value, file_size, size):
+        self.value = value
+        self.file_size = file_size
+        self.size = size
+        self.derived = dict()
+
+
+class ContentCache:
+    '''A least-recently used cache of parsed files keyed by content hash.
+
+    Hashes are memoized per path by `(mtime, size)`, so an unchanged file is
+    only read from disk the first time it is seen.
+
+    '''
+
+    def __init__(self, max_entries=256, max_bytes=None, sizeof=None):
+        '''
+
+        Args:
+            max_entries (int): The number of parsed values to keep.
+            max_bytes (int): The memory budget of the parsed values, or None
+                to bound the cache by `max_entries` only.
+            sizeof (callable): Returns the memory held by a parsed value.
+                Defaults to the size of the file it was parsed from.
+
+        '''
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self._entries = collections.OrderedDict()
+        self._digests = collections.OrderedDict()
+        self._lock = threading.RLock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bytes_read = 0
+        self.bytes_shared = 0
+        self.bytes_cached = 0
+
+    def _remember_digest(self, path, stamp, digest):
+        self._digests[path] = (stamp, digest)
+        self._digests.move_to_end(path)
+        while len(self._digests) > 4 * self.max_entries:
+            self._digests.popitem(last=False)
+
+    def content_hash(self, path):
+        '''Return the content hash of a file, reading it only if it changed.
+
+        '''
+        return self._hash_and_read(path)[0]
+
+    def _hash_and_read(self, path):
+        stat = os.stat(path)
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            known = self._digests.get(path)
+        if known is not None and known[0] == stamp:
+            return known[1], None
+
+        with open(path, 'rb') as data_file:
+            data = data_file.read()
+        digest = hash_bytes(data)
+        with self._lock:
+            self.bytes_read += len(data)
+            self._remember_digest(path, stamp, digest)
+        return digest, data
+
+    def load(self, path, parser, kind):
+        '''Return the parsed contents of a file.
+
+        Args:
+            path (str): The file to load.
+            parser (callable): Converts the raw bytes to the cached value.
+            kind (hashable): Distinguishes different parsers (or parser
+                arguments) applied to the same content.
+
+        '''
+        return self.load_entry(path, parser, kind)[1]
+
+    def load_entry(self, path, parser, kind):
+        '''Like `load`, but also return the content hash of the bytes the
+        value was parsed from, under which objects are `derive`d from it.
+
+        Returns:
+            tuple: The digest and the parsed value.
+
+        '''
+        digest, data = self._hash_and_read(path)
+        key = (digest, kind)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                self.bytes_shared += entry.file_size
+                return digest, entry.value
+
+        if data is None:
+            # The file may have changed since it was hashed, key the value
+            # by the bytes actually parsed.
+            with open(path, 'rb') as data_file:
+                data = data_file.read()
+            digest = hash_bytes(data)
+            key = (digest, kind)
+
+        value = parser(data)
+        size = len(data) if self.sizeof is None else self.sizeof(value)
+        with self._lock:
+            # Another thread may have parsed the same content meanwhile.
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = _Entry(value, len(data), size)
+                self._entries[key] = entry
+                self.bytes_cached += size
+                self.misses += 1
+                self._evict()
+            else:
+                self.hits += 1
+                self.bytes_shared += entry.file_size
+            return digest, entry.value
+
+    def _evict(self):
+        '''Drop least-recently used entries until within the bounds.
+
+        The most recent entry is always kept, even if it alone is over the
+        memory budget.
+
+        '''
+        while len(self._entries) > 1 and (
+                len(self._entries) > self.max_entries
+                or (self.max_bytes is not None
+                    and self.bytes_cached > self.max_bytes)):
+            _, entry = self._entries.popitem(last=False)
+            self.bytes_cached -= entry.size
+            self.evictions += 1
+
+    def derive(self, digest, kind, name, factory):
+        '''Return an object derived from a cached file, building it once.
+
+        Derived objects are stored alongside the parsed value they came from
+        and are evicted with it.
+
+        Args:
+            digest (str): The content hash of the parsed source, as returned
+                by `load_entry`. The file is not hashed again, it may have
+                changed since. None builds the object without caching it.
+            kind (hashable): The kind the source was loaded as.
+            name (hashable): Identifies the derived object.
+            factory (callable): Builds the derived object when missing.
+
+        '''
+        key = (digest, kind)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and name in entry.derived:
+                return entry.derived[name]
+
+        value = factory()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value = entry.derived.setdefault(name, value)
+        return value
+
+    def stats(self):
+        '''Hit rates and sizes, to gauge how much duplication is present.'''
+        with self._lock:
+            lookups = self.hits + self.misses
+            return dict(
+                entries=len(self._entries),
+                hits=self.hits,
+                misses=self.misses,
+                evictions=self.evictions,
+                hit_rate=self.hits / lookups if lookups else 0.0,
+                bytes_read=self.bytes_read,
+                bytes_shared=self.bytes_shared,
+                bytes_cached=self.bytes_cached,
+                max_bytes=self.max_bytes,
+            )
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._digests.clear()
+            self.hits = self.misses = self.evictions = 0
+            self.bytes_read = self.bytes_shared = self.bytes_cached = 0
+
+
+CONTENT_CACHE = ContentCache()
+
+CSV_CACHE = ContentCache(
+    max_entries=4096,
+    max_bytes=int(float(os.environ.get('IDREAM_CSV_CACHE_MB', 512)) * 2**20),
+    sizeof=frame_size)
+
+
+def json_kind():
+    '''The cache kind of `.json` documents under the current parser mode.'''
+    return ('json', jsonparse.get_backend()[1])
+
+
+def load_json(path, cache=CONTENT_CACHE):
+    '''Load a `.json` file through the content cache.
+
+    The document is parsed with the backend selected in
+    `isadream.models.jsonparse`, and may be a lazily parsed mapping.
+
+    '''
+    return cache.load(path, jsonparse.load_document, json_kind())
+
+
+def load_json_entry(path, cache=CONTENT_CACHE):
+    '''Like `load_json`, but also return the content hash of the document,
+    the key to `derive` objects from it with.'''
+    return cache.load_entry(path, jsonparse.load_document, json_kind())
+
+
+def read_csv(path, cache=CSV_CACHE, **read_csv_kwargs):
+    '''Read a `.csv` file through the content cache.
+
+    Args:
+        path (str): The `.csv` file.
+        cache (ContentCache): The cache to use.
+        **read_csv_kwargs: Passed to `pd.read_csv`.
+
+    Returns:
+        DataFrame: A shared, read-only, pandas dataframe.
+
+    '''
+    kind = ('csv', repr(sorted(read_csv_kwargs.items())))
+    return cache.load(
+        path, lambda data: pd.read_csv(io.BytesIO(data), **read_csv_kwargs),
+        kind)
@@ -0,0 +1,370 @@
+'''A persistent SQLite catalog of node metadata.
+
+Listing titles, experiment subtypes or release dates used to mean opening
+every `.json` file below the data mount. The catalog stores that metadata,
+along with the assays, samples, species and factors of every node (as read
+from the same parsed document a `DrupalNode` uses), in indexed SQLite
+tables. It is brought up to date incrementally: only files whose
+modification time or size changed since the last update are parsed.
+
+Queries never touch the `.json` files::
+
+    from isadream.models.catalog import Catalog
+
+    catalog = Catalog()
+    catalog.update(utils.DATA_MOUNT)
+    catalog.nodes(experiment_subtype='Al_NMR')
+
+Attributes:
+    CATALOG_PATH (str): The default database file, from the
+        `IDREAM_CATALOG_PATH` environment variable.
+
+'''
+
+# Generic Python imports.
+import os
+import sqlite3
+import logging
+import tempfile
+import threading
+
+# Local imports.
+from . import utils
+from . import cache
+
+logger = logging.getLogger(__name__)
+
+CATALOG_PATH = os.environ.get(
+    'IDREAM_CATALOG_PATH',
+    os.path.join(tempfile.gettempdir(), 'isadream_catalog.sqlite'))
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS nodes (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    folder TEXT NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    title TEXT,
+    description TEXT,
+    experiment_subtype TEXT,
+    submission_date TEXT,
+    public_release_date TEXT
+);
+CREATE INDEX IF NOT EXISTS nodes_subtype ON nodes (experiment_subtype);
+CREATE INDEX IF NOT EXISTS nodes_folder ON nodes (folder);
+CREATE INDEX IF NOT EXISTS nodes_release ON nodes (public_release_date);
+
+CREATE TABLE IF NOT EXISTS assays (
+    node_id INTEGER NOT NULL REFERENCES nodes (id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    data_file TEXT,
+    PRIMARY KEY (node_id, position)
+);
+CREATE INDEX IF NOT EXISTS assays_data_file ON assays (data_file);
+
+CREATE TABLE IF NOT EXISTS samples (
+    id INTEGER PRIMARY KEY,
+    node_id INTEGER NOT NULL REFERENCES nodes (id) ON DELETE CASCADE,
+    assay_position INTEGER,
+    name TEXT
+);
+CREATE INDEX IF NOT EXISTS samples_node ON samples (node_id);
+CREATE INDEX IF NOT EXISTS samples_name ON samples (name);
+
+CREATE TABLE IF NOT EXISTS species (
+    node_id INTEGER NOT NULL REFERENCES nodes (id) ON DELETE CASCADE,
+    sample_id INTEGER REFERENCES samples (id) ON DELETE CASCADE,
+    source_name TEXT,
+    reference TEXT,
+    stoichiometry REAL
+);
+CREATE INDEX IF NOT EXISTS species_reference ON species (reference);
+CREATE INDEX IF NOT EXISTS species_node ON species (node_id);
+
+CREATE TABLE IF NOT EXISTS factors (
+    node_id INTEGER NOT NULL REFERENCES nodes (id) ON DELETE CASCADE,
+    assay_position INTEGER,
+    sample_id INTEGER REFERENCES samples (id) ON DELETE CASCADE,
+    scope TEXT NOT NULL,
+    factor_type TEXT,
+    unit_ref TEXT,
+    decimal_value REAL,
+    string_value TEXT,
+    ref_value TEXT,
+    csv_column_index INTEGER
+);
+CREATE INDEX IF NOT EXISTS factors_type ON factors (factor_type, unit_ref);
+CREATE INDEX IF NOT EXISTS factors_node ON factors (node_id);
+'''
+
+# The json field names of each factor scope within a sample or source.
+_SAMPLE_FACTORS = ('studySampleFactors', 'AssaySampleFactors')
+_SOURCE_FACTORS = ('materialCharacteristic',)
+
+
+def _csv_index(factor):
+    '''The csvColumnIndex of a factor, None if missing or not an index.'''
+    csv_index = factor.get('csvColumnIndex')
+    if csv_index is None:
+        return None
+    try:
+        csv_index = int(csv_index)
+    except (TypeError, ValueError):
+        csv_index = -1
+    if csv_index < 0:
+        logger.warning('Ignoring the csvColumnIndex %r of factor %r.',
+                       factor.get('csvColumnIndex'), factor.get('factorType'))
+        return None
+    return csv_index
+
+
+def _factor_row(node_id, scope, factor, assay_position=None, sample_id=None):
+    return (node_id, assay_position, sample_id, scope,
+            factor.get('factorType'), factor.get('unitRef'),
+            factor.get('decimalValue'), factor.get('stringValue'),
+            factor.get('RefValue'), _csv_index(factor))
+
+
+class Catalog:
+    '''A SQLite catalog of the nodes below one or more data folders.
+
+    The connection is shared between threads and guarded by a lock, so a
+    catalog can be updated from the data watcher thread while sessions
+    query it.
+
+    '''
+
+    def __init__(self, db_path=CATALOG_PATH):
+        self.db_path = db_path
+        self._lock = threading.RLock()
+        self._connection = sqlite3.connect(db_path, check_same_thread=False)
+        self._connection.row_factory = sqlite3.Row
+        with self._lock, self._connection:
+            self._connection.execute('PRAGMA foreign_keys = ON')
+            self._connection.execute('PRAGMA journal_mode = WAL')
+            self._connection.executescript(_SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    # Updating ---------------------------------------------------------------
+
+    def update(self, root=utils.DATA_MOUNT):
+        '''Bring the catalog up to date with the `.json` files below root.
+
+        Only new files, and files whose modification time or size changed,
+        are parsed.
+
+        Returns:
+            dict: The number of `added`, `updated`, `removed` and `unchanged`
+                nodes.
+
+        '''
+        prefix = os.path.join(os.path.abspath(root), '')
+        with self._lock:
+            known = {row['path']: (row['mtime_ns'], row['size'])
+                     for row in self._connection.execute(
+                         'SELECT path, mtime_ns, size FROM nodes '
+                         'WHERE substr(path, 1, ?) = ?',
+                         (len(prefix), prefix))}
+
+        counts = dict(added=0, updated=0, removed=0, unchanged=0)
+        seen = set()
+        for dirpath, _, filenames in os.walk(prefix):
+            for name in filenames:
+                if not name.endswith('.json'):
+                    continue
+                path = os.path.join(dirpath, name)
+                seen.add(path)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                if known.get(path) == (stat.st_mtime_ns, stat.st_size):
+                    counts['unchanged'] += 1
+                elif self.update_node(path, stat):
+                    counts['updated' if path in known else 'added'] += 1
+
+        for path in set(known) - seen:
+            self.remove_node(path)
+            counts['removed'] += 1
+        return counts
+
+    def update_node(self, path, stat=None):
+        '''(Re)index a single node file.
+
+        Returns:
+            bool: False if the node could not be read.
+
+        '''
+        stat = stat or os.stat(path)
+        try:
+            # The same shared document a `DrupalNode` of this file uses.
+            document = cache.load_json(path)
+        except (OSError, ValueError, KeyError, TypeError) as error:
+            logger.warning('Could not catalog node %s: %s', path, error)
+            return False
+
+        try:
+            info = document.get('nodeInformation') or dict()
+            with self._lock, self._connection as connection:
+                connection.execute('DELETE FROM nodes WHERE path = ?', (path,))
+                node_id = connection.execute(
+                    'INSERT INTO nodes (path, folder, mtime_ns, size, title, '
+                    'description, experiment_subtype, submission_date, '
+                    'public_release_date) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    (path, os.path.dirname(path), stat.st_mtime_ns,
+                     stat.st_size, info.get('title'), info.get('description'),
+                     info.get('experimentSubType'),
+                     info.get('submissionDate'),
+                     info.get('publicReleaseDate'))).lastrowid
+                self._insert_contents(connection, node_id, document)
+        except (AttributeError, TypeError, ValueError,
+                sqlite3.InterfaceError) as error:
+            # A malformed node, the transaction is rolled back.
+            logger.warning('Could not catalog node %s: %s', path, error)
+            return False
+        return True
+
+    def _insert_contents(self, connection, node_id, document):
+        factors = [_factor_row(node_id, 'studyFactors', factor)
+                   for factor in document.get('studyFactors') or ()]
+
+        for sample in document.get('studySamples') or ():
+            self._insert_sample(connection, node_id, sample, None, factors)
+
+        for position, assay in enumerate(document.get('assays') or ()):
+            connection.execute(
+                'INSERT INTO assays (node_id, position, data_file) '
+                'VALUES (?, ?, ?)', (node_id, position, assay.get('dataFile')))
+            factors.extend(
+                _factor_row(node_id, 'assayParameters', factor, position)
+                for factor in assay.get('assayParameters') or ())
+            for sample in assay.get('samples') or ():
+                self._insert_sample(connection, node_id, sample, position,
+                                    factors)
+
+        connection.executemany(
+            'INSERT INTO factors (node_id, assay_position, sample_id, scope, '
+            'factor_type, unit_ref, decimal_value, string_value, ref_value, '
+            'csv_column_index) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            factors)
+
+    def _insert_sample(self, connection, node_id, sample, assay_position,
+                       factors):
+        sample_id = connection.execute(
+            'INSERT INTO samples (node_id, assay_position, name) '
+            'VALUES (?, ?, ?)',
+            (node_id, assay_position,
+             sample.get('sampleName') or sample.get('name'))).lastrowid
+
+        species = [(node_id, sample_id, None, entry.get('speciesReference'),
+                    entry.get('stoichiometry'))
+                   for entry in sample.get('species') or ()]
+        for scope in _SAMPLE_FACTORS:
+            factors.extend(
+                _factor_row(node_id, scope, factor, assay_position, sample_id)
+                for factor in sample.get(scope) or ())
+
+        for source in sample.get('sources') or ():
+            source_name = source.get('sourceName')
+            species.extend(
+                (node_id, sample_id, source_name,
+                 entry.get('speciesReference'), entry.get('stoichiometry'))
+                for entry in source.get('species') or ())
+            for scope in _SOURCE_FACTORS:
+                factors.extend(
+                    _factor_row(node_id, scope, factor, assay_position,
+                                sample_id)
+                    for factor in source.get(scope) or ())
+
+        connection.executemany(
+            'INSERT INTO species (node_id, sample_id, source_name, reference, '
+            'stoichiometry) VALUES (?, ?, ?, ?, ?)', species)
+
+    def remove_node(self, path):
+        '''Remove a node, and everything cataloged for it.'''
+        with self._lock, self._connection as connection:
+            connection.execute('DELETE FROM nodes WHERE path = ?', (path,))
+
+    def on_change(self, changes):
+        '''Apply a data watcher `ChangeSet` to the catalog.'''
+        for node in changes.added + changes.modified:
+            self.update_node(node.json_path)
+        for path in changes.removed:
+            self.remove_node(path)
+
+    # Querying ---------------------------------------------------------------
+
+    def query(self, sql, parameters=()):
+        '''Run a read-only SQL query, returning a list of row dictionaries.'''
+        with self._lock:
+            return [dict(row)
+                    for row in self._connection.execute(sql, parameters)]
+
+    def nodes(self, experiment_subtype=None, folder=None):
+        '''List node metadata, optionally filtered by subtype or folder.'''
+        clauses, parameters = list(), list()
+        if experiment_subtype is not None:
+            clauses.append('experiment_subtype = ?')
+            parameters.append(experiment_subtype)
+        if folder is not None:
+            clauses.append('folder = ?')
+            parameters.append(os.path.abspath(folder))
+        where = ' WHERE ' + ' AND '.join(clauses) if clauses else ''
+        return self.query(
+            'SELECT path, folder, title, description, experiment_subtype, '
+            'submission_date, public_release_date FROM nodes' + where +
+            ' ORDER BY public_release_date, path', parameters)
+
+    def experiment_subtypes(self):
+        '''The distinct experiment subtypes with their node counts.'''
+        return self.query(
+            'SELECT experiment_subtype, COUNT(*) AS nodes FROM nodes '
+            'GROUP BY experiment_subtype ORDER BY experiment_subtype')
+
+    def nodes_with_species(self, reference):
+        '''Paths of the nodes with a sample or source of a species.'''
+        return [row['path'] for row in self.query(
+            'SELECT DISTINCT nodes.path FROM species '
+            'JOIN nodes ON nodes.id = species.node_id '
+            'WHERE species.reference = ? ORDER BY nodes.path', (reference,))]
+
+    def nodes_with_factor(self, factor_type, unit_ref=None):
+        '''Paths of the nodes with a factor of the given type (and unit).'''
+        sql = ('SELECT DISTINCT nodes.path FROM factors '
+               'JOIN nodes ON nodes.id = factors.node_id '
+               'WHERE factors.factor_type = ?')
+        parameters = [factor_type]
+        if unit_ref is not None:
+            sql += ' AND factors.unit_ref = ?'
+            parameters.append(unit_ref)
+        return [row['path'] for row in self.query(sql + ' ORDER BY nodes.path',
+                                                  parameters)]
+
+
+_CATALOG = None
+
+
+def open_catalog(db_path=CATALOG_PATH, root=utils.DATA_MOUNT):
+    '''Open (once), update and return the process wide `Catalog`.'''
+    global _CATALOG
+    if _CATALOG is None:
+        _CATALOG = Catalog(db_path)
+        _CATALOG.update(root)
+    return _CATALOG
+
+
+def get_catalog():
+    '''Return the open `Catalog`, or None if it was never opened.'''
+    return _CATALOG
+
+
+def close_catalog():
+    '''Close the process wide `Catalog`, if open.'''
+    global _CATALOG
+    if _CATALOG is not None:
+        _CATALOG.close()
+        _CATALOG = None
@@ -0,0 +1,220 @@
+'''A crossfilter engine for brushing many rows interactively.
+
+Recomputing a boolean mask over the whole frame for every brush stroke
+scales with the number of rows and dimensions. `CrossFilter` instead keeps:
+
+    + for each dimension, the row order sorted by its values, so a range
+      filter is a contiguous slice of that order, and
+    + one filter bitmap per row, with a bit per dimension that is set while
+      the dimension's filter excludes the row.
+
+When a range changes only the rows between the old and new slice bounds
+have their bit for that dimension flipped, and the number of rows passing
+every filter is kept up to date as they flip. Histograms of a dimension
+count the rows passing the filters of every *other* dimension (the
+crossfilter convention, so a brushed dimension still shows its whole
+distribution), using bin numbers computed once per dimension. The counts of
+every histogram are kept up to date too: as a row's bit flips, only the
+histograms it enters or leaves are changed, by the bins of that row, so
+brushing costs time in proportion to the rows that flip, and reading the
+histograms costs nothing.
+
+::
+
+    crossfilter = CrossFilter(data_frame)
+    ppm = crossfilter.dimension('Al_ppm', bins=30)
+    hydroxide = crossfilter.dimension('OH_concentration')
+
+    hydroxide.filter_range(1.0, 5.0)
+    crossfilter.count()
+    ppm.histogram()
+
+'''
+
+# Data science imports.
+from .lazy import lazy_import
+
+np = lazy_import('numpy')
+
+_MAX_DIMENSIONS = 64
+
+
+class Dimension:
+    '''A filterable, binned column of a `CrossFilter`.'''
+
+    def __init__(self, crossfilter, name, values, bit, bins):
+        self.crossfilter = crossfilter
+        self.name = name
+        self.bit = bit
+
+        values = np.asarray(values)
+        self.order = np.argsort(values, kind='mergesort')
+        self.sorted_values = values[self.order]
+
+        # NaN values sort last and fall in the extra bin `bins`.
+        finite = values[~np.isnan(values)] if values.dtype.kind == 'f' \
+            else values
+        low, high = (finite.min(), finite.max()) if len(finite) else (0, 1)
+        self.edges = np.linspace(low, high if high > low else low + 1,
+                                 bins + 1)
+        bin_numbers = np.searchsorted(self.edges, values, side='right') - 1
+        bin_numbers = np.clip(bin_numbers, 0, bins - 1)
+        if values.dtype.kind == 'f':
+            bin_numbers[np.isnan(values)] = bins
+        self.bin_numbers = bin_numbers.astype(np.int32)
+        self.bins = bins
+
+        # The slice of `order` that passes this dimension's filter.
+        self.start, self.stop = 0, len(values)
+
+        # Counts per bin of the rows passing every other filter.
+        passing = crossfilter.mask(exclude=self)
+        self.counts = np.bincount(self.bin_numbers[passing],
+                                  minlength=bins + 1)
+
+    @property
+    def is_filtered(self):
+        return self.start > 0 or self.stop < len(self.order)
+
+    def filter_range(self, low=None, high=None):
+        '''Keep the rows with low <= value <= high, None for open bounds.'''
+        start = 0 if low is None else int(
+            np.searchsorted(self.sorted_values, low, side='left'))
+        stop = len(self.order) if high is None else int(
+            np.searchsorted(self.sorted_values, high, side='right'))
+        self._move(start, max(start, stop))
+        return self
+
+    def filter_all(self):
+        '''Remove the filter of this dimension.'''
+        self._move(0, len(self.order))
+        return self
+
+    def _move(self, start, stop):
+        '''Flip the bit of the rows entering or leaving the slice.'''
+        old_start, old_stop = self.start, self.stop
+        if stop <= old_start or start >= old_stop:
+            # Disjoint slices: every old row leaves, every new row enters.
+            leaving = [(old_start, old_stop)]
+            entering = [(start, stop)]
+        else:
+            leaving = [(old_start, start), (stop, old_stop)]
+            entering = [(start, old_start), (old_stop, stop)]
+
+        for first, last in leaving:
+            if first < last:
+                self.crossfilter._exclude(self.order[first:last], self)
+        for first, last in entering:
+            if first < last:
+                self.crossfilter._include(self.order[first:last], self)
+        self.start, self.stop = start, stop
+
+    def histogram(self):
+        '''Counts per bin of the rows passing every other dimension's filter.
+
+        Returns:
+            tuple: The counts, and the `bins + 1` bin edges.
+
+        '''
+        return self.counts[:self.bins].copy(), self.edges
+
+
+class CrossFilter:
+    '''Rows filtered by ranges over any number of dimensions.
+
+    Attributes:
+        length (int): The number of rows.
+
+    '''
+
+    def __init__(self, columns):
+        '''
+
+        Args:
+            columns (dict or DataFrame): Equal length columns, those used as
+                dimensions must be numeric.
+
+        '''
+        self.columns = columns
+        self.length = len(next(iter(columns.values()))) \
+            if isinstance(columns, dict) else len(columns)
+        self.dimensions = dict()
+        self._filters = np.zeros(self.length, dtype=np.uint64)
+        self._passing = self.length
+
+    def dimension(self, name, bins=20):
+        '''Return the `Dimension` of a column, creating it the first time.'''
+        if name in self.dimensions:
+            return self.dimensions[name]
+        if len(self.dimensions) >= _MAX_DIMENSIONS:
+            raise ValueError(f'At most {_MAX_DIMENSIONS} dimensions can be '
+                             f'filtered.')
+        values = self.columns[name]
+        values = getattr(values, 'to_numpy', lambda: values)()
+        bit = np.uint64(1) << np.uint64(len(self.dimensions))
+        dimension = Dimension(self, name, values, bit, bins)
+        self.dimensions[name] = dimension
+        return dimension
+
+    def _exclude(self, rows, dimension):
+        # The bit of dimension is clear for these rows.
+        others = self._filters[rows]
+        self._passing -= int(np.count_nonzero(others == 0))
+        self._update_counts(rows, others, dimension, -1)
+        self._filters[rows] = others | dimension.bit
+
+    def _include(self, rows, dimension):
+        others = self._filters[rows] & ~dimension.bit
+        self._filters[rows] = others
+        self._passing += int(np.count_nonzero(others == 0))
+        self._update_counts(rows, others, dimension, 1)
+
+    def _update_counts(self, rows, others, flipped, sign):
+        '''Add or remove rows from the histograms they enter or leave.
+
+        A row flipping the bit of one dimension only counts towards the
+        histogram of another dimension if no other bit is set, or only the
+        bit of that other dimension is.
+
+        Args:
+            others (ndarray): The filter bits of rows, other than the bit of
+                the flipped dimension.
+
+        '''
+        for dimension in self.dimensions.values():
+            if dimension is flipped:
+                continue
+            counted = rows[(others & ~dimension.bit) == 0]
+            if len(counted):
+                dimension.counts += sign * np.bincount(
+                    dimension.bin_numbers[counted],
+                    minlength=dimension.bins + 1)
+
+    def count(self):
+        '''The number of rows passing every filter.'''
+        return self._passing
+
+    def mask(self, exclude=None):
+        '''Boolean mask of the rows passing every filter.
+
+        Args:
+            exclude (Dimension): Ignore the filter of this dimension.
+
+        '''
+        if exclude is None:
+            return self._filters == 0
+        return (self._filters & ~exclude.bit) == 0
+
+    def indices(self):
+        '''The indices of the rows passing every filter.'''
+        return np.flatnonzero(self._filters == 0)
+
+    def histograms(self):
+        '''The `Dimension.histogram` of every dimension, by name.'''
+        return {name: dimension.histogram()
+                for name, dimension in self.dimensions.items()}
+
+    def filter_all(self):
+        '''Remove the filters of every dimension.'''
+        for dimension in self.dimensions.values():
+            dimension.filter_all()
@@ -0,0 +1,320 @@
+'''Pre-aggregated summary cubes for histogram and summary panels.
+
+A summary panel such as "mean and standard deviation of `Al_ppm` by
+hydroxide concentration, over every node" would otherwise select and scan
+the rows of every node for each request. A `SummaryCube` instead keeps, for
+each node, per group:
+
+    + the count, sum and sum of squares of the value, and its min and max,
+    + a histogram of the value over fixed bin edges.
+
+Counts, sums and histograms add up, so the totals over all nodes are kept
+current by adding a node's partials when it is ingested and subtracting
+them when it changes or is removed. Views only read the totals, never the
+rows.
+
+Groups are the distinct values of a factor, the bins of a numeric factor
+(given `by_edges`), or each species of the assay a row came from (with
+`by=SPECIES`).
+
+::
+
+    cubes = CubeSet(default_cubes())
+    cubes.update(json_paths)
+    cubes['ppm_by_hydroxide'].summary()
+
+'''
+
+# Generic Python imports.
+import logging
+import threading
+import collections
+import collections.abc
+
+# Data science imports.
+from .lazy import lazy_import
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+# Local imports.
+from . import query
+
+# Group rows by the species of the samples of their assay.
+SPECIES = 'species'
+
+logger = logging.getLogger(__name__)
+
+# Column order of the count, sum and sum of squares moments.
+_COUNT, _SUM, _SQUARES = range(3)
+
+
+class _Partial:
+    '''The aggregates of one group, within one node or over all nodes.'''
+
+    __slots__ = ('moments', 'histogram', 'low', 'high')
+
+    def __init__(self, bins):
+        self.moments = np.zeros(3)
+        self.histogram = np.zeros(bins, dtype=np.int64)
+        self.low = np.inf
+        self.high = -np.inf
+
+    def add(self, values, edges):
+        values = values[~np.isnan(values)]
+        if not len(values):
+            return
+        self.moments += (len(values), values.sum(), np.square(values).sum())
+        self.histogram += np.histogram(values, edges)[0]
+        self.low = min(self.low, values.min())
+        self.high = max(self.high, values.max())
+
+
+class SummaryCube:
+    '''Grouped moments and histograms of one value, across every node.
+
+    Attributes:
+        name (str): The cube name.
+        value (str): The factor label aggregated, see `query.factor_label`.
+        by (str): The factor label grouped by, or `SPECIES`.
+
+    '''
+
+    def __init__(self, name, value, by, value_edges, by_edges=None):
+        '''
+
+        Args:
+            value_edges (array): The histogram bin edges of the value.
+            by_edges (array): Bin edges of a numeric `by` factor. Groups are
+                then bin numbers, otherwise distinct values.
+
+        '''
+        self.name = name
+        self.value = value
+        self.by = by
+        self.value_edges = np.asarray(value_edges, dtype=np.float64)
+        self.by_edges = None if by_edges is None else np.asarray(
+            by_edges, dtype=np.float64)
+        self._nodes = dict()
+        self._totals = dict()
+        self._lock = threading.RLock()
+
+    @property
+    def bins(self):
+        return len(self.value_edges) - 1
+
+    def _group_keys(self, values):
+        if self.by_edges is None:
+            return values
+        keys = np.searchsorted(self.by_edges, values, side='right') - 1
+        # Values outside the edges are not grouped.
+        keys[(keys < 0) | (keys >= len(self.by_edges) - 1)] = -1
+        return keys
+
+    def node_partials(self, json_path):
+        '''Aggregate the rows of one node by group.'''
+        columns = [self.value] if self.by == SPECIES else [self.value, self.by]
+        block = query.select([json_path], columns=columns)
+        if self.value not in block or (self.by != SPECIES
+                                       and self.by not in block):
+            return dict()
+
+        values = np.asarray(block[self.value], dtype=np.float64)
+        if self.by == SPECIES:
+            species = {plan.data_file: plan.species
+                       for plan in query.node_plans(json_path)}
+            frame = pd.DataFrame(dict(value=values,
+                                      data_file=block['data_file']))
+            grouped = ((reference, group['value'].to_numpy())
+                       for data_file, group in frame.groupby('data_file')
+                       for reference in sorted(species.get(data_file, ())))
+        else:
+            frame = pd.DataFrame(dict(value=values,
+                                      key=self._group_keys(block[self.by])))
+            grouped = ((key, group['value'].to_numpy())
+                       for key, group in frame.groupby('key'))
+
+        partials = dict()
+        for key, group_values in grouped:
+            if self.by_edges is not None and key == -1:
+                continue
+            partial = partials.setdefault(key, _Partial(self.bins))
+            partial.add(group_values, self.value_edges)
+        return partials
+
+    def add_node(self, json_path):
+        '''Add (or replace) the aggregates of a node.'''
+        partials = self.node_partials(json_path)
+        with self._lock:
+            self._subtract(self._nodes.pop(json_path, dict()))
+            self._nodes[json_path] = partials
+            for key, partial in partials.items():
+                total = self._totals.setdefault(key, _Partial(self.bins))
+                total.moments += partial.moments
+                total.histogram += partial.histogram
+                total.low = min(total.low, partial.low)
+                total.high = max(total.high, partial.high)
+
+    def remove_node(self, json_path):
+        '''Remove the aggregates of a node.'''
+        with self._lock:
+            self._subtract(self._nodes.pop(json_path, dict()))
+
+    def _subtract(self, partials):
+        for key, partial in partials.items():
+            total = self._totals[key]
+            total.moments -= partial.moments
+            total.histogram -= partial.histogram
+            if total.moments[_COUNT] <= 0:
+                del self._totals[key]
+            elif partial.low <= total.low or partial.high >= total.high:
+                # Extremes do not subtract, take them from the other nodes.
+                total.low = min((node[key].low for node in self._nodes.values()
+                                 if key in node), default=np.inf)
+                total.high = max((node[key].high
+                                  for node in self._nodes.values()
+                                  if key in node), default=-np.inf)
+
+    def _label(self, key):
+        if self.by_edges is None:
+            return key
+        return f'{self.by_edges[key]:g} - {self.by_edges[key + 1]:g}'
+
+    def summary(self):
+        '''The count, mean, std, min and max of the value by group.
+
+        Returns:
+            DataFrame: One row per group, sorted by group.
+
+        '''
+        with self._lock:
+            keys = sorted(self._totals)
+            moments = np.array([self._totals[key].moments for key in keys]
+                               ).reshape(-1, 3)
+            extremes = [(self._totals[key].low, self._totals[key].high)
+                        for key in keys]
+        count = moments[:, _COUNT]
+        mean = moments[:, _SUM] / count
+        variance = np.maximum(moments[:, _SQUARES] / count - mean ** 2, 0)
+        # The sample standard deviation, as pandas reports it.
+        with np.errstate(divide='ignore', invalid='ignore'):
+            std = np.sqrt(variance * count / (count - 1))
+        return pd.DataFrame(collections.OrderedDict(
+            group=[self._label(key) for key in keys],
+            count=count.astype(np.int64),
+            mean=mean,
+            std=np.where(count > 1, std, np.nan),
+            min=[low for low, _ in extremes],
+            max=[high for _, high in extremes],
+        ))
+
+    def histogram(self, group=None):
+        '''Histogram of the value in one group, or in all groups.
+
+        Returns:
+            dict: `left`, `right` and `count` arrays, ready for a Bokeh
+                `ColumnDataSource` of quads.
+
+        '''
+        with self._lock:
+            if group is None:
+                counts = sum((total.histogram
+                              for total in self._totals.values()),
+                             np.zeros(self.bins, dtype=np.int64))
+            else:
+                total = self._totals.get(group)
+                counts = (np.zeros(self.bins, dtype=np.int64) if total is None
+                          else total.histogram.copy())
+        return dict(left=self.value_edges[:-1], right=self.value_edges[1:],
+                    count=counts)
+
+    def groups(self):
+        with self._lock:
+            return sorted(self._totals)
+
+
+class CubeSet(collections.abc.Mapping):
+    '''Summary cubes by name, updated together as nodes change.'''
+
+    def __init__(self, cubes):
+        self._cubes = collections.OrderedDict(
+            (cube.name, cube) for cube in cubes)
+
+    def __getitem__(self, name):
+        return self._cubes[name]
+
+    def __iter__(self):
+        return iter(self._cubes)
+
+    def __len__(self):
+        return len(self._cubes)
+
+    def update(self, json_paths):
+        '''Add (or replace) nodes in every cube.
+
+        A node that cannot be read, such as one whose `.csv` is missing, is
+        logged and left out of every cube.
+
+        '''
+        for json_path in json_paths:
+            try:
+                for cube in self._cubes.values():
+                    cube.add_node(json_path)
+            except (OSError, ValueError, KeyError, TypeError) as error:
+                logger.warning('Could not aggregate node %s: %s',
+                               json_path, error)
+                self.remove([json_path])
+
+    def remove(self, json_paths):
+        for json_path in json_paths:
+            for cube in self._cubes.values():
+                cube.remove_node(json_path)
+
+    def on_change(self, changes):
+        '''Apply a data watcher `ChangeSet` to every cube.'''
+        self.update(node.json_path
+                    for node in changes.added + changes.modified)
+        self.remove(changes.removed)
+
+
+def default_cubes():
+    '''The `Al_ppm` cubes of the aluminate views.'''
+    ppm = query.factor_label('Measurement', 'ppm')
+    ppm_edges = np.linspace(60, 90, 61)
+    return [
+        SummaryCube('ppm_by_hydroxide', ppm,
+                    query.factor_label('Measurement Condition', 'Molar'),
+                    ppm_edges, by_edges=np.arange(0, 21, 1.0)),
+        SummaryCube('ppm_by_species', ppm, SPECIES, ppm_edges),
+        SummaryCube('ppm_by_temperature', ppm,
+                    query.factor_label('Measurement Condition', 'Celsius'),
+                    ppm_edges),
+    ]
+
+
+_CUBES = None
+
+
+def open_cubes(json_paths=(), cubes=None):
+    '''Build (once) and return the process wide `CubeSet`.
+
+    Args:
+        json_paths (list[str]): The nodes aggregated at first.
+        cubes (list[SummaryCube]): Defaults to `default_cubes()`.
+
+    '''
+    global _CUBES
+    if _CUBES is None:
+        _CUBES = CubeSet(default_cubes() if cubes is None else cubes)
+        _CUBES.update(json_paths)
+    return _CUBES
+
+
+def get_cubes():
+    '''Return the `CubeSet`, or None if it was never built.'''
+    return _CUBES
+
+
+def close_cubes():
+    global _CUBES
+    _CUBES = None
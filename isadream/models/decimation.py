@@ -0,0 +1,231 @@
+'''Downsampling of dense assay traces for plotting.
+
+NMR and Raman assays may hold spectra of tens of thousands of points, far
+more than a plot a few hundred pixels wide can show. Sending every point
+costs websocket transfer and browser rendering time. The functions here
+pick a bounded number of points that keep the visual shape of a trace:
+
+    + `lttb`: Largest-Triangle-Three-Buckets. Keeps the point of each bucket
+      that forms the largest triangle with the point kept in the previous
+      bucket and the mean of the next bucket. Best for line traces.
+    + `minmax`: Keeps the lowest and highest point of each bucket, so no
+      peak or spike is ever dropped. Cheaper, and fully vectorized.
+
+Both return the sorted indices of the kept points, so every other column of
+a frame can be indexed with them too.
+
+`ZoomDecimator` keeps a Bokeh `ColumnDataSource` decimated to the visible
+x range, so zooming in shows the full resolution of the data in view::
+
+    decimator = ZoomDecimator(data_frame, 'ppm', 'intensity', n_out=2000)
+    source = ColumnDataSource(data=decimator.data())
+    decimator.attach(source, fig.x_range, curdoc())
+
+Large datafiles can be decimated straight from the binary spectrum store
+with `ZoomDecimator.from_spectrum`.
+
+'''
+
+# Data science imports.
+from .lazy import lazy_import
+
+np = lazy_import('numpy')
+
+
+def _as_array(values):
+    return np.asarray(values, dtype=np.float64)
+
+
+def lttb(x, y, n_out):
+    '''Indices of the points kept by Largest-Triangle-Three-Buckets.
+
+    The first and last points are always kept. The bucket means are
+    computed in one pass, only the choice within each bucket (which depends
+    on the previous choice) is made bucket by bucket.
+
+    Args:
+        x (array): Sorted x values.
+        y (array): The y values.
+        n_out (int): The number of points to keep, at least 3.
+
+    Returns:
+        ndarray: The sorted indices of the kept points.
+
+    '''
+    x, y = _as_array(x), _as_array(y)
+    length = len(x)
+    if n_out >= length or length < 3:
+        return np.arange(length)
+    if n_out < 3:
+        raise ValueError('LTTB needs to keep at least 3 points.')
+
+    # Bucket boundaries over the points between the first and last.
+    edges = np.linspace(1, length - 1, n_out - 1).astype(np.intp)
+    starts, stops = edges[:-1], edges[1:]
+    counts = stops - starts
+    x_means = np.add.reduceat(x[:-1], starts) / counts
+    y_means = np.add.reduceat(y[:-1], starts) / counts
+    # The mean of the bucket after the last is the last point.
+    x_next = np.append(x_means[1:], x[-1])
+    y_next = np.append(y_means[1:], y[-1])
+
+    kept = np.empty(n_out, dtype=np.intp)
+    kept[0], kept[-1] = 0, length - 1
+    previous = 0
+    for bucket, (start, stop) in enumerate(zip(starts, stops)):
+        x_a, y_a = x[previous], y[previous]
+        # Twice the triangle area, the factor does not change the argmax.
+        areas = np.abs((x_a - x_next[bucket]) * (y[start:stop] - y_a)
+                       - (x_a - x[start:stop]) * (y_next[bucket] - y_a))
+        previous = start + int(np.argmax(areas))
+        kept[bucket + 1] = previous
+    return kept
+
+
+def minmax(x, y, n_out):
+    '''Indices of the lowest and highest point of each of `n_out // 2`
+    buckets, and of the first and last points.
+
+    Args:
+        x (array): Sorted x values.
+        y (array): The y values, NaN values are never picked over numbers.
+        n_out (int): The approximate number of points to keep.
+
+    Returns:
+        ndarray: The sorted, unique indices of the kept points.
+
+    '''
+    y = _as_array(y)
+    length = len(y)
+    if n_out >= length:
+        return np.arange(length)
+
+    buckets = max(n_out // 2, 1)
+    width = -(-length // buckets)
+    buckets = -(-length // width)
+    padded = np.full(buckets * width, np.nan)
+    padded[:length] = y
+    padded = padded.reshape(buckets, width)
+    missing = np.isnan(padded)
+
+    offsets = np.arange(buckets) * width
+    lows = np.argmin(np.where(missing, np.inf, padded), axis=1) + offsets
+    highs = np.argmax(np.where(missing, -np.inf, padded), axis=1) + offsets
+    kept = np.concatenate(([0, length - 1], lows, highs))
+    return np.unique(kept[kept < length])
+
+
+METHODS = dict(lttb=lttb, minmax=minmax)
+
+
+def decimate(x, y, n_out, method='lttb'):
+    '''Indices of at most about `n_out` points keeping the shape of (x, y).
+
+    Args:
+        method (str): `'lttb'` or `'minmax'`.
+
+    '''
+    try:
+        function = METHODS[method]
+    except KeyError:
+        raise ValueError(f'Unknown decimation method {method!r}, choose '
+                         f'from {sorted(METHODS)}.') from None
+    return function(x, y, n_out)
+
+
+def decimate_frame(data_frame, x, y, n_out, method='lttb'):
+    '''The rows of a dataframe, sorted by column x, decimated on (x, y).'''
+    data_frame = data_frame.sort_values(x, kind='mergesort')
+    indices = decimate(data_frame[x].to_numpy(), data_frame[y].to_numpy(),
+                       n_out, method)
+    return data_frame.iloc[indices]
+
+
+class ZoomDecimator:
+    '''Decimate a trace to the visible x range of a plot.
+
+    The full resolution columns are kept here, sorted by x. Each time the
+    x range changes the visible window (and one point either side, so lines
+    reach the plot edges) is decimated again to `n_out` points.
+
+    '''
+
+    def __init__(self, columns, x, y, n_out=2000, method='lttb',
+                 delay=100, presorted=False):
+        '''
+
+        Args:
+            columns (dict or DataFrame): Equal length columns of the trace.
+            x (str): The x column.
+            y (str): The y column, the one the shape is kept for.
+            n_out (int): The number of points sent to the browser.
+            method (str): `'lttb'` or `'minmax'`.
+            delay (int): Milliseconds of quiet before a range change
+                triggers decimation, so a drag decimates once.
+            presorted (bool): The columns are already sorted on x, and are
+                used without copying.
+
+        '''
+        if presorted:
+            self.columns = {name: columns[name] for name in columns}
+        else:
+            x_values = _as_array(columns[x])
+            order = np.argsort(x_values, kind='mergesort')
+            self.columns = {name: np.asarray(columns[name])[order]
+                            for name in columns}
+        self.x, self.y = x, y
+        self.n_out = n_out
+        self.method = method
+        self.delay = delay
+        self._pending = False
+
+    @classmethod
+    def from_spectrum(cls, spectrum, y, **kwargs):
+        '''Decimate a `spectrumstore.Spectrum`.
+
+        Its memory-mapped columns are sorted on x already, so only the
+        pages of the visible window are read from disk.
+
+        '''
+        columns = {name: spectrum[name] for name in spectrum.columns}
+        return cls(columns, spectrum.x, y, presorted=True, **kwargs)
+
+    def window(self, start=None, end=None):
+        '''The slice of the sorted columns visible between start and end.
+
+        Either order is accepted, a reversed axis (as NMR chemical shift is
+        usually drawn) has a start greater than its end.
+
+        '''
+        if start is not None and end is not None and start > end:
+            start, end = end, start
+        x_values = self.columns[self.x]
+        low = 0 if start is None else max(
+            int(np.searchsorted(x_values, start, side='left')) - 1, 0)
+        high = len(x_values) if end is None else min(
+            int(np.searchsorted(x_values, end, side='right')) + 1,
+            len(x_values))
+        return slice(low, high)
+
+    def data(self, start=None, end=None):
+        '''The decimated columns of the x range between start and end.'''
+        window = self.window(start, end)
+        indices = decimate(self.columns[self.x][window],
+                           self.columns[self.y][window],
+                           self.n_out, self.method) + window.start
+        return {name: values[indices] for name, values in self.columns.items()}
+
+    def attach(self, source, x_range, doc):
+        '''Update source with the visible data whenever x_range changes.'''
+
+        def redecimate():
+            self._pending = False
+            source.data = self.data(x_range.start, x_range.end)
+
+        def on_range_change(attr, old, new):
+            if not self._pending:
+                self._pending = True
+                doc.add_timeout_callback(redecimate, self.delay)
+
+        x_range.on_change('start', on_range_change)
+        x_range.on_change('end', on_range_change)
@@ -11,15 +11,21 @@ Attributes:
 
 # Generic Python imports.
 import os
-import json
+from functools import partial
 # import itertools
 # import collections
 
 # Data science imports.
-import pandas as pd
+from .lazy import lazy_import
+
+pd = lazy_import('pandas')
 
 # Local helper function imports.
 from . import utils
+from . import cache
+from . import profiling
+from . import query
+from . import nodediff
 
 # Local model class imports.
 from .sample import Sample
@@ -77,13 +83,25 @@ class DrupalNode:
 
     '''
 
+    # The normalized tables of a node, by attribute name and json key.
+    TABLES = (
+        ('_node_information', 'nodeInformation'),
+        ('_study_factors', 'studyFactors'),
+        ('_study_samples', 'studySamples'),
+        ('_study_comments', 'comments'),
+        ('_study_assays', 'assays'),
+    )
+
     def __init__(self, node_json_path):
 
         self.json_path = os.path.join(utils.BASE_PATH, node_json_path)
 
-        # Load the json file into memory.
-        with open(self.json_path) as json_file:
-            self.json_dict = json.load(json_file)
+        # Load the json file into memory. Identical files are shared through
+        # the content cache, and must not be modified.
+        with profiling.stage('json.load', self.json_path):
+            self._digest, self._json_dict = cache.load_json_entry(
+                self.json_path)
+        self._fingerprint = None
 
         # The higher tiers of metadata apply to all data (and Assay instances
         # generated by this instance.) within this class. These are the
@@ -97,15 +115,107 @@ class DrupalNode:
         # The data to be used to construct Assay instances.
         self._study_assays = self.normalize_to_dataframe('assays')
 
+    @classmethod
+    def from_tables(cls, json_path, tables):
+        '''Build a node from tables normalized elsewhere.
+
+        Used to rebuild nodes normalized in another process, see
+        `isadream.models.parallel`. The json file is only read again if
+        `json_dict` is accessed.
+
+        Args:
+            json_path (str): The path of the node's `.json` file.
+            tables (dict): Normalized dataframes keyed by the json keys of
+                `TABLES`.
+
+        '''
+        node = cls.__new__(cls)
+        node.json_path = os.path.join(utils.BASE_PATH, json_path)
+        node._json_dict = node._digest = None
+        node._fingerprint = None
+        for attribute, key in cls.TABLES:
+            setattr(node, attribute, tables[key])
+        return node
+
+    @property
+    def json_dict(self):
+        '''The parsed `.json` file, shared and read-only.'''
+        if self._json_dict is None:
+            self._digest, self._json_dict = cache.load_json_entry(
+                self.json_path)
+        return self._json_dict
+
+    @property
+    def fingerprint(self):
+        '''The `nodediff.Fingerprint` of this node's document, or None if
+        the node was built from tables.
+
+        Only computed by `reload`, as it reads every part of the document.
+
+        '''
+        if self._fingerprint is None and self._json_dict is not None:
+            self._fingerprint = nodediff.fingerprint(self._json_dict)
+        return self._fingerprint
+
+    def reload(self):
+        '''Read the `.json` file again, rebuilding only what changed.
+
+        The new document is compared with this node's (see
+        `isadream.models.nodediff`). Tables of unchanged top-level sections
+        are reused, and handed to the content cache as the tables of the new
+        contents. Datafiles are cached by their own contents, so those of
+        unchanged assays are not read again either. This node is left
+        untouched.
+
+        Returns:
+            tuple: The new `DrupalNode`, and the `nodediff.NodeDiff` from
+                this node to it.
+
+        '''
+        node = self.__class__.__new__(self.__class__)
+        node.json_path = self.json_path
+        with profiling.stage('json.load', self.json_path):
+            node._digest, node._json_dict = cache.load_json_entry(
+                self.json_path)
+        node._fingerprint = None
+        old = self.fingerprint
+        diff = nodediff.compare(old, node.fingerprint)
+
+        for attribute, key in self.TABLES:
+            if old is None or key in diff.sections:
+                table = node.normalize_to_dataframe(key)
+            else:
+                table = cache.CONTENT_CACHE.derive(
+                    node._digest, cache.json_kind(), ('normalized', key),
+                    partial(getattr, self, attribute))
+            setattr(node, attribute, table)
+        return node, diff
+
+    def tables(self):
+        '''The normalized tables of this node keyed by json key.'''
+        return {key: getattr(self, attribute)
+                for attribute, key in self.TABLES}
+
     def normalize_to_dataframe(self, key):
         '''Reads a nested dictionary and returns a normalized pandas
         dataframe.
 
+        The result is shared by every node with the same file contents.
+
         '''
+        with profiling.stage(f'normalize_to_dataframe.{key}',
+                             self.json_path):
+            return cache.CONTENT_CACHE.derive(
+                self._digest, cache.json_kind(), ('normalized', key),
+                lambda: self._normalize(key))
+
+    def _normalize(self, key):
         # Normalize the dataframe to a list of dictionaries.
-        normalized_dict = list(utils.normalize(self.json_dict.get(key)))
+        with profiling.stage('utils.normalize', self.json_path):
+            normalized_dict = list(utils.normalize(self.json_dict.get(key)))
         # Read the data into a pandas DataFrame.
-        normalized_df = pd.io.json.json_normalize(normalized_dict)
+        with profiling.stage('json_normalize', self.json_path):
+            normalized_df = pd.io.json.json_normalize(normalized_dict)
         return normalized_df
 
     @property
@@ -113,11 +223,22 @@ class DrupalNode:
         '''Contains a list of assay dataframes associated with this instance.
 
         '''
-        assays = self._study_assays.groupby(level=0)
-        assay_data = [data for _, data in assays]
-        return [Assay(data, self.samples, self.factors, self.comments)
+        with profiling.stage('assays.groupby', self.json_path):
+            assays = self._study_assays.groupby(level=0)
+            assay_data = [data for _, data in assays]
+        base_path = os.path.dirname(self.json_path)
+        return [Assay(data, self.samples, self.factors, self.comments,
+                      base_path=base_path)
                 for data in assay_data]
 
+    def select(self, species=None, factors=None, columns=None):
+        '''Select the assay data of this node as NumPy-backed columns.
+
+        See `isadream.models.query.select` for the arguments.
+
+        '''
+        return query.select([self], species, factors, columns)
+
     @property
     def factors(self):
         '''
@@ -131,10 +252,12 @@ class DrupalNode:
         '''
         _sample_groups = self._study_samples.copy()
         _sample_groups = _sample_groups.set_index('sampleName').T
-        _sample_groups = utils.split_index(_sample_groups, 'index').T
+        with profiling.stage('samples.split_index', self.json_path):
+            _sample_groups = utils.split_index(_sample_groups, 'index').T
         _sample_groups.columns = pd.MultiIndex.from_tuples(_sample_groups.columns)
-        _sample_groups = _sample_groups.groupby(level=0)
-        _sample_groups = [data for _, data in _sample_groups]
+        with profiling.stage('samples.groupby', self.json_path):
+            _sample_groups = _sample_groups.groupby(level=0)
+            _sample_groups = [data for _, data in _sample_groups]
 
         return _sample_groups
 
@@ -0,0 +1,241 @@
+'''Batched least squares fits of one trend line per group of rows.
+
+Fitting a trend to each series (Al ppm against OH concentration for each
+of the KOH, LiOH and NaOH assays, say) with a `np.polyfit` call per group
+costs a Python round trip per group. `fit` solves every group at once:
+
+    1. x is centred and scaled per group, for well conditioned equations,
+    2. the power sums that make up each group's normal equations are
+       accumulated with one `np.bincount` per power over all rows,
+    3. the (groups x terms x terms) stack of normal equations is solved in
+       a single batched pseudo-inverse.
+
+Fits are cached per dataset version (see `dataset_version`), so a view can
+overlay them as soon as it is opened::
+
+    from isadream.models import fitting
+
+    fits = fitting.fit_frame(data_frame, 'Measurement Condition (Molar)',
+                             'Measurement (ppm)', by='data_file', degree=1,
+                             version=fitting.dataset_version(json_paths))
+    fit_source.data = fits.lines()
+
+'''
+
+# Generic Python imports.
+import os
+import threading
+import collections
+
+# Data science imports.
+from .lazy import lazy_import
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+# Local imports.
+from . import cache
+from . import query
+from . import utils
+
+_FITS = collections.OrderedDict()
+_FITS_LOCK = threading.Lock()
+_MAX_FITS = 1024
+
+
+class Fits:
+    '''Polynomial fits of y on x, one per group.
+
+    Coefficients are kept in increasing powers of the scaled variable
+    `(x - shift) / scale` of each group, use `evaluate` or `coefficients`
+    for values in terms of x. Groups with no more points than coefficients
+    have NaN coefficients.
+
+    Attributes:
+        groups (ndarray): The group labels.
+        degree (int): The polynomial degree.
+        count (ndarray): The number of points fitted per group.
+        rss (ndarray): The residual sum of squares per group.
+        r_squared (ndarray): The coefficient of determination per group.
+        x_min, x_max (ndarray): The x range of the points of each group.
+
+    '''
+
+    def __init__(self, groups, degree, scaled, shift, scale, count, rss,
+                 r_squared, x_min, x_max):
+        self.groups = groups
+        self.degree = degree
+        self.scaled = scaled
+        self.shift = shift
+        self.scale = scale
+        self.count = count
+        self.rss = rss
+        self.r_squared = r_squared
+        self.x_min = x_min
+        self.x_max = x_max
+
+    def __len__(self):
+        return len(self.groups)
+
+    def evaluate(self, x):
+        '''The fitted values of every group at x.
+
+        Args:
+            x (array): Points, shared by all groups, or a (groups x points)
+                array.
+
+        Returns:
+            ndarray: A (groups x points) array.
+
+        '''
+        x = np.asarray(x, dtype=np.float64)
+        if x.ndim == 1:
+            x = np.broadcast_to(x, (len(self.groups), len(x)))
+        u = (x - self.shift[:, None]) / self.scale[:, None]
+        # Horner's scheme over all groups at once.
+        values = np.zeros_like(u)
+        for power in range(self.degree, -1, -1):
+            values = values * u + self.scaled[:, power, None]
+        return values
+
+    def coefficients(self):
+        '''The coefficients of each group in increasing powers of x.'''
+        result = np.full_like(self.scaled, np.nan)
+        for row, (scaled, shift, scale) in enumerate(
+                zip(self.scaled, self.shift, self.scale)):
+            if np.isfinite(scaled).all():
+                polynomial = np.polynomial.Polynomial(
+                    scaled, domain=[shift - scale, shift + scale])
+                converted = polynomial.convert().coef
+                result[row, :len(converted)] = converted
+                result[row, len(converted):] = 0.0
+        return result
+
+    def lines(self, points=50):
+        '''Each fit over its group's x range, as `multi_line` data.'''
+        fractions = np.linspace(0.0, 1.0, points)
+        x = self.x_min[:, None] + (self.x_max - self.x_min)[:, None] \
+            * fractions
+        y = self.evaluate(x)
+        keep = np.isfinite(y).all(axis=1)
+        return dict(xs=list(x[keep]), ys=list(y[keep]),
+                    group=[str(group) for group in self.groups[keep]],
+                    r_squared=self.r_squared[keep].tolist())
+
+    def to_frame(self):
+        '''The fits as a dataframe, one row per group.'''
+        frame = pd.DataFrame(dict(group=self.groups, count=self.count,
+                                  rss=self.rss, r_squared=self.r_squared))
+        for power, values in enumerate(self.coefficients().T):
+            frame[f'c{power}'] = values
+        return frame
+
+
+def fit(x, y, groups, degree=1):
+    '''Fit a polynomial of y on x to every group of rows at once.
+
+    Args:
+        x, y (array): The points, rows with a NaN are ignored.
+        groups (array): The group label of each row.
+        degree (int): The polynomial degree, 1 for straight lines.
+
+    Returns:
+        Fits: The fit of each group, in order of first appearance.
+
+    '''
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    codes, labels = pd.factorize(np.asarray(groups))
+    keep = np.isfinite(x) & np.isfinite(y) & (codes >= 0)
+    x, y, codes = x[keep], y[keep], codes[keep]
+    n_groups, terms = len(labels), degree + 1
+
+    def group_sum(weights):
+        return np.bincount(codes, weights=weights, minlength=n_groups)
+
+    count = np.bincount(codes, minlength=n_groups)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        shift = group_sum(x) / count
+        x_min = np.full(n_groups, np.inf)
+        x_max = np.full(n_groups, -np.inf)
+        np.minimum.at(x_min, codes, x)
+        np.maximum.at(x_max, codes, x)
+        scale = (x_max - x_min) / 2
+        scale = np.where(scale > 0, scale, 1.0)
+        shift = np.where(count > 0, shift, 0.0)
+
+        u = (x - shift[codes]) / scale[codes]
+        powers = np.ones((len(u), 2 * degree + 1))
+        for power in range(1, 2 * degree + 1):
+            powers[:, power] = powers[:, power - 1] * u
+        # Power sums, the entries of the normal equations of each group.
+        sums = np.stack([group_sum(powers[:, power])
+                         for power in range(2 * degree + 1)], axis=1)
+        moments = np.stack([group_sum(powers[:, power] * y)
+                            for power in range(terms)], axis=1)
+        index = np.arange(terms)
+        normal = sums[:, index[:, None] + index[None, :]]
+        scaled = np.matmul(np.linalg.pinv(normal), moments[:, :, None])[:, :, 0]
+        scaled[count <= degree] = np.nan
+
+        fitted = np.zeros_like(u)
+        for power in range(degree, -1, -1):
+            fitted = fitted * u + scaled[codes, power]
+        rss = group_sum((y - fitted) ** 2)
+        total = group_sum(y ** 2) - group_sum(y) ** 2 / count
+        r_squared = 1 - rss / total
+    return Fits(np.asarray(labels), degree, scaled, shift, scale, count, rss,
+                r_squared, x_min, x_max)
+
+
+def dataset_version(nodes):
+    '''A digest of the contents of nodes and of the datafiles they use.
+
+    Changes whenever any of the files does, and is cheap to compute again,
+    as content hashes are memoized by file modification time and size.
+
+    '''
+    parts = list()
+    for node in nodes:
+        json_path = getattr(node, 'json_path', node)
+        folder = os.path.dirname(json_path)
+        parts.append(cache.CONTENT_CACHE.content_hash(json_path))
+        for plan in query.node_plans(json_path):
+            try:
+                parts.append(cache.CSV_CACHE.content_hash(
+                    utils.data_file_path(plan.data_file, folder)))
+            except OSError:
+                parts.append(f'missing {plan.data_file}')
+    return cache.hash_bytes('\n'.join(sorted(parts)).encode('utf-8'))
+
+
+def frame_version(data_frame):
+    '''A digest of the rows of a dataframe, for rows not read from files,
+    such as those streamed into a view.'''
+    hashes = pd.util.hash_pandas_object(data_frame, index=False)
+    return cache.hash_bytes(hashes.to_numpy().tobytes())
+
+
+def fit_frame(data_frame, x, y, by, degree=1, version=None):
+    '''`fit` the columns of a dataframe, grouped by column by.
+
+    Args:
+        version (hashable): The `dataset_version` of the frame's data. If
+            given, fits are cached and reused for the same version.
+
+    '''
+    key = None if version is None else (version, x, y, by, degree)
+    if key is not None:
+        with _FITS_LOCK:
+            fits = _FITS.get(key)
+            if fits is not None:
+                _FITS.move_to_end(key)
+                return fits
+
+    fits = fit(data_frame[x], data_frame[y], data_frame[by], degree)
+    if key is not None:
+        with _FITS_LOCK:
+            _FITS[key] = fits
+            while len(_FITS) > _MAX_FITS:
+                _FITS.popitem(last=False)
+    return fits
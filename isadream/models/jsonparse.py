@@ -0,0 +1,162 @@
+'''Pluggable JSON parsing for node ingestion.
+
+The fastest installed parser is used to read node `.json` files, in order of
+preference: `orjson`, `simdjson` (pysimdjson), `ujson` and finally the
+standard library `json` module. None of these are required.
+
+A lazy mode is also available when simdjson is installed. Lazily parsed
+documents are kept in simdjson's native form and Python objects are only
+built for a top-level key the first time it is requested. A `DrupalNode`
+only ever asks for the five top-level keys it normalizes, and a metadata
+listing only for `nodeInformation`, so other values are never materialized.
+
+The backend is chosen with the `IDREAM_JSON_BACKEND` environment variable
+(`orjson`, `simdjson`, `ujson` or `json`) and lazy mode is switched on with
+`IDREAM_JSON_LAZY=1`, or at runtime with `set_backend()`.
+
+'''
+
+# Generic Python imports.
+import os
+import json
+import collections.abc
+
+_BACKENDS = collections.OrderedDict()
+
+try:
+    import orjson
+    _BACKENDS['orjson'] = orjson.loads
+except ImportError:
+    pass
+
+try:
+    import simdjson
+
+    def _materialize(value):
+        if isinstance(value, simdjson.Object):
+            return value.as_dict()
+        if isinstance(value, simdjson.Array):
+            return value.as_list()
+        return value
+
+    def _simdjson_loads(data):
+        # A parser owns the memory of its document, so one is needed per
+        # document to keep the results valid.
+        return _materialize(simdjson.Parser().parse(data))
+
+    _BACKENDS['simdjson'] = _simdjson_loads
+except ImportError:
+    pass
+
+try:
+    import ujson
+    _BACKENDS['ujson'] = ujson.loads
+except ImportError:
+    pass
+
+_BACKENDS['json'] = json.loads
+
+
+def available_backends():
+    '''The names of the installed backends, fastest first.'''
+    return list(_BACKENDS)
+
+
+def _default_backend():
+    requested = os.environ.get('IDREAM_JSON_BACKEND')
+    if requested in _BACKENDS:
+        return requested
+    return next(iter(_BACKENDS))
+
+
+_backend = _default_backend()
+_lazy = os.environ.get('IDREAM_JSON_LAZY', '').lower() in ('1', 'true', 'yes')
+
+
+def set_backend(name=None, lazy=None):
+    '''Select the parser backend and, optionally, lazy mode.
+
+    Args:
+        name (str): One of `available_backends()`. None keeps the current
+            backend.
+        lazy (bool): Enable or disable lazy mode. None keeps the current
+            setting.
+
+    Raises:
+        ValueError: If the backend is not installed.
+
+    '''
+    global _backend, _lazy
+    if name is not None:
+        if name not in _BACKENDS:
+            raise ValueError(f'JSON backend {name!r} is not installed, '
+                             f'choose from {available_backends()}.')
+        _backend = name
+    if lazy is not None:
+        _lazy = bool(lazy)
+
+
+def get_backend():
+    '''Return the `(name, lazy)` parser settings in use.'''
+    return _backend, _lazy
+
+
+def loads(data, backend=None):
+    '''Parse a JSON document from bytes or str with the selected backend.'''
+    return _BACKENDS[backend or _backend](data)
+
+
+class LazyDocument(collections.abc.Mapping):
+    '''A read-only mapping over a JSON object that builds values on demand.
+
+    The document is parsed by simdjson into its native representation, and
+    Python objects are only built for the top-level keys that are requested.
+
+    Attributes:
+        materialized (set[str]): The keys built so far.
+
+    '''
+
+    def __init__(self, data):
+        self._document = simdjson.Parser().parse(data)
+        if not isinstance(self._document, simdjson.Object):
+            raise ValueError('The JSON document is not an object.')
+        self._values = dict()
+
+    @property
+    def materialized(self):
+        return set(self._values)
+
+    def __getitem__(self, key):
+        try:
+            return self._values[key]
+        except KeyError:
+            pass
+        value = _materialize(self._document[key])
+        self._values[key] = value
+        return value
+
+    def __iter__(self):
+        return iter(self._document.keys())
+
+    def __len__(self):
+        return len(self._document)
+
+    def __contains__(self, key):
+        return key in self._document
+
+
+def load_document(data):
+    '''Parse a node document honoring the lazy mode setting.
+
+    Lazy mode needs simdjson. Without it, or for documents that are not JSON
+    objects, the document is parsed eagerly with the selected backend (a
+    pure Python key scanner is slower than any of the compiled parsers).
+
+    '''
+    if _lazy and 'simdjson' in _BACKENDS:
+        try:
+            return LazyDocument(data)
+        except ValueError:
+            pass
+    return loads(data)
@@ -0,0 +1,48 @@
+'''Deferred imports of heavy dependencies.
+
+pandas and NumPy take a large share of the time needed to start a worker or
+a command line tool, even when only node metadata is read. Modules of this
+package bind them with `lazy_import` instead of `import`, and they are only
+imported when one of their attributes is first used::
+
+    from .lazy import lazy_import
+
+    pd = lazy_import('pandas')
+
+Set `IDREAM_EAGER_IMPORTS=1` to import everything up front, for example to
+pay the cost before forking workers.
+
+'''
+
+# Generic Python imports.
+import os
+import sys
+import importlib
+import importlib.util
+
+_EAGER = os.environ.get('IDREAM_EAGER_IMPORTS', '').lower() in (
+    '1', 'true', 'yes')
+
+
+def lazy_import(name):
+    '''Return module name, imported on first attribute access.
+
+    Modules already imported, or missing, are returned (or raise) at once,
+    as does every module when `IDREAM_EAGER_IMPORTS` is set.
+
+    '''
+    if name in sys.modules:
+        # Possibly still lazy, `import_module` would load it.
+        return sys.modules[name]
+    if _EAGER:
+        return importlib.import_module(name)
+
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ImportError(f'No module named {name!r}', name=name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
@@ -0,0 +1,210 @@
+'''Merge many assay frames into one contiguous columnar block.
+
+Concatenating thousands of small assay frames, each with a few constant
+factor columns added, copies the data repeatedly and widens mismatched
+columns to `object`. `merge_frames` instead:
+
+    1. computes the union schema (column order and a common dtype per
+       column) over every frame and its constants,
+    2. allocates one NumPy buffer of the final length for each column, and
+    3. copies each frame's columns straight into its slice of the buffers,
+       broadcasting constants without building intermediate frames.
+
+The result is a `ColumnBlock`, a mapping of column names to arrays that can
+be handed to a Bokeh `ColumnDataSource` as is, or turned into a DataFrame
+(or an Arrow table, if `pyarrow` is installed).
+
+'''
+
+# Generic Python imports.
+import datetime
+import collections
+import collections.abc
+
+# Data science imports.
+from .lazy import lazy_import
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+_NUMERIC_KINDS = frozenset('biufc')
+# Timezone naive datetimes and timedeltas keep a nanosecond dtype.
+_TIME_DTYPES = {'M': 'datetime64[ns]', 'm': 'timedelta64[ns]'}
+
+
+class ColumnBlock(collections.abc.Mapping):
+    '''Equal length column arrays, keyed by column name, in order.'''
+
+    def __init__(self, columns, length):
+        self.columns = columns
+        self.length = length
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def __iter__(self):
+        return iter(self.columns)
+
+    def __len__(self):
+        return len(self.columns)
+
+    @property
+    def nbytes(self):
+        return sum(array.nbytes for array in self.columns.values())
+
+    def to_frame(self):
+        '''The block as a pandas DataFrame.'''
+        if not self.columns:
+            return pd.DataFrame(index=pd.RangeIndex(self.length))
+        return pd.DataFrame(self.columns, copy=False)
+
+    def to_arrow(self):
+        '''The block as a `pyarrow.Table`, numeric columns are not copied.'''
+        try:
+            import pyarrow
+        except ImportError:
+            raise ImportError('pyarrow is needed for Arrow tables.') from None
+        return pyarrow.table(
+            {name: pyarrow.array(array, from_pandas=True)
+             for name, array in self.columns.items()})
+
+
+def _value_dtype(value):
+    '''The dtype a constant would be stored with, or None for missing.'''
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return None
+    if isinstance(value, datetime.datetime) and value.tzinfo is None:
+        return np.dtype(_TIME_DTYPES['M'])
+    if isinstance(value, datetime.timedelta):
+        return np.dtype(_TIME_DTYPES['m'])
+    dtype = np.asarray(value).dtype
+    if dtype.kind in _TIME_DTYPES:
+        return np.dtype(_TIME_DTYPES[dtype.kind])
+    return dtype if dtype.kind in _NUMERIC_KINDS else np.dtype(object)
+
+
+def _series_dtype(series):
+    dtype = series.dtype
+    if isinstance(dtype, np.dtype) and dtype.kind in _TIME_DTYPES:
+        return np.dtype(_TIME_DTYPES[dtype.kind])
+    if not isinstance(dtype, np.dtype) or dtype.kind not in _NUMERIC_KINDS:
+        # Strings, categoricals, timezone aware datetimes and extension
+        # arrays.
+        return np.dtype(object)
+    return dtype
+
+
+def _union_dtype(dtypes, has_missing):
+    '''The dtype able to hold every dtype given, and missing values.'''
+    kinds = {dtype.kind for dtype in dtypes}
+    if len(kinds) == 1 and kinds <= set(_TIME_DTYPES):
+        # Missing values are NaT.
+        return np.dtype(_TIME_DTYPES[kinds.pop()])
+    if not dtypes or any(dtype.kind not in _NUMERIC_KINDS for dtype in dtypes):
+        return np.dtype(object)
+    dtype = np.result_type(*dtypes)
+    if has_missing:
+        if dtype.kind == 'b':
+            return np.dtype(object)
+        if dtype.kind in 'iu':
+            return np.dtype(np.float64)
+    return dtype
+
+
+def union_schema(frames, constants):
+    '''Compute the merged column order and dtypes.
+
+    Args:
+        frames (list[DataFrame]): The frames to merge.
+        constants (list[dict]): Constant columns for each frame.
+
+    Returns:
+        OrderedDict: Maps each column name to its merged dtype.
+
+    '''
+    seen = collections.OrderedDict()
+    rows_with = collections.Counter()
+    total = 0
+
+    for frame, frame_constants in zip(frames, constants):
+        total += len(frame)
+        for name in frame.columns:
+            seen.setdefault(name, []).append(_series_dtype(frame[name]))
+            rows_with[name] += len(frame)
+        for name, value in frame_constants.items():
+            dtypes = seen.setdefault(name, [])
+            dtype = _value_dtype(value)
+            if dtype is not None:
+                dtypes.append(dtype)
+                rows_with[name] += len(frame)
+
+    return collections.OrderedDict(
+        (name, _union_dtype(dtypes, rows_with[name] < total))
+        for name, dtypes in seen.items())
+
+
+def merge_frames(frames, constants=None, source_column=None):
+    '''Merge frames into one `ColumnBlock` with a single allocation per column.
+
+    Args:
+        frames (list[DataFrame]): The frames to merge, their indexes are
+            ignored.
+        constants (list[dict]): Optional constant column values for each
+            frame, for example the factors that apply to a whole assay.
+        source_column (str): If given, an `int32` column of this name holds
+            the position in `frames` each row came from.
+
+    Returns:
+        ColumnBlock: The merged columns. Columns missing from a frame are
+            filled with NaN (integer columns are widened to float for this,
+            booleans to object), or NaT for datetimes. A constant named like
+            a column of its frame replaces that column.
+
+    '''
+    frames = list(frames)
+    if constants is None:
+        constants = [dict()] * len(frames)
+    else:
+        constants = list(constants)
+        if len(constants) != len(frames):
+            raise ValueError('One constants dictionary is needed per frame.')
+
+    schema = union_schema(frames, constants)
+    lengths = [len(frame) for frame in frames]
+    total = sum(lengths)
+
+    columns = collections.OrderedDict()
+    for name, dtype in schema.items():
+        columns[name] = np.empty(total, dtype=dtype)
+    if source_column is not None:
+        columns[source_column] = np.repeat(
+            np.arange(len(frames), dtype=np.int32), lengths)
+
+    offset = 0
+    for frame, frame_constants, length in zip(frames, constants, lengths):
+        stop = offset + length
+        present = set()
+        for name in frame.columns:
+            column = columns[name]
+            series = frame[name]
+            if column.dtype.kind == 'O' and series.dtype.kind in _TIME_DTYPES:
+                # Keep Timestamps, not integer nanoseconds.
+                series = series.astype(object)
+            column[offset:stop] = series.to_numpy()
+            present.add(name)
+        for name, value in frame_constants.items():
+            if _value_dtype(value) is None:
+                present.discard(name)
+            else:
+                columns[name][offset:stop] = value
+                present.add(name)
+        for name in schema:
+            if name not in present:
+                # The union dtype of a partly missing column holds NaN, NaT
+                # for datetimes.
+                column = columns[name]
+                column[offset:stop] = (np.nan if column.dtype.kind not in
+                                       _TIME_DTYPES else 'NaT')
+        offset = stop
+
+    return ColumnBlock(columns, total)
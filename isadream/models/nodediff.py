@@ -0,0 +1,163 @@
+'''Structural comparison of two versions of a node document.
+
+When a curator fixes one factor of one assay, Drupal rewrites the whole
+node `.json` file. Rather than comparing the documents value by value, each
+part of a document is reduced to a digest of its canonical json form:
+
+    + each top-level section (`nodeInformation`, `studyFactors`, ...),
+    + each assay, so an assay is recognized wherever it moved in the list,
+    + each sample, by name, and each factor, by `query.factor_label`,
+      wherever they appear in the document.
+
+`compare` reports which of these differ between two fingerprints, see
+`NodeDiff`. `DrupalNode.reload` uses it to rebuild only the tables that
+changed, and fingerprints are only taken there, never when a node is first
+loaded::
+
+    node, diff = node.reload()
+    if diff.changed:
+        logger.info('Reingested %s: %s', node.json_path, diff)
+
+'''
+
+# Generic Python imports.
+import json
+import collections
+
+# Local imports.
+from . import cache
+from . import query
+
+# The factor scopes of a sample, and of a source, in the json structure.
+_SAMPLE_FACTORS = ('studySampleFactors', 'AssaySampleFactors')
+_SOURCE_FACTORS = ('materialCharacteristic',)
+
+Fingerprint = collections.namedtuple(
+    'Fingerprint', ['sections', 'assays', 'samples', 'factors'])
+Fingerprint.__doc__ = '''Digests of the parts of a node document.
+
+`sections` maps top-level keys to a digest, `assays` is the tuple of assay
+digests in document order, `samples` and `factors` map sample names and
+factor labels to the sorted digests of every entry with that name or label.
+'''
+
+
+class NodeDiff(collections.namedtuple(
+        'NodeDiff', ['sections', 'assays_changed', 'assays_removed',
+                     'assays_reused', 'samples', 'factors'])):
+    '''What differs between two versions of a node document.
+
+    Attributes:
+        sections (list[str]): Top-level keys whose contents differ.
+        assays_changed (list[int]): Indices, in the new document, of assays
+            that are new or edited.
+        assays_removed (list[int]): Indices, in the old document, of assays
+            that are no longer present.
+        assays_reused (list[int]): Indices, in the new document, of assays
+            found unchanged.
+        samples (list[str]): Names of samples added, removed or edited.
+        factors (list[str]): Labels of factors added, removed or edited.
+
+    '''
+
+    __slots__ = ()
+
+    @property
+    def changed(self):
+        return bool(self.sections)
+
+    def __str__(self):
+        if not self.changed:
+            return 'unchanged'
+        parts = [f'sections {", ".join(self.sections)}',
+                 f'{len(self.assays_changed)} assays changed, '
+                 f'{len(self.assays_removed)} removed, '
+                 f'{len(self.assays_reused)} unchanged']
+        if self.samples:
+            parts.append(f'samples {", ".join(map(str, self.samples))}')
+        if self.factors:
+            parts.append(f'factors {", ".join(map(str, self.factors))}')
+        return '; '.join(parts)
+
+
+def digest(value):
+    '''The digest of a json value, independent of key order.'''
+    data = json.dumps(value, sort_keys=True, separators=(',', ':'),
+                      default=str)
+    return cache.hash_bytes(data.encode('utf-8'))
+
+
+def _add_factors(factors, entries):
+    for factor in entries or ():
+        label = query.factor_label(factor.get('factorType'),
+                                   factor.get('unitRef'))
+        factors[label].append(digest(factor))
+
+
+def _add_sample(samples, factors, sample):
+    # Assay samples are named by `name` rather than `sampleName`.
+    name = sample.get('sampleName') or sample.get('name')
+    samples[name].append(digest(sample))
+    for scope in _SAMPLE_FACTORS:
+        _add_factors(factors, sample.get(scope))
+    for source in sample.get('sources') or ():
+        for scope in _SOURCE_FACTORS:
+            _add_factors(factors, source.get(scope))
+
+
+def fingerprint(document):
+    '''Reduce a node document to a `Fingerprint`.'''
+    sections = {key: digest(value) for key, value in document.items()}
+    assays = tuple(digest(assay) for assay in document.get('assays') or ())
+
+    samples = collections.defaultdict(list)
+    factors = collections.defaultdict(list)
+    _add_factors(factors, document.get('studyFactors'))
+    for sample in document.get('studySamples') or ():
+        _add_sample(samples, factors, sample)
+    for assay in document.get('assays') or ():
+        _add_factors(factors, assay.get('assayParameters'))
+        for sample in assay.get('samples') or ():
+            _add_sample(samples, factors, sample)
+
+    return Fingerprint(
+        sections, assays,
+        {name: sorted(digests) for name, digests in samples.items()},
+        {label: sorted(digests) for label, digests in factors.items()})
+
+
+def _changed_keys(old, new):
+    return sorted((key for key in set(old) | set(new)
+                   if old.get(key) != new.get(key)), key=str)
+
+
+def compare(old, new):
+    '''The `NodeDiff` from fingerprint old to fingerprint new.
+
+    If old is None (the previous document is not known) everything in new
+    is reported as changed.
+
+    '''
+    if old is None:
+        old = Fingerprint(dict(), (), dict(), dict())
+
+    # Assays are matched by contents, an unchanged assay is found wherever
+    # it is in the new list. Duplicates are matched one to one.
+    available = collections.Counter(old.assays)
+    changed, reused = list(), list()
+    for index, assay in enumerate(new.assays):
+        if available[assay] > 0:
+            available[assay] -= 1
+            reused.append(index)
+        else:
+            changed.append(index)
+    removed = list()
+    for index, assay in enumerate(old.assays):
+        if available[assay] > 0:
+            available[assay] -= 1
+            removed.append(index)
+
+    return NodeDiff(_changed_keys(old.sections, new.sections),
+                    changed, removed, reused,
+                    _changed_keys(old.samples, new.samples),
+                    _changed_keys(old.factors, new.factors))
@@ -0,0 +1,222 @@
+'''Parallel construction of `DrupalNode` instances in worker processes.
+
+Parsing and normalizing a node is pure Python and pandas work that holds the
+GIL, so threads do not help. `build_nodes` builds nodes in a process pool.
+Workers return their normalized tables through a single
+`multiprocessing.shared_memory` segment per node: numeric columns are
+written into the segment as raw arrays, and only the small column layout
+(and any object columns, which cannot be shared as raw memory) is pickled
+back to the parent.
+
+On Python versions without `multiprocessing.shared_memory` (before 3.8) the
+tables are pickled whole instead. This includes the Docker image, which is
+built on `python:3.6-stretch`: the container always takes the pickling
+path, and only gets the zero-copy transfer once its base image is raised
+to Python 3.8 or later.
+
+::
+
+    from isadream.models import parallel
+
+    nodes = parallel.build_nodes(json_paths, workers=4)
+
+'''
+
+# Generic Python imports.
+import os
+import concurrent.futures
+
+# Data science imports.
+from .lazy import lazy_import
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+try:
+    from multiprocessing import shared_memory, resource_tracker
+except ImportError:
+    shared_memory = None
+
+# Local imports.
+from .drupalnode import DrupalNode
+
+_ALIGNMENT = 64
+
+
+def _shareable(series):
+    dtype = series.dtype
+    return isinstance(dtype, np.dtype) and dtype.kind in 'biufcmM'
+
+
+def frames_to_shared(frames):
+    '''Copy the numeric columns of frames into one shared memory segment.
+
+    Args:
+        frames (dict): DataFrames by name.
+
+    Returns:
+        tuple: The `SharedMemory` segment (None if nothing was shared), and
+            a picklable layout to pass to `frames_from_shared`. The caller
+            must close the segment, and the receiver unlinks it.
+
+    '''
+    layout = dict()
+    size = 0
+    for name, frame in frames.items():
+        columns = list()
+        for position, column in enumerate(frame.columns):
+            series = frame.iloc[:, position]
+            if _shareable(series):
+                array = np.ascontiguousarray(series.to_numpy())
+                columns.append((column, 'shared', array.dtype.str, size))
+                size += -(-array.nbytes // _ALIGNMENT) * _ALIGNMENT
+            else:
+                columns.append((column, 'pickled', None,
+                                series.to_numpy(dtype=object)))
+        layout[name] = (len(frame), columns)
+
+    segment = None
+    if size:
+        segment = shared_memory.SharedMemory(create=True, size=size)
+        for name, frame in frames.items():
+            length, columns = layout[name]
+            for position, (_, kind, dtype, offset) in enumerate(columns):
+                if kind == 'shared':
+                    target = np.ndarray(length, dtype=dtype,
+                                        buffer=segment.buf, offset=offset)
+                    target[:] = frame.iloc[:, position].to_numpy()
+
+    return segment, (segment.name if segment else None, layout)
+
+
+def frames_from_shared(shared):
+    '''Rebuild frames exported by `frames_to_shared`, and free the segment.'''
+    segment_name, layout = shared
+    segment = None
+    if segment_name is not None:
+        segment = shared_memory.SharedMemory(name=segment_name)
+
+    try:
+        frames = dict()
+        for name, (length, columns) in layout.items():
+            data = dict()
+            for column, kind, dtype, value in columns:
+                if kind == 'shared':
+                    # Copy out, the segment is released below.
+                    data[column] = np.ndarray(
+                        length, dtype=dtype, buffer=segment.buf,
+                        offset=value).copy()
+                else:
+                    data[column] = value
+            frames[name] = pd.DataFrame(data, index=pd.RangeIndex(length))
+    finally:
+        if segment is not None:
+            segment.close()
+            segment.unlink()
+    return frames
+
+
+def release_shared(shared):
+    '''Free the segment of frames exported by `frames_to_shared`, unread.'''
+    segment_name, _ = shared
+    if segment_name is None:
+        return
+    try:
+        segment = shared_memory.SharedMemory(name=segment_name)
+    except FileNotFoundError:
+        return
+    segment.close()
+    segment.unlink()
+
+
+def _build_tables(json_path):
+    '''Worker: build a node and export its normalized tables.'''
+    tables = DrupalNode(json_path).tables()
+    if shared_memory is None:
+        return json_path, tables, False
+
+    segment, shared = frames_to_shared(tables)
+    if segment is not None:
+        # The parent attaches by name and unlinks it once copied, so this
+        # process must not clean the segment up when it exits.
+        resource_tracker.unregister(segment._name, 'shared_memory')
+        segment.close()
+    return json_path, shared, True
+
+
+def _build_chunk(json_paths):
+    '''Worker: `_build_tables` for several paths.
+
+    A failure frees the segments of the nodes already built before it is
+    raised, as they never reach the parent.
+
+    '''
+    results = list()
+    try:
+        for json_path in json_paths:
+            results.append(_build_tables(json_path))
+    except BaseException:
+        _release_results(results)
+        raise
+    return results
+
+
+def _release_results(results):
+    for result in results:
+        if result is not None and result[2]:
+            release_shared(result[1])
+
+
+def build_nodes(json_paths, workers=None, chunksize=1):
+    '''Build a `DrupalNode` for each path using a pool of processes.
+
+    Args:
+        json_paths (list[str]): The node `.json` files.
+        workers (int): Number of worker processes, defaults to the number of
+            CPUs. With one worker the nodes are built in this process.
+        chunksize (int): Paths handed to a worker at a time.
+
+    Returns:
+        list[DrupalNode]: The nodes, in the order of `json_paths`.
+
+    Raises:
+        The first error raised building a node, once the segments of every
+        node built are freed.
+
+    '''
+    json_paths = list(json_paths)
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(json_paths) < 2:
+        return [DrupalNode(path) for path in json_paths]
+
+    nodes = [None] * len(json_paths)
+    executor = concurrent.futures.ProcessPoolExecutor(workers)
+    futures = dict()
+    try:
+        for start in range(0, len(json_paths), chunksize):
+            chunk = json_paths[start:start + chunksize]
+            futures[executor.submit(_build_chunk, chunk)] = start
+        for future in concurrent.futures.as_completed(list(futures)):
+            start = futures.pop(future)
+            results = future.result()
+            try:
+                for offset, result in enumerate(results):
+                    # Attaching unlinks the segment, even if it fails.
+                    results[offset] = None
+                    json_path, tables, is_shared = result
+                    if is_shared:
+                        tables = frames_from_shared(tables)
+                    nodes[start + offset] = DrupalNode.from_tables(
+                        json_path, tables)
+            finally:
+                _release_results(results)
+    finally:
+        for future in futures:
+            future.cancel()
+        executor.shutdown(wait=True)
+        # The workers no longer track their segments, free those of every
+        # result that was not attached above.
+        for future in futures:
+            if not future.cancelled() and future.exception() is None:
+                _release_results(future.result())
+    return nodes
@@ -0,0 +1,375 @@
+'''Batch peak detection over the spectra of many assays.
+
+Peak positions used to be read off plots by hand. `find_peaks` measures the
+peaks of many spectra at once: the spectra are stacked into NaN padded 2-D
+arrays (assays x points) and every step is a NumPy operation over the whole
+stack, with no loop over assays or peaks:
+
+    1. local maxima above `min_height` (a fraction of each spectrum's range
+       above its baseline, the spectrum minimum) are found by comparing
+       shifted copies of the stack,
+    2. the `max_peaks` highest maxima of each spectrum are kept,
+    3. the half maximum crossings either side of each peak are found from a
+       (spectra x peaks x window) mask of the points around each peak, and
+       interpolated linearly to give the full width at half maximum (FWHM),
+    4. the centroid is the baseline corrected, intensity weighted mean x
+       between the two crossings.
+
+`extract` runs this over the assays of many nodes, optionally restricted to
+one `experimentSubType`. Datafiles are read through `cache.read_csv` and
+results are cached by datafile content hash, so only new or edited assays
+are measured again. The assays are split into groups of similar length,
+which are measured in a thread pool (NumPy releases the GIL for the array
+operations).
+
+`select` attaches the features as derived factors of each assay to the
+frame returned by `query.select`::
+
+    from isadream.models import peaks
+
+    block = peaks.select(json_paths, x='Measurement (ppm)',
+                         y='Measurement (Intensity)',
+                         experiment_subtype='Al_NMR',
+                         columns=['Peak Position (ppm)',
+                                  'Measurement Condition (Molar)'])
+
+'''
+
+# Generic Python imports.
+import os
+import logging
+import threading
+import collections
+import concurrent.futures
+
+# Data science imports.
+from .lazy import lazy_import
+
+np = lazy_import('numpy')
+
+# Local imports.
+from . import cache
+from . import query
+from . import utils
+
+logger = logging.getLogger(__name__)
+
+FEATURES = ('position', 'height', 'centroid', 'fwhm')
+
+# The points searched either side of a peak for its half maximum, and the
+# largest (spectra x peaks x window) array built at once.
+_WINDOW = 256
+_MAX_MASK = 2 ** 22
+
+_RESULTS = collections.OrderedDict()
+_RESULTS_LOCK = threading.Lock()
+_MAX_RESULTS = 65536
+
+
+def pad(spectra):
+    '''Stack (x, y) pairs into NaN padded 2-D arrays, each row sorted on x.
+
+    Points without an x value are dropped to the padding.
+
+    '''
+    spectra = list(spectra)
+    length = max((len(x) for x, _ in spectra), default=0)
+    x_stack = np.full((len(spectra), length), np.nan)
+    y_stack = np.full((len(spectra), length), np.nan)
+    for row, (x, y) in enumerate(spectra):
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        order = np.argsort(x, kind='mergesort')
+        x, y = x[order], y[order]
+        y[np.isnan(x)] = np.nan
+        x_stack[row, :len(x)] = x
+        y_stack[row, :len(y)] = y
+    return x_stack, y_stack
+
+
+def _crossings(x_stack, y_stack, half, peaks, baseline, width):
+    '''The FWHM and centroid of peaks, searched within width points.
+
+    Args:
+        x_stack, y_stack (ndarray): (spectra x points) padded spectra.
+        half (ndarray): (spectra x peaks) half maximum levels.
+        peaks (ndarray): (spectra x peaks) point index of each peak.
+        baseline (ndarray): The baseline of each spectrum.
+        width (int): The number of points searched either side of a peak.
+
+    Returns:
+        tuple: The FWHM and centroid, and whether both crossings of each
+            peak were found within the window.
+
+    '''
+    length = y_stack.shape[1]
+    offsets = np.arange(-width, width + 1)
+    index = peaks[:, :, None] + offsets
+    outside = (index < 0) | (index >= length)
+    index = np.clip(index, 0, length - 1)
+    rows = np.arange(len(peaks))[:, None, None]
+    x_window = x_stack[rows, index]
+    y_window = np.where(outside, np.nan, y_stack[rows, index])
+
+    # NaN points, the padding and the ends of the data end a peak.
+    below = ~(y_window >= half[:, :, None])
+    left = np.where(below & (offsets < 0), offsets, -width - 1).max(axis=2)
+    right = np.where(below & (offsets > 0), offsets, width + 1).min(axis=2)
+    found = (left >= -width) & (right <= width)
+
+    def crossing(outer, inner):
+        # The x where y crosses half between the points outer and inner.
+        outer = np.clip(outer + width, 0, 2 * width)[:, :, None]
+        inner = np.clip(inner + width, 0, 2 * width)[:, :, None]
+        x_out = np.take_along_axis(x_window, outer, axis=2)[:, :, 0]
+        y_out = np.take_along_axis(y_window, outer, axis=2)[:, :, 0]
+        x_in = np.take_along_axis(x_window, inner, axis=2)[:, :, 0]
+        y_in = np.take_along_axis(y_window, inner, axis=2)[:, :, 0]
+        value = x_in + (half - y_in) * (x_out - x_in) / (y_out - y_in)
+        # Next to the end of the data, or a gap, the last point counts.
+        return np.where(np.isfinite(value), value, x_in)
+
+    fwhm = crossing(right, right - 1) - crossing(left, left + 1)
+
+    inside = ((offsets > left[:, :, None]) & (offsets < right[:, :, None])
+              & ~outside)
+    weights = np.where(inside, y_window - baseline[:, None, None], 0.0)
+    x_values = np.where(inside, x_window, 0.0)
+    centroid = (weights * x_values).sum(axis=2) / weights.sum(axis=2)
+    return fwhm, centroid, found
+
+
+def find_peaks(x_stack, y_stack, max_peaks=1, min_height=0.1):
+    '''Measure the highest peaks of every spectrum of a padded stack.
+
+    Args:
+        x_stack, y_stack (ndarray): (spectra x points) arrays, see `pad`.
+        max_peaks (int): The number of peaks to measure per spectrum.
+        min_height (float): Ignore maxima lower than this fraction of the
+            range of their spectrum, above its baseline.
+
+    Returns:
+        dict: (spectra x max_peaks) arrays keyed by `FEATURES`, ordered by
+            peak height. Missing peaks are NaN.
+
+    '''
+    n_spectra, length = y_stack.shape
+    result = {name: np.full((n_spectra, max_peaks), np.nan)
+              for name in FEATURES}
+    if n_spectra == 0 or length < 3:
+        return result
+
+    # Spectra without peaks, or without values, give NaN and inf along the
+    # way, they are masked out at the end.
+    with np.errstate(invalid='ignore', divide='ignore'):
+        features, valid = _find_peaks(x_stack, y_stack, max_peaks,
+                                      min_height)
+    count = valid.shape[1]
+    for name, values in features.items():
+        result[name][:, :count] = np.where(valid, values, np.nan)
+    return result
+
+
+def _find_peaks(x_stack, y_stack, max_peaks, min_height):
+    n_spectra, length = y_stack.shape
+    missing = np.isnan(y_stack)
+    filled = np.where(missing, -np.inf, y_stack)
+    baseline = np.where(missing, np.inf, y_stack).min(axis=1)
+    top = filled.max(axis=1)
+    threshold = baseline + min_height * (top - baseline)
+
+    centre = filled[:, 1:-1]
+    is_peak = ((centre > filled[:, :-2]) & (centre >= filled[:, 2:])
+               & (centre >= threshold[:, None]) & np.isfinite(centre))
+    heights = np.full((n_spectra, length), -np.inf)
+    heights[:, 1:-1] = np.where(is_peak, centre, -np.inf)
+
+    # The highest maxima, highest first.
+    count = min(max_peaks, length - 2)
+    peaks = np.argpartition(-heights, count - 1, axis=1)[:, :count]
+    peak_heights = np.take_along_axis(heights, peaks, axis=1)
+    order = np.argsort(-peak_heights, axis=1, kind='stable')
+    peaks = np.take_along_axis(peaks, order, axis=1)
+    peak_heights = np.take_along_axis(peak_heights, order, axis=1)
+    valid = np.isfinite(peak_heights)
+    half = baseline[:, None] + (peak_heights - baseline[:, None]) / 2
+
+    fwhm = np.empty((n_spectra, count))
+    centroid = np.empty((n_spectra, count))
+    pending = np.arange(n_spectra)
+    width = min(_WINDOW, length)
+    while len(pending):
+        # Peaks wider than the window are measured again over a window
+        # spanning the whole spectrum, which always finds both crossings.
+        step = max(_MAX_MASK // (count * (2 * width + 1)), 1)
+        wider = list()
+        for start in range(0, len(pending), step):
+            rows = pending[start:start + step]
+            batch_fwhm, batch_centroid, found = _crossings(
+                x_stack[rows], y_stack[rows], half[rows], peaks[rows],
+                baseline[rows], width)
+            fwhm[rows], centroid[rows] = batch_fwhm, batch_centroid
+            wider.append(rows[~found.all(axis=1)])
+        pending = np.concatenate(wider) if width < length else []
+        width = length
+
+    features = dict(position=np.take_along_axis(x_stack, peaks, axis=1),
+                    height=peak_heights, centroid=centroid, fwhm=fwhm)
+    return features, valid
+
+
+def _unit(label):
+    '''The unit of a factor label built by `query.factor_label`.'''
+    if label.endswith(')') and ' (' in label:
+        return label[label.rindex(' (') + 2:-1]
+    return None
+
+
+def feature_labels(x, y, max_peaks=1):
+    '''The derived factor labels of each peak, by feature name.
+
+    For example `'Peak Position (ppm)'`, or `'Peak 2 Position (ppm)'` when
+    more than one peak is measured.
+
+    '''
+    units = dict(position=_unit(x), height=_unit(y), centroid=_unit(x),
+                 fwhm=_unit(x))
+    names = dict(position='Position', height='Height', centroid='Centroid',
+                 fwhm='FWHM')
+    labels = list()
+    for peak in range(max_peaks):
+        prefix = 'Peak' if max_peaks == 1 else f'Peak {peak + 1}'
+        labels.append({name: query.factor_label(f'{prefix} {names[name]}',
+                                                units[name])
+                       for name in FEATURES})
+    return labels
+
+
+def _experiment_subtype(json_path):
+    info = cache.load_json(json_path).get('nodeInformation') or dict()
+    return info.get('experimentSubType')
+
+
+def _assays(nodes, x, y, experiment_subtype):
+    '''The (node path, plan, datafile) of assays with both columns.'''
+    for node in nodes:
+        json_path = getattr(node, 'json_path', node)
+        if (experiment_subtype is not None
+                and _experiment_subtype(json_path) != experiment_subtype):
+            continue
+        folder = os.path.dirname(json_path)
+        for plan in query.node_plans(json_path):
+            if x in plan.csv_columns and y in plan.csv_columns:
+                yield json_path, plan, utils.data_file_path(plan.data_file,
+                                                         folder)
+
+
+def _read_spectrum(csv_path, x_index, y_index):
+    data_frame = cache.read_csv(csv_path, skiprows=1, header=None)
+    return (data_frame.iloc[:, x_index].to_numpy(dtype=np.float64),
+            data_frame.iloc[:, y_index].to_numpy(dtype=np.float64))
+
+
+def _measure(group, max_peaks, min_height):
+    '''Worker: measure a group of `(key, (x, y))` spectra.'''
+    keys = [key for key, _ in group]
+    x_stack, y_stack = pad(spectrum for _, spectrum in group)
+    features = find_peaks(x_stack, y_stack, max_peaks, min_height)
+    return [(key, {name: features[name][row] for name in FEATURES})
+            for row, key in enumerate(keys)]
+
+
+def extract(nodes, x, y, experiment_subtype=None, max_peaks=1,
+            min_height=0.1, workers=None):
+    '''Measure the peaks of the (x, y) spectrum of every matching assay.
+
+    Args:
+        nodes (list): `DrupalNode` instances, or paths of node `.json` files.
+        x (str): The factor label of the x column, for example
+            `'Measurement (ppm)'`.
+        y (str): The factor label of the intensity column.
+        experiment_subtype (str): Only measure nodes of this subtype.
+        max_peaks (int): The number of peaks to measure per assay.
+        min_height (float): See `find_peaks`.
+        workers (int): Threads measuring groups of assays, defaults to the
+            number of CPUs.
+
+    Returns:
+        dict: Derived factors (as for `query.select`'s `derived`), keyed by
+            `(node path, data_file)`.
+
+    '''
+    labels = feature_labels(x, y, max_peaks)
+    assays, pending = list(), dict()
+    for json_path, plan, csv_path in _assays(nodes, x, y,
+                                             experiment_subtype):
+        try:
+            key = (cache.CSV_CACHE.content_hash(csv_path),
+                   plan.csv_columns[x], plan.csv_columns[y], max_peaks,
+                   min_height)
+        except OSError as error:
+            logger.warning('Could not read datafile %s: %s', csv_path, error)
+            continue
+        assays.append((json_path, plan.data_file, key))
+        with _RESULTS_LOCK:
+            known = key in _RESULTS
+        if not known and key not in pending:
+            pending[key] = csv_path
+
+    if pending:
+        spectra = list()
+        for key, csv_path in pending.items():
+            try:
+                spectra.append((key, _read_spectrum(csv_path, key[1],
+                                                    key[2])))
+            except (OSError, ValueError) as error:
+                logger.warning('Could not measure peaks of %s: %s',
+                               csv_path, error)
+        # Similar lengths are grouped, so little padding is measured.
+        spectra.sort(key=lambda item: len(item[1][0]))
+        workers = min(workers or os.cpu_count() or 1, len(spectra)) or 1
+        step = -(-len(spectra) // workers) if spectra else 1
+        groups = [spectra[start:start + step]
+                  for start in range(0, len(spectra), step)]
+        with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+            measured = executor.map(
+                lambda group: _measure(group, max_peaks, min_height), groups)
+            for results in measured:
+                with _RESULTS_LOCK:
+                    for key, features in results:
+                        _RESULTS[key] = features
+                        _RESULTS.move_to_end(key)
+        with _RESULTS_LOCK:
+            while len(_RESULTS) > _MAX_RESULTS:
+                _RESULTS.popitem(last=False)
+
+    derived = dict()
+    for json_path, data_file, key in assays:
+        with _RESULTS_LOCK:
+            features = _RESULTS.get(key)
+        if features is None:
+            continue
+        derived[(json_path, data_file)] = collections.OrderedDict(
+            (peak_labels[name], float(features[name][peak]))
+            for peak, peak_labels in enumerate(labels)
+            for name in FEATURES)
+    return derived
+
+
+def select(nodes, x, y, experiment_subtype=None, max_peaks=1,
+           min_height=0.1, workers=None, **select_kwargs):
+    '''`query.select` with the peak features of each assay as factors.
+
+    See `extract` for the arguments, the remaining keyword arguments are
+    passed to `query.select`. Only nodes of `experiment_subtype` are
+    selected, when it is given.
+
+    '''
+    if experiment_subtype is not None:
+        nodes = [node for node in nodes if _experiment_subtype(
+            getattr(node, 'json_path', node)) == experiment_subtype]
+    derived = extract(nodes, x, y, None, max_peaks, min_height, workers)
+    return query.select(
+        nodes, derived=lambda json_path, plan: derived.get(
+            (json_path, plan.data_file)),
+        **select_kwargs)
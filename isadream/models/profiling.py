@@ -0,0 +1,226 @@
+'''Opt-in per-stage profiling of node loading.
+
+The stages of `DrupalNode.__init__` and the property builders of the model
+classes are wrapped with `stage()`. When profiling is enabled every stage
+records its wall time and, optionally, the net memory it allocated as
+reported by `tracemalloc`. When it is disabled `stage()` returns a shared
+no-op context manager and nothing is recorded.
+
+Stages may nest, each record holds the inclusive time (and memory) of its
+stage, the time spent outside of nested stages (`self_seconds`,
+`self_memory_bytes`) and the name of the enclosing stage (`parent`).
+`breakdown` sums self times, so a nested stage is not counted twice.
+
+Profiling is enabled for the whole process by setting the `IDREAM_PROFILE`
+environment variable (`IDREAM_PROFILE=memory` also traces allocations). Only
+the last `IDREAM_PROFILE_RECORDS` records of each thread are then kept, so a
+profiled server does not grow without bound. Profiling may also be enabled
+for a block of code::
+
+    from isadream.models import profiling
+
+    with profiling.profile() as records:
+        node = DrupalNode(path)
+        node.samples
+
+    print(profiling.breakdown(records))
+
+'''
+
+# Generic Python imports.
+import os
+import json
+import time
+import logging
+import threading
+import collections
+import tracemalloc
+
+logger = logging.getLogger(__name__)
+
+
+class _State(threading.local):
+    '''Per thread profiling switch and record list.'''
+
+    def __init__(self):
+        self.enabled = _ENV_ENABLED
+        self.trace_memory = _ENV_MEMORY
+        self.records = collections.deque(maxlen=MAX_RECORDS)
+        self.stack = list()
+
+
+_ENV_SETTING = os.environ.get('IDREAM_PROFILE', '').lower()
+_ENV_ENABLED = _ENV_SETTING not in ('', '0', 'false', 'no')
+_ENV_MEMORY = _ENV_SETTING == 'memory'
+MAX_RECORDS = int(os.environ.get('IDREAM_PROFILE_RECORDS', 10000))
+
+if _ENV_MEMORY and not tracemalloc.is_tracing():
+    tracemalloc.start()
+
+_state = _State()
+
+
+class _NullStage:
+    '''The do-nothing context manager handed out while disabled.'''
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+class _Stage:
+
+    __slots__ = ('name', 'node', '_start', '_memory', '_nested_seconds',
+                 '_nested_memory')
+
+    def __init__(self, name, node):
+        self.name = name
+        self.node = node
+
+    def __enter__(self):
+        self._memory = None
+        self._nested_seconds = 0.0
+        self._nested_memory = 0
+        if _state.trace_memory and tracemalloc.is_tracing():
+            self._memory = tracemalloc.get_traced_memory()[0]
+        _state.stack.append(self)
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        seconds = time.perf_counter() - self._start
+        stack = _state.stack
+        if stack and stack[-1] is self:
+            stack.pop()
+        parent = stack[-1] if stack else None
+        record = dict(node=self.node, stage=self.name, seconds=seconds,
+                      self_seconds=seconds - self._nested_seconds,
+                      memory_bytes=None, self_memory_bytes=None,
+                      parent=None if parent is None else parent.name)
+        if self._memory is not None:
+            memory = tracemalloc.get_traced_memory()[0] - self._memory
+            record['memory_bytes'] = memory
+            record['self_memory_bytes'] = memory - self._nested_memory
+        if parent is not None:
+            parent._nested_seconds += seconds
+            parent._nested_memory += record['memory_bytes'] or 0
+        _state.records.append(record)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(json.dumps(record))
+        return False
+
+
+def is_enabled():
+    return _state.enabled
+
+
+def stage(name, node=None):
+    '''Time a stage of node loading.
+
+    Args:
+        name (str): The stage name, for example `'json_normalize'`.
+        node (str): Identifies the node, usually its `.json` path.
+
+    Returns:
+        A context manager.
+
+    '''
+    if not _state.enabled:
+        return _NULL_STAGE
+    return _Stage(name, node)
+
+
+def enable(trace_memory=False):
+    '''Turn profiling on for the current thread.
+
+    Args:
+        trace_memory (bool): Also record net allocations with tracemalloc,
+            this is started if needed and slows loading down noticeably.
+
+    '''
+    _state.enabled = True
+    _state.trace_memory = trace_memory
+    if trace_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+def disable():
+    '''Turn profiling off for the current thread.'''
+    _state.enabled = False
+
+
+def records():
+    '''The stage records collected on the current thread.'''
+    return list(_state.records)
+
+
+def clear():
+    _state.records.clear()
+
+
+class profile:
+    '''Context manager enabling profiling for a block of code.
+
+    Yields the list the stage records of the block are appended to.
+
+    '''
+
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+
+    def __enter__(self):
+        self._previous = (_state.enabled, _state.trace_memory,
+                          _state.records)
+        self._started_tracing = (self.trace_memory
+                                 and not tracemalloc.is_tracing())
+        _state.records = list()
+        enable(self.trace_memory)
+        return _state.records
+
+    def __exit__(self, *exc_info):
+        if self._started_tracing:
+            tracemalloc.stop()
+        _state.enabled, _state.trace_memory, _state.records = self._previous
+        return False
+
+
+def to_dataframe(stage_records=None):
+    '''The stage records as a pandas DataFrame, one row per stage run.'''
+    # Imported here so that this module stays cheap to import.
+    import pandas as pd
+
+    if stage_records is None:
+        stage_records = records()
+    return pd.DataFrame(
+        list(stage_records),
+        columns=['node', 'stage', 'parent', 'seconds', 'self_seconds',
+                 'memory_bytes', 'self_memory_bytes'])
+
+
+def breakdown(stage_records=None, value='self_seconds'):
+    '''A per-node breakdown: the total of `value` for each node and stage.
+
+    The default, self time, excludes the time of nested stages, so the
+    columns of a node add up to its total time.
+
+    Returns:
+        DataFrame: Indexed by node, with one column per stage.
+
+    '''
+    frame = to_dataframe(stage_records)
+    frame['node'] = frame['node'].fillna('')
+    return frame.pivot_table(index='node', columns='stage', values=value,
+                             aggfunc='sum', fill_value=0)
+
+
+def log_records(stage_records=None, level=logging.INFO):
+    '''Emit each record as a JSON structured log line.'''
+    if stage_records is None:
+        stage_records = records()
+    for record in stage_records:
+        logger.log(level, json.dumps(record))
@@ -0,0 +1,293 @@
+'''Select assay data by species and factors as NumPy-backed columns.
+
+The model classes hand back lists of Python objects (`[Factor(...)]`,
+`[Sample(...)]`) and the apps rebuild frames from them row by row. `select`
+goes from node documents straight to column arrays instead:
+
+    1. Each node document is reduced once to a plan per assay: the species
+       of its samples, the factors given as a constant value and the factors
+       read from a `csvColumnIndex`. Plans are kept in the content cache with
+       the parsed document.
+    2. Species and constant factor predicates are checked against the plans,
+       so datafiles of assays that cannot match are never read.
+    3. Only the datafile columns that are requested or filtered on are taken
+       from the (shared) cached frame, rows are filtered with NumPy masks,
+       and the survivors are copied once into a `merge.ColumnBlock`.
+
+Factors are addressed by a label built from their type and unit, see
+`factor_label`. Where an assay has several factors with the same label the
+most specific one wins (assay samples over assay parameters over node
+samples over node factors).
+
+::
+
+    from isadream.models import query
+
+    block = query.select(json_paths, species='OH-',
+                         factors={'Measurement Condition (Molar)': (1, 5)},
+                         columns=['Measurement (ppm)'])
+    source = ColumnDataSource(data=dict(block))
+
+'''
+
+# Generic Python imports.
+import os
+import logging
+import collections
+
+# Data science imports.
+from .lazy import lazy_import
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+# Local imports.
+from . import utils
+from . import cache
+from . import merge
+
+logger = logging.getLogger(__name__)
+
+# The factor scopes of a sample, and of a source, in the json structure.
+_SAMPLE_FACTORS = ('studySampleFactors', 'AssaySampleFactors')
+_SOURCE_FACTORS = ('materialCharacteristic',)
+
+_Plan = collections.namedtuple(
+    '_Plan', ('data_file', 'species', 'csv_columns', 'constants'))
+
+
+def factor_label(factor_type, unit_ref=None):
+    '''The column label of a factor, for example `'Measurement (ppm)'`.'''
+    if unit_ref is None:
+        return str(factor_type)
+    return f'{factor_type} ({unit_ref})'
+
+
+def _factor_entry(factor):
+    '''Split a factor into its label and a `(kind, value)` pair.'''
+    label = factor_label(factor.get('factorType'), factor.get('unitRef'))
+    csv_index = factor.get('csvColumnIndex')
+    if csv_index is not None:
+        try:
+            csv_index = int(csv_index)
+        except (TypeError, ValueError):
+            csv_index = -1
+        if csv_index >= 0:
+            return label, ('csv', csv_index)
+        logger.warning('Ignoring the csvColumnIndex %r of factor %r.',
+                       factor.get('csvColumnIndex'), label)
+    for key in ('decimalValue', 'stringValue', 'RefValue'):
+        if factor.get(key) is not None:
+            return label, ('value', factor[key])
+    return label, None
+
+
+def _add_factors(entries, factors):
+    for factor in factors or ():
+        label, entry = _factor_entry(factor)
+        if entry is not None:
+            entries[label] = entry
+
+
+def _add_sample(entries, species, sample):
+    '''Add the factors and species of a sample, and of its sources.'''
+    species.update(entry.get('speciesReference')
+                   for entry in sample.get('species') or ())
+    for scope in _SAMPLE_FACTORS:
+        _add_factors(entries, sample.get(scope))
+    for source in sample.get('sources') or ():
+        species.update(entry.get('speciesReference')
+                       for entry in source.get('species') or ())
+        for scope in _SOURCE_FACTORS:
+            _add_factors(entries, source.get(scope))
+
+
+def build_plans(document):
+    '''Reduce a node document to a `_Plan` for each assay with a datafile.'''
+    node_entries = collections.OrderedDict()
+    node_species = set()
+    _add_factors(node_entries, document.get('studyFactors'))
+    for sample in document.get('studySamples') or ():
+        _add_sample(node_entries, node_species, sample)
+
+    plans = list()
+    for assay in document.get('assays') or ():
+        data_file = assay.get('dataFile')
+        if not data_file:
+            continue
+        entries = collections.OrderedDict(node_entries)
+        species = set(node_species)
+        _add_factors(entries, assay.get('assayParameters'))
+        for sample in assay.get('samples') or ():
+            _add_sample(entries, species, sample)
+
+        csv_columns = collections.OrderedDict(
+            (label, value) for label, (kind, value) in entries.items()
+            if kind == 'csv')
+        constants = collections.OrderedDict(
+            (label, value) for label, (kind, value) in entries.items()
+            if kind == 'value')
+        species.discard(None)
+        plans.append(_Plan(data_file, frozenset(species), csv_columns,
+                           constants))
+    return plans
+
+
+def node_plans(json_path):
+    '''The assay plans of a node file, built once per file contents.'''
+    digest, document = cache.load_json_entry(json_path)
+    return cache.CONTENT_CACHE.derive(
+        digest, cache.json_kind(), ('query', 'plans'),
+        lambda: build_plans(document))
+
+
+def _is_range(predicate):
+    return isinstance(predicate, tuple) and len(predicate) == 2
+
+
+def _is_collection(predicate):
+    return isinstance(predicate, (list, set, frozenset))
+
+
+def matches(value, predicate):
+    '''Test a constant value against a predicate.
+
+    A predicate is a value to compare equal to, a list or set of accepted
+    values, or a `(low, high)` tuple of inclusive bounds where either bound
+    may be None.
+
+    '''
+    if _is_range(predicate):
+        low, high = predicate
+        try:
+            return ((low is None or value >= low)
+                    and (high is None or value <= high))
+        except TypeError:
+            return False
+    if _is_collection(predicate):
+        return value in predicate
+    return value == predicate
+
+
+def mask(array, predicate):
+    '''Evaluate a predicate (see `matches`) over an array of values.'''
+    if _is_range(predicate):
+        low, high = predicate
+        result = np.ones(len(array), dtype=bool)
+        if low is not None:
+            result &= array >= low
+        if high is not None:
+            result &= array <= high
+        return result
+    if _is_collection(predicate):
+        return np.isin(array, list(predicate))
+    return array == predicate
+
+
+def _as_set(values):
+    if values is None or isinstance(values, str):
+        return None if values is None else {values}
+    return set(values)
+
+
+def _json_path(node):
+    return getattr(node, 'json_path', node)
+
+
+def _assay_frame(plan, folder, factors, columns):
+    '''The filtered columns of one assay, or None if no row can match.'''
+    labels = list(plan.csv_columns) + list(plan.constants)
+    wanted = labels if columns is None else [
+        label for label in columns if label in plan.csv_columns
+        or label in plan.constants]
+
+    # Predicates on constants, or on factors the assay does not have, are
+    # decided without reading the datafile.
+    row_filters = dict()
+    for label, predicate in factors.items():
+        if label in plan.csv_columns:
+            row_filters[label] = predicate
+        elif label not in plan.constants or not matches(
+                plan.constants[label], predicate):
+            return None
+
+    needed = [label for label in plan.csv_columns
+              if label in row_filters or label in wanted]
+    data_frame = cache.read_csv(utils.data_file_path(plan.data_file, folder),
+                                skiprows=1, header=None)
+    arrays = collections.OrderedDict()
+    for label in needed:
+        index = plan.csv_columns[label]
+        if index >= data_frame.shape[1]:
+            if label in row_filters:
+                return None
+            continue
+        arrays[label] = data_frame.iloc[:, index].to_numpy()
+
+    selected = np.ones(len(data_frame), dtype=bool)
+    for label, predicate in row_filters.items():
+        selected &= mask(arrays[label], predicate)
+    if not selected.any():
+        return None
+    if not selected.all():
+        arrays = collections.OrderedDict(
+            (label, array[selected]) for label, array in arrays.items())
+
+    frame = pd.DataFrame(
+        collections.OrderedDict((label, arrays[label]) for label in wanted
+                                if label in arrays),
+        index=pd.RangeIndex(int(selected.sum())), copy=False)
+    constants = {label: plan.constants[label] for label in wanted
+                 if label in plan.constants}
+    return frame, constants
+
+
+def select(nodes, species=None, factors=None, columns=None, derived=None):
+    '''Select assay rows from nodes into one NumPy-backed `ColumnBlock`.
+
+    Args:
+        nodes (list): `DrupalNode` instances, or paths of node `.json` files.
+        species (str or list[str]): Keep assays with a sample or source of
+            any of these species references.
+        factors (dict): Predicates keyed by factor label, see `matches`.
+            Predicates on constant factors select whole assays, predicates on
+            datafile columns select rows.
+        columns (list[str]): The factor labels to return, by default every
+            factor of the selected assays.
+        derived (callable): Called with the node path and the `_Plan` of
+            each assay, returns a dict of factors computed from the assay
+            (see `isadream.models.peaks`). They are treated as constant
+            factors of the assay, and may be filtered on.
+
+    Returns:
+        merge.ColumnBlock: The selected rows, with a `metadata_key` column
+            holding the node path and a `data_file` column holding the
+            datafile of each row. Use `ColumnBlock.to_frame()` for a pandas
+            dataframe, or pass `dict(block)` to a `ColumnDataSource`.
+
+    '''
+    species = _as_set(species)
+    factors = dict(factors or ())
+
+    frames, constants = list(), list()
+    for node in nodes:
+        json_path = _json_path(node)
+        folder = os.path.dirname(json_path)
+        for plan in node_plans(json_path):
+            if species is not None and not species & plan.species:
+                continue
+            if derived is not None:
+                extra = derived(json_path, plan)
+                if extra:
+                    plan_constants = collections.OrderedDict(plan.constants)
+                    plan_constants.update(extra)
+                    plan = plan._replace(constants=plan_constants)
+            selected = _assay_frame(plan, folder, factors, columns)
+            if selected is None:
+                continue
+            frame, frame_constants = selected
+            frame_constants.update(metadata_key=json_path,
+                                   data_file=plan.data_file)
+            frames.append(frame)
+            constants.append(frame_constants)
+    return merge.merge_frames(frames, constants)
@@ -0,0 +1,231 @@
+'''Resample many assays onto one shared x grid.
+
+Comparing spectra or trends of different nodes needs a common x axis. An
+outer join on x grows with the number of distinct x values of every assay,
+and is mostly empty. `interpolate` instead evaluates every assay on one
+evenly spaced grid (see `choose_grid`), writing each assay's `np.interp`
+over the grid points within its x range straight into one preallocated
+array. Flattening all assays into a single `np.searchsorted` was measured
+to be slower than these per-assay C loops, for both many short and a few
+long assays.
+
+The result is a dense (assays x grid points) array, NaN outside the x range
+of each assay, which a heatmap (`Resampled.image`) or an overlay of lines
+(`Resampled.lines`) can draw as is::
+
+    from isadream.models import resample
+
+    resampled = resample.resample_assays(json_paths, x='Measurement (ppm)',
+                                         y='Measurement (Intensity)')
+    fig.image(source=ColumnDataSource(resampled.image()), image='image',
+              x='x', y='y', dw='dw', dh='dh', palette='Viridis256')
+
+Grids and resampled arrays of node datafiles are cached by the content
+hashes of the datafiles, so they are only computed again when one changes.
+Cached arrays are shared, and read-only.
+
+'''
+
+# Generic Python imports.
+import os
+import logging
+import threading
+import collections
+
+# Data science imports.
+from .lazy import lazy_import
+
+np = lazy_import('numpy')
+
+# Local imports.
+from . import cache
+from . import query
+from . import utils
+
+logger = logging.getLogger(__name__)
+
+BOUNDS = ('intersection', 'union')
+
+_CACHE = collections.OrderedDict()
+_CACHE_LOCK = threading.Lock()
+_MAX_CACHED = 256
+
+
+class Resampled(collections.namedtuple(
+        'Resampled', ['grid', 'values', 'labels'])):
+    '''Assays resampled on a common grid.
+
+    Attributes:
+        grid (ndarray): The shared x values.
+        values (ndarray): An (assays x grid points) array of y values.
+        labels (list): A label for each assay, `(node path, data_file)` for
+            node assays.
+
+    '''
+
+    __slots__ = ()
+
+    def image(self):
+        '''`ColumnDataSource` data for a Bokeh `image` glyph, one assay per
+        image row. Empty if the grid is, as when the spectra share no x
+        range.'''
+        if not len(self.grid) or not len(self.values):
+            return dict(image=[], x=[], y=[], dw=[], dh=[])
+        return dict(image=[self.values], x=[self.grid[0]], y=[0],
+                    dw=[self.grid[-1] - self.grid[0]],
+                    dh=[len(self.values)])
+
+    def lines(self):
+        '''`ColumnDataSource` data for a Bokeh `multi_line` overlay.'''
+        if not len(self.grid):
+            return dict(xs=[], ys=[], label=[])
+        return dict(xs=[self.grid] * len(self.values), ys=list(self.values),
+                    label=[str(label) for label in self.labels])
+
+
+def choose_grid(spectra, points=None, bounds='intersection'):
+    '''A shared, evenly spaced grid for (x, y) spectra.
+
+    Args:
+        spectra (list): (x, y) pairs.
+        points (int): The grid size, by default the median number of points
+            of the spectra.
+        bounds (str): `'intersection'` spans the x range every spectrum
+            covers, `'union'` the x range any spectrum covers.
+
+    '''
+    if bounds not in BOUNDS:
+        raise ValueError(f'Unknown grid bounds {bounds!r}, choose from '
+                         f'{BOUNDS}.')
+    lows, highs, lengths = list(), list(), list()
+    for x, _ in spectra:
+        x = np.asarray(x, dtype=np.float64)
+        x = x[np.isfinite(x)]
+        if len(x):
+            lows.append(x.min())
+            highs.append(x.max())
+            lengths.append(len(x))
+    if not lengths:
+        return np.empty(0)
+    if bounds == 'intersection':
+        low, high = max(lows), min(highs)
+    else:
+        low, high = min(lows), max(highs)
+    if points is None:
+        points = int(np.median(lengths))
+    if high < low:
+        # The spectra share no x range.
+        return np.empty(0)
+    return np.linspace(low, high, max(points, 2) if high > low else 1)
+
+
+def interpolate(spectra, grid):
+    '''Linearly interpolate every (x, y) spectrum on grid.
+
+    Returns:
+        ndarray: An (spectra x grid points) array, NaN outside the x range
+            of each spectrum.
+
+    '''
+    grid = np.asarray(grid, dtype=np.float64)
+    values = np.full((len(spectra), len(grid)), np.nan)
+    if not len(grid):
+        return values
+    for row, (x, y) in enumerate(spectra):
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        keep = np.isfinite(x) & np.isfinite(y)
+        if not keep.all():
+            x, y = x[keep], y[keep]
+        if not len(x):
+            continue
+        if (np.diff(x) < 0).any():
+            # Datafiles are usually sorted on x already.
+            order = np.argsort(x, kind='stable')
+            x, y = x[order], y[order]
+        start = int(np.searchsorted(grid, x[0], side='left'))
+        stop = int(np.searchsorted(grid, x[-1], side='right'))
+        values[row, start:stop] = np.interp(grid[start:stop], x, y)
+    return values
+
+
+def resample(spectra, points=None, bounds='intersection', grid=None,
+             labels=None):
+    '''Resample (x, y) spectra on a common grid, see `choose_grid`.'''
+    spectra = list(spectra)
+    if grid is None:
+        grid = choose_grid(spectra, points, bounds)
+    labels = list(range(len(spectra))) if labels is None else list(labels)
+    return Resampled(np.asarray(grid, dtype=np.float64),
+                     interpolate(spectra, grid), labels)
+
+
+def _cached(key, factory):
+    with _CACHE_LOCK:
+        value = _CACHE.get(key)
+        if value is not None:
+            _CACHE.move_to_end(key)
+            return value
+    value = factory()
+    # Shared by every caller.
+    value.flags.writeable = False
+    with _CACHE_LOCK:
+        _CACHE[key] = value
+        while len(_CACHE) > _MAX_CACHED:
+            _CACHE.popitem(last=False)
+    return value
+
+
+def resample_assays(nodes, x, y, points=None, bounds='intersection',
+                    grid=None):
+    '''Resample the (x, y) columns of every assay of nodes that has both.
+
+    Args:
+        nodes (list): `DrupalNode` instances, or paths of node `.json` files.
+        x, y (str): Factor labels of datafile columns, see `query`.
+        points, bounds: See `choose_grid`, used when grid is None.
+        grid (array): Use this grid instead of choosing one.
+
+    Returns:
+        Resampled: Labelled by `(node path, data_file)`.
+
+    '''
+    labels, paths, keys = list(), list(), list()
+    for node in nodes:
+        json_path = getattr(node, 'json_path', node)
+        folder = os.path.dirname(json_path)
+        for plan in query.node_plans(json_path):
+            if x not in plan.csv_columns or y not in plan.csv_columns:
+                continue
+            csv_path = utils.data_file_path(plan.data_file, folder)
+            try:
+                digest = cache.CSV_CACHE.content_hash(csv_path)
+            except OSError as error:
+                logger.warning('Could not read datafile %s: %s', csv_path,
+                               error)
+                continue
+            labels.append((json_path, plan.data_file))
+            paths.append(csv_path)
+            keys.append((digest, plan.csv_columns[x], plan.csv_columns[y]))
+
+    def read(columns):
+        spectra = list()
+        for csv_path, key in zip(paths, keys):
+            data_frame = cache.read_csv(csv_path, skiprows=1, header=None)
+            spectra.append(tuple(
+                data_frame.iloc[:, key[column]].to_numpy(dtype=np.float64)
+                for column in columns))
+        return spectra
+
+    if grid is None:
+        # The grid only depends on the x columns.
+        grid = _cached(
+            ('grid', tuple(key[:2] for key in keys), points, bounds),
+            lambda: choose_grid([(x_values, x_values)
+                                 for x_values, in read((1,))],
+                                points, bounds))
+    grid = np.asarray(grid, dtype=np.float64)
+    values = _cached(
+        ('values', tuple(keys), cache.hash_bytes(grid.tobytes())),
+        lambda: interpolate(read((1, 2)), grid))
+    return Resampled(grid, values, labels)
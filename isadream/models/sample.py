@@ -1,6 +1,11 @@
+# Generic Python imports.
+import logging
 
+# Data science imports.
+from .lazy import lazy_import
 
-import pandas as pd
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
 
 
 from . import utils
@@ -9,27 +14,60 @@ from .factor import Factor
 from .species import Species
 from .source import Source
 
+logger = logging.getLogger(__name__)
+
+# The sections of a sample frame holding factors.
+FACTOR_SECTIONS = ('studySampleFactors', 'AssaySampleFactors')
+
 
 class Sample:
+    '''A sample of a node or assay.
+
+    The sample frame is split into its sections once, when the sample is
+    built, so that the accessors below return prebuilt values. These are
+    shared and must not be modified.
+
+    '''
 
     def __init__(self, sample_df):
         self.sample_df = sample_df
+        sections = utils.split_sections(sample_df)
+
+        # Sample frames are grouped by name, the columns carry it.
+        self.name = sample_df.columns[0] if len(sample_df.columns) else None
+
+        species = utils.section_records(
+            sections.get('species', pd.DataFrame()))
+        self._species = [Species(data) for data in species]
+        # The species as arrays, for vectorized use.
+        self.species_references = np.array(
+            [entry.reference for entry in self._species], dtype=object)
+        self.stoichiometries = np.array(
+            [entry.stoichiometry for entry in self._species], dtype=float)
+
+        factors = [record for section in FACTOR_SECTIONS if section in sections
+                   for record in utils.section_records(sections[section])]
+        self.factor_table = pd.DataFrame.from_records(factors)
+        self._factors = [Factor(data) for data in factors]
+
+        self._sources = list()
+        if 'sources' in sections:
+            self._sources = Source.from_section(sections['sources'])
+
+        if utils.DEBUG:
+            logger.debug('Sample %s species: %s', self.name, species)
 
     def __str__(self):
         return str(self.sample_df)
 
-    # @property
-    # def sources(self):
-    #     sources = self.sample_df.xs('sources').to_dict('records')
-    #     return [Source(data) for data in sources]
+    @property
+    def sources(self):
+        return self._sources
 
     @property
     def species(self):
-        species = self.sample_df.xs('species').to_dict('records')
-        print(species)
-        return [Species(data) for data in species]
+        return self._species
 
     @property
     def factors(self):
-        factors = self.sample_df.xs('studySampleFactors').to_dict('records')
-        return [Factor(data) for data in factors]
+        return self._factors
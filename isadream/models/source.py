@@ -1,20 +1,50 @@
+from . import utils
+
 from .species import Species
 from .factor import Factor
 
 
 class Source:
-    '''
+    '''A source material of a sample.
+
+    Like `Sample`, the frame is split into its sections once, when built.
+
     '''
 
     def __init__(self, source_df):
         self.df = source_df
+        sections = utils.split_sections(source_df)
+
+        self.name = None
+        if 'sourceName' in sections:
+            self.name = sections['sourceName'].iloc[0].dropna().iloc[0]
+
+        self._species = [
+            Species(data) for data in
+            utils.section_records(sections['species'])] \
+            if 'species' in sections else list()
+        self._factors = [
+            Factor(data) for data in
+            utils.section_records(sections['materialCharacteristic'])] \
+            if 'materialCharacteristic' in sections else list()
+
+    @classmethod
+    def from_section(cls, sources_df):
+        '''Build a `Source` for each source named in a sample's `sources`
+        section.
+
+        '''
+        sections = utils.split_sections(sources_df)
+        if 'sourceName' not in sections:
+            return [cls(sources_df)]
+        names = sections['sourceName'].iloc[0]
+        return [cls(sources_df.loc[:, (names == name).to_numpy()])
+                for name in names.dropna().unique()]
 
     @property
     def species(self):
-        species = self.df.xs('species').to_dict('records')
-        return [Species(data) for data in species]
+        return self._species
 
     @property
     def factors(self):
-        factors = self.df.xs('materialCharacteristic').to_dict('records')
-        return [Factor(data) for data in factors]
+        return self._factors
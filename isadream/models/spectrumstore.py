@@ -0,0 +1,252 @@
+'''A chunked, memory-mapped binary store of assay datafiles.
+
+Datafiles are only kept as `.csv` text, so showing any part of a large
+spectrum means parsing the whole file. `SpectrumStore` converts a datafile,
+as read by `utils.load_csv`, once into a folder of binary NumPy columns:
+
+    + every column as a float64 `.npy` file, with the rows sorted on the x
+      column (ppm, wavenumber, ...) and rows without an x value last,
+    + a chunk index holding the first and last x value of each chunk of
+      `chunk_rows` rows.
+
+The columns are memory-mapped when opened. Reading an x range looks up the
+overlapping chunks in the index, and only the pages of those chunks are
+ever read from disk, however large the file is::
+
+    spectrum = spectrumstore.open_spectrum(assay.data_path, x=0)
+    window = spectrum.read(3.5, 4.0)
+
+Folders are named by the content hash of the datafile (and the x column),
+so copies of a file in many session folders share one store entry, and an
+edited file gets a new one.
+
+Attributes:
+    STORE_PATH (str): The default folder of the store, from the
+        `IDREAM_SPECTRUM_STORE` environment variable.
+    SPECTRUM_STORE (SpectrumStore): The process wide store used by
+        `open_spectrum`.
+
+'''
+
+# Generic Python imports.
+import os
+import json
+import shutil
+import logging
+import tempfile
+import threading
+import collections
+
+# Data science imports.
+from .lazy import lazy_import
+
+np = lazy_import('numpy')
+
+# Local imports.
+from . import cache
+
+logger = logging.getLogger(__name__)
+
+STORE_PATH = os.environ.get(
+    'IDREAM_SPECTRUM_STORE',
+    os.path.join(tempfile.gettempdir(), 'isadream_spectra'))
+
+CHUNK_ROWS = 4096
+
+_FORMAT_VERSION = 1
+
+
+def _column_file(column):
+    return f'column_{column}.npy'
+
+
+class Spectrum:
+    '''The memory-mapped columns of one stored datafile.
+
+    Attributes:
+        columns (list): The column labels, as in the `load_csv` frame.
+        x (column label): The column the rows are sorted on.
+        length (int): The number of rows.
+        finite_length (int): The number of rows with an x value, these come
+            first.
+
+    '''
+
+    def __init__(self, folder):
+        with open(os.path.join(folder, 'meta.json')) as meta_file:
+            meta = json.load(meta_file)
+        self.folder = folder
+        self.columns = meta['columns']
+        self.x = meta['x']
+        self.length = meta['rows']
+        self.finite_length = meta['finite_rows']
+        self.chunk_rows = meta['chunk_rows']
+
+        self._arrays = {
+            column: np.load(os.path.join(folder, _column_file(position)),
+                            mmap_mode='r')
+            for position, column in enumerate(self.columns)}
+        index = np.load(os.path.join(folder, 'chunks.npy'))
+        self.chunk_lows, self.chunk_highs = index[0], index[1]
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, column):
+        '''The whole memory-mapped, read-only column.'''
+        return self._arrays[column]
+
+    def chunks(self, start=None, end=None):
+        '''The chunk numbers overlapping the x range from start to end.'''
+        first = 0 if start is None else int(
+            np.searchsorted(self.chunk_highs, start, side='left'))
+        last = len(self.chunk_lows) if end is None else int(
+            np.searchsorted(self.chunk_lows, end, side='right'))
+        return range(first, max(first, last))
+
+    def rows(self, start=None, end=None):
+        '''The slice of rows with start <= x <= end, None for open bounds.
+
+        Only the chunks at either end of the range are searched.
+
+        '''
+        if start is None and end is None:
+            return slice(0, self.length)
+        chunks = self.chunks(start, end)
+        if not chunks:
+            return slice(0, 0)
+        x_values = self._arrays[self.x]
+        low = chunks.start * self.chunk_rows
+        high = min(chunks.stop * self.chunk_rows, self.finite_length)
+        if start is not None:
+            stop = min(low + self.chunk_rows, high)
+            low += int(np.searchsorted(x_values[low:stop], start,
+                                       side='left'))
+        if end is not None:
+            first = max((chunks.stop - 1) * self.chunk_rows, low)
+            high = first + int(np.searchsorted(x_values[first:high], end,
+                                               side='right'))
+        return slice(low, max(low, high))
+
+    def read(self, start=None, end=None, columns=None):
+        '''Copy the columns of the rows with start <= x <= end.
+
+        Args:
+            start (float): The lower x bound, or None.
+            end (float): The upper x bound, or None.
+            columns (list): The columns to read, by default every column.
+
+        Returns:
+            dict: NumPy arrays keyed by column label, sorted on x.
+
+        '''
+        rows = self.rows(start, end)
+        return {column: np.array(self._arrays[column][rows])
+                for column in (self.columns if columns is None else columns)}
+
+
+class SpectrumStore:
+    '''Binary copies of datafiles in a folder, keyed by content hash.
+
+    Entries are written to a temporary folder and renamed into place, so
+    several processes may build the same entry concurrently.
+
+    '''
+
+    def __init__(self, root=STORE_PATH, chunk_rows=CHUNK_ROWS,
+                 max_open=256):
+        '''
+
+        Args:
+            root (str): The folder holding the store entries.
+            chunk_rows (int): The number of rows in a chunk.
+            max_open (int): The number of opened `Spectrum` instances kept.
+
+        '''
+        self.root = root
+        self.chunk_rows = chunk_rows
+        self.max_open = max_open
+        self._open = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def folder(self, csv_path, x=0):
+        '''The store folder of a datafile, which may not exist yet.'''
+        digest = cache.CSV_CACHE.content_hash(csv_path)
+        return os.path.join(self.root, f'{digest}-x{x}')
+
+    def open(self, csv_path, x=0):
+        '''Return the stored `Spectrum` of a datafile, building it if needed.
+
+        Args:
+            csv_path (str): The `.csv` datafile.
+            x (int): The position of the column to sort and range-read on.
+
+        '''
+        folder = self.folder(csv_path, x)
+        with self._lock:
+            spectrum = self._open.get(folder)
+            if spectrum is not None:
+                self._open.move_to_end(folder)
+                return spectrum
+
+        if not os.path.exists(os.path.join(folder, 'meta.json')):
+            self.build(csv_path, folder, x)
+        spectrum = Spectrum(folder)
+        with self._lock:
+            self._open[folder] = spectrum
+            while len(self._open) > self.max_open:
+                self._open.popitem(last=False)
+        return spectrum
+
+    def build(self, csv_path, folder, x=0):
+        '''Convert a datafile into the store entry `folder`.'''
+        data_frame = cache.read_csv(csv_path, skiprows=1, header=None)
+        if x not in data_frame.columns:
+            raise ValueError(f'{csv_path} has no column {x!r}.')
+        try:
+            arrays = [data_frame[column].to_numpy(dtype=np.float64)
+                      for column in data_frame.columns]
+        except (TypeError, ValueError):
+            raise ValueError(f'{csv_path} has non-numeric columns and '
+                             f'cannot be stored as a spectrum.') from None
+
+        x_values = arrays[list(data_frame.columns).index(x)]
+        # A stable sort keeps the file order of equal x values, NaN last.
+        order = np.argsort(x_values, kind='mergesort')
+        sorted_x = x_values[order]
+        finite_rows = int(np.count_nonzero(~np.isnan(sorted_x)))
+        starts = np.arange(0, finite_rows, self.chunk_rows)
+        stops = np.minimum(starts + self.chunk_rows, finite_rows) - 1
+        chunks = np.vstack([sorted_x[starts], sorted_x[stops]])
+
+        os.makedirs(self.root, exist_ok=True)
+        building = tempfile.mkdtemp(dir=self.root, prefix='.building-')
+        try:
+            for position, values in enumerate(arrays):
+                np.save(os.path.join(building, _column_file(position)),
+                        values[order])
+            np.save(os.path.join(building, 'chunks.npy'), chunks)
+            meta = dict(version=_FORMAT_VERSION, source=csv_path,
+                        columns=[int(column) for column in data_frame.columns],
+                        x=x, rows=len(data_frame), finite_rows=finite_rows,
+                        chunk_rows=self.chunk_rows)
+            # Written last, an entry with `meta.json` is complete.
+            with open(os.path.join(building, 'meta.json'), 'w') as meta_file:
+                json.dump(meta, meta_file)
+            os.rename(building, folder)
+        except OSError:
+            shutil.rmtree(building, ignore_errors=True)
+            if not os.path.exists(os.path.join(folder, 'meta.json')):
+                raise
+            # Another process stored the same contents first.
+        logger.debug('Stored %s (%d rows) in %s', csv_path, len(data_frame),
+                     folder)
+        return folder
+
+
+SPECTRUM_STORE = SpectrumStore()
+
+
+def open_spectrum(csv_path, x=0, store=None):
+    '''The `Spectrum` of a datafile from the process wide store.'''
+    return (store or SPECTRUM_STORE).open(csv_path, x)
@@ -7,12 +7,20 @@ import os
 import itertools
 
 # Data science imports.
-import pandas as pd
+from .lazy import lazy_import
+
+pd = lazy_import('pandas')
 
 # DEMO_BASE = '/Users/karinharrington/github/isadream/isadream/demo_data/'
 DEMO_BASE = '/home/tylerbiggs/git/isadream/isadream/demo_data/'
 BASE_PATH = os.environ.get('IDREAM_JSON_BASE_PATH', DEMO_BASE)
 
+# The mounted directory Drupal writes the session `J` folders into.
+DATA_MOUNT = os.environ.get('IDREAM_DATA_MOUNT', '/opt/isadream/data')
+
+# Log the contents of model sections as they are built.
+DEBUG = os.environ.get('IDREAM_DEBUG', '').lower() in ('1', 'true', 'yes')
+
 # Demo and test json files.
 SIPOS_DEMO = os.path.join(
     BASE_PATH,
@@ -111,6 +119,72 @@ def try_xs(dataframe, key, level=1):
     except KeyError:
         return None
 
+def split_sections(dataframe):
+    '''Split a sample or source frame into its sections.
+
+    The rows of these frames are keyed by `split_index` tuples, the first
+    level naming the section (`species`, `sources`, a factor scope...).
+
+    Returns:
+        dict: Each section's rows, with the section level dropped.
+
+    '''
+    if not isinstance(dataframe.index, pd.MultiIndex):
+        return dict()
+    return {key: part.droplevel(0)
+            for key, part in dataframe.groupby(level=0, sort=False)}
+
+
+def _field_name(key):
+    '''The field of a section row key, its first string level.'''
+    levels = key if isinstance(key, tuple) else (key,)
+    return next((level for level in levels if isinstance(level, str)), None)
+
+
+def _is_missing(value):
+    return value is None or (isinstance(value, float) and value != value)
+
+
+def section_records(section):
+    '''The distinct records of a section, one dictionary per entry.
+
+    Each column of a section holds one normalized combination of entries,
+    so the same entry is repeated over many columns.
+
+    '''
+    fields = [_field_name(key) for key in section.index]
+    records, seen = list(), set()
+    for position in range(section.shape[1]):
+        record = {field: value
+                  for field, value in zip(fields, section.iloc[:, position])
+                  if field is not None and not _is_missing(value)}
+        key = tuple(sorted((field, repr(value))
+                           for field, value in record.items()))
+        if record and key not in seen:
+            seen.add(key)
+            records.append(record)
+    return records
+
+
+def data_file_path(data_file, folder):
+    '''The path of a datafile referenced by a node.
+
+    Drupal writes datafiles next to the node `.json` file, in folder. The
+    bundled demo keeps its `.json` files in a subfolder of `BASE_PATH` and
+    its datafiles in `BASE_PATH`, which is searched next.
+
+    Returns:
+        str: The first of those paths that exists, else the one in folder.
+
+    '''
+    path = os.path.join(str(folder), str(data_file))
+    if not os.path.exists(path):
+        fallback = os.path.join(str(BASE_PATH), str(data_file))
+        if os.path.exists(fallback):
+            return fallback
+    return path
+
+
 def load_csv(path, base_path=BASE_PATH, **read_csv_kwargs):
     '''Implementation for handling user .csv files.
 
@@ -14,6 +14,7 @@ import abc
 
 # Local imports.
 # from .model import Model
+from . import decimation
 
 
 class View(abc.ABC):
@@ -76,6 +77,17 @@ class View(abc.ABC):
         # TODO: Break these into different properties? Perhaps of the Model class.
         return columns, discrete, continuous, quantileable
 
+    @staticmethod
+    def decimate_dataframe(data_frame, x, y, n_out=2000, method='lttb'):
+        '''Bound the points sent to the browser for a dense (x, y) trace.
+
+        See `isadream.models.decimation`, and its `ZoomDecimator` to decimate
+        again at a higher resolution as the user zooms in.
+        '''
+        if len(data_frame) <= n_out:
+            return data_frame
+        return decimation.decimate_frame(data_frame, x, y, n_out, method)
+
     @staticmethod
     @abc.abstractmethod
     def build_column_data_source():
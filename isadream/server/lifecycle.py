@@ -0,0 +1,82 @@
+'''Process wide services shared by the Bokeh apps of a server.
+
+Every app's `server_lifecycle.py` calls `server_loaded` and
+`server_unloaded`. The apps served by one process share a single watcher,
+catalog, set of cubes, session manager, metrics endpoint and set of live
+streams: they are started when the first app is loaded, and stopped when
+the last one is unloaded, so that no change is handled once per app.
+
+Served by several pre-forked workers, every worker watches the data mount,
+keeps its own copy of the cubes current and reads the live streams, since
+any of them may hold the sessions that use them. Only the primary worker
+writes the node catalog and collects orphaned session folders::
+
+    from isadream.server import lifecycle
+
+    def on_server_loaded(server_context):
+        lifecycle.server_loaded()
+
+    def on_server_unloaded(server_context):
+        lifecycle.server_unloaded()
+
+'''
+
+# Generic Python imports.
+import threading
+
+# Local imports.
+from ..models import catalog
+from ..models import cubes
+from . import metrics
+from . import prefork
+from . import sessions
+from . import streaming
+from . import watcher
+
+_APPS_LOADED = 0
+_LOCK = threading.Lock()
+
+
+def server_loaded():
+    '''Start the shared services, once per process.'''
+    global _APPS_LOADED
+    with _LOCK:
+        _APPS_LOADED += 1
+        if _APPS_LOADED > 1:
+            return
+        # Watch the data mount so new or edited nodes reach live sessions.
+        data_watcher = watcher.start_watcher()
+        primary = prefork.is_primary_worker()
+        if primary:
+            # Keep the node metadata catalog in step with the data mount.
+            node_catalog = catalog.open_catalog()
+            data_watcher.subscribe(None, node_catalog.on_change)
+            json_paths = (row['path'] for row in node_catalog.nodes())
+        else:
+            # Inherited from the parent, which loaded every node.
+            json_paths = ()
+        # Aggregate the summary panels at ingest, not per request.
+        node_cubes = cubes.open_cubes(json_paths)
+        data_watcher.subscribe(None, node_cubes.on_change)
+        # Session folders are removed by a background worker, never on the
+        # IOLoop.
+        sessions.start_manager(collect=primary)
+        # Serve the metrics for scraping on localhost.
+        metrics.start_http_server()
+        # Live instrument streams, configured by IDREAM_STREAMS.
+        streaming.open_streams()
+
+
+def server_unloaded():
+    '''Stop the shared services once the last app is unloaded.'''
+    global _APPS_LOADED
+    with _LOCK:
+        _APPS_LOADED = max(_APPS_LOADED - 1, 0)
+        if _APPS_LOADED:
+            return
+        watcher.stop_watcher()
+        catalog.close_catalog()
+        cubes.close_cubes()
+        sessions.stop_manager()
+        metrics.stop_http_server()
+        streaming.close_streams()
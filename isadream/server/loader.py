@@ -0,0 +1,49 @@
+'''Loading of the nodes held in a session data folder.
+
+Node files and datafiles are read through `isadream.models.cache`, so the
+byte-identical copies Drupal writes into each session folder are parsed and
+held in memory once.
+
+'''
+
+# Generic Python imports.
+import os
+import glob
+import time
+
+# Local imports.
+from ..models import utils
+from ..models import cache
+from ..models.drupalnode import DrupalNode
+from . import metrics
+
+
+def session_json_files(folder, data_mount=utils.DATA_MOUNT):
+    '''Return the sorted `.json` node files within a session folder.'''
+    full_path = os.path.join(data_mount, folder)
+    return sorted(glob.glob(os.path.join(full_path, '*.json')))
+
+
+def load_session_nodes(folder, data_mount=utils.DATA_MOUNT):
+    '''Build a `DrupalNode` for every node file within a session folder.
+
+    Args:
+        folder (str): The session folder, as given by the `J` argument.
+        data_mount (str): The mount path to be prepended to the folder.
+
+    Returns:
+        list[DrupalNode]: The nodes, sharing parsed contents with any
+            other session holding identical files.
+
+    '''
+    nodes = list()
+    for path in session_json_files(folder, data_mount):
+        start = time.perf_counter()
+        nodes.append(DrupalNode(path))
+        metrics.NODE_LOAD.observe_since(start, source='session')
+    return nodes
+
+
+def cache_stats():
+    '''Hit rates of the shared node and datafile caches.'''
+    return dict(json=cache.CONTENT_CACHE.stats(), csv=cache.CSV_CACHE.stats())
@@ -0,0 +1,369 @@
+'''Prometheus style metrics for the Bokeh visualization server.
+
+A small, dependency free, metrics registry. Values are recorded from the
+`server_lifecycle.py` hooks, the data loading functions and the application
+callbacks, and served in the Prometheus text exposition format from a local
+HTTP endpoint::
+
+    from isadream.server import metrics
+
+    def on_server_loaded(server_context):
+        metrics.start_http_server()
+
+    # Within `main.py`:
+    @metrics.timed_callback('testvis')
+    def update_plot(attr, old, new):
+        ...
+
+The endpoint listens on localhost only, scrape it with
+`curl http://127.0.0.1:9464/metrics`.
+
+Attributes:
+    METRICS_PORT (int): Port of the metrics endpoint, from the
+        `IDREAM_METRICS_PORT` environment variable.
+
+'''
+
+# Generic Python imports.
+import os
+import time
+import bisect
+import logging
+import resource
+import functools
+import threading
+import socketserver
+import http.server
+
+logger = logging.getLogger(__name__)
+
+METRICS_PORT = int(os.environ.get('IDREAM_METRICS_PORT', 9464))
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0)
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key, extra=()):
+    items = list(key) + list(extra)
+    if not items:
+        return ''
+    escaped = (
+        '{}="{}"'.format(name, str(value).replace('\\', r'\\')
+                         .replace('"', r'\"').replace('\n', r'\n'))
+        for name, value in items)
+    return '{' + ','.join(escaped) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+class _Metric:
+    '''Base class holding one value per distinct label set.'''
+
+    kind = None
+
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        self._values = dict()
+        self._lock = threading.Lock()
+
+    def samples(self):
+        '''Yield `(suffix, label_key, extra_labels, value)` tuples.'''
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield '', key, (), value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}',
+                 f'# TYPE {self.name} {self.kind}']
+        for suffix, key, extra, value in self.samples():
+            lines.append(f'{self.name}{suffix}{_format_labels(key, extra)} '
+                         f'{_format_value(value)}')
+        return '\n'.join(lines)
+
+
+class Counter(_Metric):
+    '''A monotonically increasing value.'''
+
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def set_total(self, value, **labels):
+        '''Set the count from a total kept elsewhere, for collectors.'''
+        with self._lock:
+            self._values[_label_key(labels)] = value
+
+
+class Gauge(_Metric):
+    '''A value that may go up and down.'''
+
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[_label_key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    '''Counts observations into cumulative buckets.'''
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            counts, total = self._values.get(
+                key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._values[key] = (counts, total + value)
+
+    def observe_since(self, start, **labels):
+        '''Observe the seconds elapsed since a `time.perf_counter()` value.'''
+        self.observe(time.perf_counter() - start, **labels)
+
+    def time(self, **labels):
+        '''A context manager observing the duration of its block.'''
+        return _Timer(self, labels)
+
+    def samples(self):
+        with self._lock:
+            items = [(key, (list(counts), total))
+                     for key, (counts, total) in self._values.items()]
+        bounds = self.buckets + (float('inf'),)
+        for key, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(bounds, counts):
+                cumulative += count
+                yield ('_bucket', key, (('le', _format_value(bound)),),
+                       cumulative)
+            yield '_sum', key, (), total
+            yield '_count', key, (), cumulative
+
+
+class _Timer:
+
+    def __init__(self, histogram, labels):
+        self._histogram = histogram
+        self._labels = labels
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._histogram.observe_since(self._start, **self._labels)
+
+
+class Registry:
+    '''Holds metrics, and collector functions run at scrape time.'''
+
+    def __init__(self):
+        self._metrics = list()
+        self._collectors = list()
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector):
+        '''Register a callable run before every scrape.'''
+        with self._lock:
+            self._collectors.append(collector)
+
+    def render(self):
+        '''The metrics in the Prometheus text exposition format.'''
+        with self._lock:
+            collectors = list(self._collectors)
+            registered = list(self._metrics)
+        for collector in collectors:
+            try:
+                collector()
+            except Exception:
+                logger.exception('Metrics collector %r failed.', collector)
+        return '\n'.join(metric.render() for metric in registered) + '\n'
+
+
+REGISTRY = Registry()
+
+SESSIONS_ACTIVE = REGISTRY.register(Gauge(
+    'isadream_sessions_active', 'Open Bokeh sessions.'))
+SESSIONS_TOTAL = REGISTRY.register(Counter(
+    'isadream_sessions_total', 'Bokeh sessions created.'))
+DOCUMENT_BUILD = REGISTRY.register(Histogram(
+    'isadream_document_build_seconds', 'Time to build a session document.'))
+NODE_LOAD = REGISTRY.register(Histogram(
+    'isadream_node_load_seconds', 'Time to load and normalize a node.'))
+CALLBACK_LATENCY = REGISTRY.register(Histogram(
+    'isadream_callback_seconds', 'Latency of Bokeh application callbacks.'))
+CACHE_LOOKUPS = REGISTRY.register(Counter(
+    'isadream_content_cache_lookups_total',
+    'Content cache lookups by result.'))
+CACHE_HIT_RATE = REGISTRY.register(Gauge(
+    'isadream_content_cache_hit_rate', 'Fraction of content cache hits.'))
+CACHE_BYTES = REGISTRY.register(Gauge(
+    'isadream_content_cache_bytes', 'Memory held by content cache entries.'))
+RESIDENT_MEMORY = REGISTRY.register(Gauge(
+    'isadream_process_resident_memory_bytes',
+    'Resident memory of the server process.'))
+APP_DATA = REGISTRY.register(Gauge(
+    'isadream_app_data_bytes',
+    'Memory held by the data frames of the open sessions of an app.'))
+STREAM_ROWS = REGISTRY.register(Counter(
+    'isadream_stream_rows_total', 'Rows read from a live stream source.'))
+STREAM_DROPPED = REGISTRY.register(Counter(
+    'isadream_stream_dropped_rows_total',
+    'Streamed rows not sent to a session, by reason.'))
+STREAM_PENDING = REGISTRY.register(Gauge(
+    'isadream_stream_pending_rows',
+    'Rows of a live stream waiting for its slowest session.'))
+
+
+def resident_memory():
+    '''The current resident set size of this process in bytes.'''
+    try:
+        with open('/proc/self/statm') as statm:
+            pages = int(statm.read().split()[1])
+        return pages * resource.getpagesize()
+    except (OSError, IndexError, ValueError):
+        # Not Linux, fall back to the peak resident size (kB on Linux/BSD).
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _collect_process():
+    RESIDENT_MEMORY.set(resident_memory())
+
+
+def _collect_cache():
+    # Imported here, the metrics module is usable without pandas.
+    from ..models.cache import CONTENT_CACHE, CSV_CACHE
+    for name, content_cache in (('json', CONTENT_CACHE), ('csv', CSV_CACHE)):
+        stats = content_cache.stats()
+        CACHE_LOOKUPS.set_total(stats['hits'], cache=name, result='hit')
+        CACHE_LOOKUPS.set_total(stats['misses'], cache=name, result='miss')
+        CACHE_HIT_RATE.set(stats['hit_rate'], cache=name)
+        CACHE_BYTES.set(stats['bytes_cached'], cache=name)
+
+
+REGISTRY.add_collector(_collect_process)
+REGISTRY.add_collector(_collect_cache)
+
+
+def session_created(app):
+    '''Record a new session, from an `on_session_created` hook.'''
+    SESSIONS_TOTAL.inc(app=app)
+    SESSIONS_ACTIVE.inc(app=app)
+
+
+_SESSION_BYTES = dict()
+_SESSION_LOCK = threading.Lock()
+
+
+def session_destroyed(app, session_id=None):
+    '''Record a closed session, from an `on_session_destroyed` hook.'''
+    SESSIONS_ACTIVE.dec(app=app)
+    with _SESSION_LOCK:
+        released = _SESSION_BYTES.pop((app, session_id), 0)
+    APP_DATA.dec(released, app=app)
+
+
+def track_frame(app, session_id, data_frame):
+    '''Add the memory held by a session's data frame to its app gauge.
+
+    The amount is released again by `session_destroyed`.
+
+    '''
+    size = int(data_frame.memory_usage(deep=True).sum())
+    with _SESSION_LOCK:
+        key = (app, session_id)
+        _SESSION_BYTES[key] = _SESSION_BYTES.get(key, 0) + size
+    APP_DATA.inc(size, app=app)
+
+
+def timed_callback(app):
+    '''Decorate a Bokeh callback to record its latency.'''
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with CALLBACK_LATENCY.time(app=app, callback=function.__name__):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class _MetricsHandler(http.server.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = REGISTRY.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+
+class _ThreadingHTTPServer(socketserver.ThreadingMixIn,
+                           http.server.HTTPServer):
+    daemon_threads = True
+
+
+_SERVER = None
+
+
+def start_http_server(port=None, address='127.0.0.1'):
+    '''Start (once) the metrics endpoint in a daemon thread.
+
+    Args:
+        port (int): Defaults to `METRICS_PORT`, which pre-forked workers
+            offset by their worker index.
+
+    '''
+    global _SERVER
+    if port is None:
+        port = METRICS_PORT
+    if _SERVER is None:
+        _SERVER = _ThreadingHTTPServer((address, port), _MetricsHandler)
+        threading.Thread(target=_SERVER.serve_forever, daemon=True,
+                         name='isadream-metrics').start()
+    return _SERVER
+
+
+def stop_http_server():
+    '''Stop the metrics endpoint, if running.'''
+    global _SERVER
+    if _SERVER is not None:
+        _SERVER.shutdown()
+        _SERVER.server_close()
+        _SERVER = None
@@ -0,0 +1,259 @@
+'''Serve the Bokeh apps from several pre-forked worker processes.
+
+A single `bokeh serve` process runs every session callback, and every pandas
+computation, on one core. `serve` instead:
+
+    1. loads the node documents, datafiles, query plans and summary cubes
+       of the data mount into the process wide caches,
+    2. freezes the garbage collector, so collections in the workers do not
+       write to (and so copy) the pages holding the warmed caches, and
+    3. forks `workers` processes, each running a Bokeh `Server` for the
+       apps on its own port, sharing the warmed caches copy-on-write.
+
+A session is built by the HTTP request for the page and then driven over a
+websocket, which must reach the same worker. The workers are placed behind
+nginx, configured by `nginx_config`, which hashes a client key kept in the
+`isadream_client` cookie to pick the worker, so every request of a client
+goes to one worker. Hashing the client address instead would send every
+client behind one proxy or NAT gateway to the same worker.
+
+Each worker serves its metrics on `IDREAM_METRICS_PORT` plus its worker
+index. Only the primary worker (see `is_primary_worker`) writes the node
+catalog and collects orphaned session folders. Crashed workers are
+restarted.
+
+Usage::
+
+    python -m isadream.server.prefork --workers 4 --port 5006 \\
+        --nginx-config /etc/nginx/conf.d/isadream.conf /bokehtest /testvis
+
+'''
+
+# Generic Python imports.
+import os
+import gc
+import sys
+import time
+import signal
+import logging
+import argparse
+
+# Local imports.
+from ..models import utils
+from ..models import cache
+from ..models import query
+from ..models import cubes
+from ..models import catalog
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+_NGINX_TEMPLATE = '''map $cookie_isadream_client $isadream_client {{
+    # A new client is keyed by its first request, and keeps the key.
+    "" $request_id;
+    default $cookie_isadream_client;
+}}
+
+upstream isadream_workers {{
+    # Keep each client on one worker, its sessions live there.
+    hash $isadream_client consistent;
+{servers}
+}}
+
+server {{
+    listen {listen};
+
+    location / {{
+        proxy_pass http://isadream_workers;
+        proxy_http_version 1.1;
+        proxy_set_header Upgrade $http_upgrade;
+        proxy_set_header Connection "upgrade";
+        proxy_set_header Host $host:$server_port;
+        proxy_set_header X-Real-IP $remote_addr;
+        proxy_set_header X-Forwarded-For $proxy_add_x_forwarded_for;
+        proxy_set_header X-Forwarded-Proto $scheme;
+        proxy_buffering off;
+        proxy_read_timeout 3600s;
+        add_header Set-Cookie "isadream_client=$isadream_client; Path=/; HttpOnly; SameSite=Lax";
+    }}
+}}
+'''
+
+
+def is_primary_worker():
+    '''Whether this process runs the services needed once per server.
+
+    True in worker 0, and when the apps are served by a single `bokeh serve`
+    process.
+
+    '''
+    return os.environ.get('IDREAM_WORKER_INDEX', '0') == '0'
+
+
+def worker_ports(port, workers):
+    '''The ports of the workers behind a proxy listening on port.'''
+    return [port + 1 + index for index in range(workers)]
+
+
+def nginx_config(port, workers, address='127.0.0.1'):
+    '''An nginx server block balancing port over the worker ports.'''
+    servers = '\n'.join(f'    server {address}:{worker_port};'
+                        for worker_port in worker_ports(port, workers))
+    return _NGINX_TEMPLATE.format(servers=servers, listen=port)
+
+
+def warm(data_mount=utils.DATA_MOUNT):
+    '''Load every node below data_mount into the process wide caches.
+
+    Returns:
+        int: The number of nodes loaded.
+
+    '''
+    node_catalog = catalog.Catalog()
+    try:
+        # Workers open their own connection, and then find it up to date.
+        node_catalog.update(data_mount)
+        json_paths = [row['path'] for row in node_catalog.nodes()]
+    finally:
+        node_catalog.close()
+
+    for json_path in json_paths:
+        folder = os.path.dirname(json_path)
+        try:
+            for plan in query.node_plans(json_path):
+                cache.read_csv(utils.data_file_path(plan.data_file, folder),
+                               skiprows=1, header=None)
+        except (OSError, ValueError) as error:
+            logger.warning('Could not preload %s: %s', json_path, error)
+
+    # Inherited by the workers as the process wide `CubeSet`.
+    cubes.open_cubes(json_paths)
+    return len(json_paths)
+
+
+def _run_worker(index, apps, port, address, server_kwargs):
+    '''Serve the apps in this (forked) process until terminated.'''
+    from bokeh.command.util import build_single_handler_applications
+    from bokeh.server.server import Server
+
+    os.environ['IDREAM_WORKER_INDEX'] = str(index)
+    metrics.METRICS_PORT += index
+
+    server = Server(build_single_handler_applications(apps), port=port,
+                    address=address, **server_kwargs)
+    server.start()
+    signal.signal(signal.SIGTERM,
+                  lambda *_: server.io_loop.add_callback_from_signal(
+                      server.io_loop.stop))
+    logger.info('Worker %d serving on port %d.', index, port)
+    server.io_loop.start()
+
+
+def _fork_worker(index, apps, port, address, server_kwargs):
+    pid = os.fork()
+    if pid:
+        return pid
+    status = 0
+    try:
+        _run_worker(index, apps, port, address, server_kwargs)
+    except Exception:
+        logger.exception('Worker %d failed.', index)
+        status = 1
+    finally:
+        os._exit(status)
+
+
+def serve(apps, workers=None, port=5006, address='127.0.0.1',
+          data_mount=utils.DATA_MOUNT, **server_kwargs):
+    '''Warm the caches, then serve the apps from forked workers.
+
+    Workers listen on `worker_ports(port, workers)`, behind a proxy on port.
+    Returns once the workers have been stopped with SIGTERM or SIGINT.
+
+    Args:
+        apps (list[str]): The Bokeh application directories.
+        workers (int): Defaults to the number of CPUs.
+        server_kwargs: Passed to each `bokeh.server.server.Server`, for
+            example `allow_websocket_origin` and `use_xheaders`.
+
+    '''
+    # Imported once here, and shared by the workers.
+    import bokeh.server.server  # noqa: F401
+
+    workers = workers or os.cpu_count() or 1
+    start = time.perf_counter()
+    loaded = warm(data_mount)
+    logger.info('Loaded %d nodes in %.1f s.', loaded,
+                time.perf_counter() - start)
+
+    gc.collect()
+    if hasattr(gc, 'freeze'):
+        gc.freeze()
+
+    ports = worker_ports(port, workers)
+    children = {_fork_worker(index, apps, ports[index], address,
+                             server_kwargs): index
+                for index in range(workers)}
+
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        index = children.pop(pid, None)
+        if index is None or stopping:
+            continue
+        logger.warning('Worker %d exited with status %d, restarting.',
+                       index, status)
+        children[_fork_worker(index, apps, ports[index], address,
+                              server_kwargs)] = index
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('apps', nargs='+',
+                        help='Bokeh application directories.')
+    parser.add_argument('--workers', type=int,
+                        default=int(os.environ.get('IDREAM_WORKERS', 0)),
+                        help='Worker processes, defaults to the CPU count.')
+    parser.add_argument('--port', type=int, default=5006,
+                        help='The public (proxy) port.')
+    parser.add_argument('--address', default='127.0.0.1',
+                        help='The address the workers listen on.')
+    parser.add_argument('--allow-websocket-origin', action='append',
+                        default=[], dest='origins')
+    parser.add_argument('--use-xheaders', action='store_true')
+    parser.add_argument('--nginx-config',
+                        help='Write the nginx configuration to this file.')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    workers = args.workers or os.cpu_count() or 1
+    if args.nginx_config:
+        with open(args.nginx_config, 'w') as config_file:
+            config_file.write(nginx_config(args.port, workers, args.address))
+
+    serve(args.apps, workers=workers, port=args.port, address=args.address,
+          allow_websocket_origin=args.origins or None,
+          use_xheaders=args.use_xheaders)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
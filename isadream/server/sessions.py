@@ -0,0 +1,377 @@
+'''Reference counted session data folders with deferred cleanup.
+
+Every Bokeh session is opened with a `J` argument naming the folder Drupal
+wrote its node files into. Several sessions may share that folder (a browser
+refresh opens a new session before the old one is destroyed), so folders are
+reference counted and only deleted once the last session releases them.
+A referenced folder is also held open with a shared `flock`, and deletion
+needs an exclusive one, so that when the apps are served by several
+pre-forked workers (see `isadream.server.prefork`) no worker deletes a
+folder a session of another worker still uses.
+
+Deletion never runs on the Bokeh IOLoop. Released folders are queued to a
+background worker, and a periodic garbage collector removes orphaned folders
+left behind by crashed or never-opened sessions. Only session folders are
+collected: folders a session has opened, which are marked with a
+`SESSION_MARKER` file, and folders named like `IDREAM_SESSION_PATTERN` (a
+regular expression, unset by default), so other folders of the data mount,
+such as those live streams are read from, are left alone::
+
+    from isadream.server import sessions
+
+    def on_server_loaded(server_context):
+        sessions.start_manager()
+
+    def on_session_created(session_context):
+        sessions.get_manager().acquire(sessions.session_folder(session_context))
+
+    def on_session_destroyed(session_context):
+        sessions.get_manager().release(sessions.session_folder(session_context))
+
+'''
+
+# Generic Python imports.
+import os
+import re
+import time
+import queue
+import shutil
+import logging
+import threading
+import collections
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Local imports.
+from ..models import utils
+
+logger = logging.getLogger(__name__)
+
+SESSION_MARKER = '.isadream-session'
+SESSION_PATTERN = os.environ.get('IDREAM_SESSION_PATTERN')
+
+
+def session_folder(session_context, endpoint_args='J'):
+    '''Return the session folder argument of a session, or None.
+
+    Args:
+        session_context: A Bokeh `SessionContext`.
+        endpoint_args (str): The request argument holding the folder name.
+
+    '''
+    try:
+        values = session_context.request.arguments.get(endpoint_args)
+    except AttributeError:
+        return None
+    if not values:
+        return None
+    return values[0].decode('utf-8')
+
+
+def _lock_folder(path, exclusive=False):
+    '''Open path and `flock` it, returning the descriptor or None.
+
+    Neither lock waits, None is returned if the folder is held exclusively,
+    or, for an exclusive lock, held at all. Without `fcntl`, or if the
+    folder is missing, locking is skipped and a descriptor of -1 is
+    returned so callers can proceed.
+
+    '''
+    if fcntl is None:
+        return -1
+    try:
+        descriptor = os.open(path, os.O_RDONLY)
+    except OSError:
+        return -1
+    try:
+        fcntl.flock(descriptor, (fcntl.LOCK_EX if exclusive
+                                 else fcntl.LOCK_SH) | fcntl.LOCK_NB)
+    except OSError:
+        os.close(descriptor)
+        return None
+    return descriptor
+
+
+def _unlock_folder(descriptor):
+    if descriptor is not None and descriptor >= 0:
+        os.close(descriptor)
+
+
+def _mark_session(path):
+    '''Create or touch the `SESSION_MARKER` of a folder.'''
+    try:
+        with open(os.path.join(path, SESSION_MARKER), 'a'):
+            pass
+        os.utime(os.path.join(path, SESSION_MARKER))
+    except OSError as error:
+        logger.warning('Could not mark session folder %s: %s', path, error)
+
+
+def folder_size(path):
+    '''Total size in bytes of all files below path.'''
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for name in filenames:
+            try:
+                total += os.lstat(os.path.join(dirpath, name)).st_size
+            except OSError:
+                pass
+    return total
+
+
+class SessionResources:
+    '''Reference counts session data folders and deletes them off-loop.
+
+    Attributes:
+        reclaimed_bytes (int): Bytes freed by deleted folders.
+        reclaimed_folders (int): Number of folders deleted.
+
+    '''
+
+    def __init__(self, data_mount=utils.DATA_MOUNT, gc_interval=600.0,
+                 orphan_age=3600.0, pattern=SESSION_PATTERN, collect=True):
+        '''
+
+        Args:
+            data_mount (str): The directory holding the session folders.
+            gc_interval (float): Seconds between orphan collection runs.
+            orphan_age (float): Unreferenced folders untouched for this many
+                seconds are considered orphaned.
+            pattern (str): A regular expression matching the names of
+                session folders, which are collected even if no session
+                opened them.
+            collect (bool): Run the orphan garbage collector. Served from
+                several workers, a single one collects.
+
+        '''
+        self.data_mount = os.path.realpath(data_mount)
+        self.gc_interval = gc_interval
+        self.orphan_age = orphan_age
+        self.pattern = re.compile(pattern) if pattern else None
+        self.collect = collect
+
+        self.reclaimed_bytes = 0
+        self.reclaimed_folders = 0
+
+        self._refs = collections.Counter()
+        self._held = dict()
+        self._deleting = set()
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._stop = threading.Event()
+        self._threads = list()
+
+    def resolve(self, folder):
+        '''Resolve a folder name to a path inside the data mount.
+
+        Raises:
+            ValueError: If the folder escapes the data mount, for example
+                through a `..` component in the request argument.
+
+        '''
+        path = os.path.realpath(os.path.join(self.data_mount, folder))
+        if os.path.commonpath([path, self.data_mount]) != self.data_mount \
+                or path == self.data_mount:
+            raise ValueError(f'{folder!r} is not a folder within the mount.')
+        return path
+
+    def acquire(self, folder):
+        '''Record that a session uses folder.
+
+        Raises:
+            ValueError: If the folder escapes the data mount, or is being
+                removed.
+
+        '''
+        if folder is None:
+            return
+        path = self.resolve(folder)
+        with self._lock:
+            if path not in self._held:
+                descriptor = None if path in self._deleting \
+                    else _lock_folder(path)
+                if descriptor is None:
+                    raise ValueError(f'{folder!r} is being removed.')
+                self._held[path] = descriptor
+            self._refs[path] += 1
+        if os.path.isdir(path):
+            _mark_session(path)
+
+    def release(self, folder):
+        '''Drop a session reference, queueing the folder for deletion when
+        no session uses it any more.
+
+        '''
+        if folder is None:
+            return
+        path = self.resolve(folder)
+        with self._lock:
+            if self._refs[path] > 0:
+                self._refs[path] -= 1
+            if self._refs[path] > 0:
+                return
+            del self._refs[path]
+            _unlock_folder(self._held.pop(path, None))
+        self._queue.put(path)
+
+    def refcount(self, folder):
+        with self._lock:
+            return self._refs.get(self.resolve(folder), 0)
+
+    def stats(self):
+        '''Summarize the manager state.'''
+        with self._lock:
+            active = len(self._refs)
+        return dict(
+            active_folders=active,
+            pending_deletions=self._queue.qsize(),
+            reclaimed_bytes=self.reclaimed_bytes,
+            reclaimed_folders=self.reclaimed_folders,
+        )
+
+    def start(self):
+        '''Start the deletion worker and the garbage collector.'''
+        if self._threads:
+            return
+        self._stop.clear()
+        self._threads = [
+            threading.Thread(target=self._delete_worker, daemon=True,
+                             name='isadream-session-cleanup'),
+        ]
+        if self.collect:
+            self._threads.append(
+                threading.Thread(target=self._gc_worker, daemon=True,
+                                 name='isadream-session-gc'))
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self):
+        '''Stop the workers, leaving any queued folders in place.'''
+        self._stop.set()
+        self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = list()
+
+    def is_session_folder(self, path):
+        '''Whether path is a session folder, see the module docstring.'''
+        return os.path.exists(os.path.join(path, SESSION_MARKER)) or bool(
+            self.pattern and self.pattern.fullmatch(os.path.basename(path)))
+
+    def collect_garbage(self):
+        '''Queue every unreferenced session folder older than `orphan_age`.
+
+        Returns:
+            int: The number of folders queued for deletion.
+
+        '''
+        cutoff = time.time() - self.orphan_age
+        try:
+            entries = list(os.scandir(self.data_mount))
+        except OSError as error:
+            logger.warning('Cannot scan %s: %s', self.data_mount, error)
+            return 0
+
+        queued = 0
+        for entry in entries:
+            if not entry.is_dir(follow_symlinks=False):
+                continue
+            path = os.path.realpath(entry.path)
+            if not self.is_session_folder(path):
+                continue
+            with self._lock:
+                if self._refs.get(path):
+                    continue
+            try:
+                if entry.stat(follow_symlinks=False).st_mtime > cutoff:
+                    continue
+                # Touched whenever a session opens the folder.
+                if os.stat(os.path.join(path, SESSION_MARKER)).st_mtime \
+                        > cutoff:
+                    continue
+            except FileNotFoundError:
+                pass
+            except OSError:
+                continue
+            self._queue.put(path)
+            queued += 1
+        return queued
+
+    def _delete(self, path):
+        if not os.path.isdir(path):
+            return
+
+        # Held by a session of another process.
+        descriptor = _lock_folder(path, exclusive=True)
+        if descriptor is None:
+            return
+        # The lock is held until the folder is gone, `acquire` refuses the
+        # folder meanwhile, in this process and in any other.
+        try:
+            with self._lock:
+                # A new session may have claimed the folder while it was
+                # queued.
+                if self._refs.get(path):
+                    return
+                self._deleting.add(path)
+            self._remove(path)
+        finally:
+            with self._lock:
+                self._deleting.discard(path)
+            _unlock_folder(descriptor)
+
+    def _remove(self, path):
+        size = folder_size(path)
+
+        def on_error(function, failed_path, exc_info):
+            logger.warning('Could not remove %s: %s', failed_path, exc_info[1])
+
+        shutil.rmtree(path, onerror=on_error)
+        if not os.path.exists(path):
+            self.reclaimed_bytes += size
+            self.reclaimed_folders += 1
+            logger.info('Removed session folder %s (%d bytes).', path, size)
+
+    def _delete_worker(self):
+        while True:
+            path = self._queue.get()
+            if path is None:
+                break
+            try:
+                self._delete(path)
+            except Exception:
+                logger.exception('Failed to remove session folder %s.', path)
+
+    def _gc_worker(self):
+        while not self._stop.wait(self.gc_interval):
+            queued = self.collect_garbage()
+            if queued:
+                logger.info('Queued %d orphaned session folders.', queued)
+
+
+_MANAGER = None
+
+
+def start_manager(data_mount=utils.DATA_MOUNT, **kwargs):
+    '''Start (once) and return the process wide `SessionResources`.'''
+    global _MANAGER
+    if _MANAGER is None:
+        _MANAGER = SessionResources(data_mount, **kwargs)
+        _MANAGER.start()
+    return _MANAGER
+
+
+def get_manager():
+    '''Return the running `SessionResources`, or None.'''
+    return _MANAGER
+
+
+def stop_manager():
+    '''Stop the process wide `SessionResources`, if running.'''
+    global _MANAGER
+    if _MANAGER is not None:
+        _MANAGER.stop()
+        _MANAGER = None
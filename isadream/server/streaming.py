@@ -0,0 +1,645 @@
+'''Live ingestion of instrument rows into open Bokeh sessions.
+
+Some instruments write measurements continuously. A `Stream` reads new rows
+from a local source in a background thread, names their columns and
+attaches the factors of the assay they belong to, and appends them to the
+`ColumnDataSource` of every subscribed session with `source.stream`.
+
+Sources:
+    + `TailSource`: rows appended to a `.csv` file, like `tail -F`.
+    + `SocketSource`: `.csv` lines written to a Unix domain socket.
+    + `QueueSource`: rows put on a bounded queue by another thread.
+
+Rows are positional, like the rows of an assay datafile. When a stream is
+given a node (and optionally one of its datafiles) the columns are named
+with that assay's factor labels, and its constant factors, `metadata_key`
+and `data_file` are attached to every batch, as in the frames built by
+`isadream.models.query.select`. The node's plan is looked up per batch from
+the content cache, so an edit to the node applies to the following rows.
+
+Backpressure: each session has at most one batch in flight. The browser
+acknowledges each batch it applies, and the next batch is sent no sooner
+than `min_interval` seconds later, holding every row that arrived meanwhile.
+For a session streaming with a `rollover`, rows that would scroll out of
+the source before being seen are dropped from the held rows. Otherwise rows
+are held for the slowest session, and once `max_pending` rows are held the
+stream stops reading its source. A queue producer then blocks in
+`QueueSource.put`, and a socket producer in `send` once the kernel buffer
+is full, so a fast producer cannot flood slow browsers.
+
+::
+
+    from isadream.server import streaming
+
+    # server_lifecycle.py
+    def on_server_loaded(server_context):
+        streaming.open_streams()
+
+    # main.py
+    stream = streaming.get_stream('live')
+    unsubscribe = stream.subscribe(curdoc(), source, rollover=5000)
+
+Streams are configured with the `IDREAM_STREAMS` environment variable, as
+`;` separated `name=kind:path` entries, each optionally followed by
+`,node=<json path>` and `,data_file=<datafile name>`::
+
+    IDREAM_STREAMS='live=tail:/data/live/al_nmr.csv,node=/data/live/al_nmr.json'
+
+'''
+
+# Generic Python imports.
+import os
+import csv
+import time
+import queue
+import select
+import socket
+import logging
+import threading
+import collections
+from functools import partial
+
+# Data science imports.
+from ..models.lazy import lazy_import
+
+np = lazy_import('numpy')
+
+# Local imports.
+from ..models import query
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+STREAMS_SPEC = os.environ.get('IDREAM_STREAMS', '')
+
+# Run in the browser after a batch is appended to the source, the change of
+# `tags` is sent back to the server as the acknowledgement.
+_ACK_CODE = '''
+source.tags = [(source.tags.length ? source.tags[0] : 0) + 1];
+'''
+
+
+def _parse_lines(lines):
+    '''Split `.csv` lines into rows of strings, skipping blank lines.'''
+    return [row for row in csv.reader(lines) if row]
+
+
+class QueueSource:
+    '''Rows put on a bounded queue by a producer thread.
+
+    `put` blocks while the queue is full, which is the backpressure the
+    producer sees.
+
+    '''
+
+    def __init__(self, maxsize=10000):
+        self.queue = queue.Queue(maxsize)
+
+    def put(self, row, timeout=None):
+        '''Add a row (a sequence of values), waiting while the queue is full.
+        '''
+        self.queue.put(row, timeout=timeout)
+
+    def read(self, timeout, limit):
+        rows = list()
+        try:
+            rows.append(self.queue.get(timeout=timeout))
+            while len(rows) < limit:
+                rows.append(self.queue.get_nowait())
+        except queue.Empty:
+            pass
+        return rows
+
+    def close(self):
+        pass
+
+
+class TailSource:
+    '''Rows appended to a `.csv` file.
+
+    Only complete lines are read. A file that shrinks, or is replaced, is
+    read again from the start. A line longer than the `max_bytes` of a read
+    is skipped, and counted in `skipped_lines`.
+
+    '''
+
+    def __init__(self, path, skip_header=True, from_end=True):
+        '''
+
+        Args:
+            path (str): The `.csv` file, which need not exist yet.
+            skip_header (bool): The first line of the file is a header.
+            from_end (bool): Skip the rows already in the file.
+
+        '''
+        self.path = path
+        self.skip_header = skip_header
+        self.skipped_lines = 0
+        self._offset = 0
+        self._inode = None
+        self._skipping = False
+        # Whether the next complete line read is the header.
+        self._in_header = skip_header
+        if from_end:
+            try:
+                stat = os.stat(path)
+                self._offset, self._inode = stat.st_size, stat.st_ino
+            except OSError:
+                pass
+            self._in_header = skip_header and not self._offset
+
+    def read(self, timeout, limit, max_bytes=2**20):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            time.sleep(timeout)
+            return []
+        if stat.st_ino != self._inode or stat.st_size < self._offset:
+            self._offset, self._inode = 0, stat.st_ino
+            self._skipping = False
+            self._in_header = self.skip_header
+        if stat.st_size == self._offset:
+            time.sleep(timeout)
+            return []
+
+        with open(self.path, 'rb') as data_file:
+            data_file.seek(self._offset)
+            data = data_file.read(max_bytes)
+        if self._skipping:
+            # The rest of a line longer than `max_bytes`.
+            end = data.find(b'\n')
+            if end < 0:
+                self._offset += len(data)
+                if len(data) < max_bytes:
+                    time.sleep(timeout)
+                return []
+            self._skipping = False
+            self._offset += end + 1
+            data = data[end + 1:]
+
+        # The text after the last newline is a line still being written, it
+        # is read again next time, as are lines past `limit`.
+        lines = data.split(b'\n')[:-1][:limit]
+        if not lines:
+            if len(data) >= max_bytes:
+                logger.warning('Skipping a line of more than %d bytes in %s.',
+                               max_bytes, self.path)
+                self.skipped_lines += 1
+                self._offset += len(data)
+                self._skipping = True
+            else:
+                time.sleep(timeout)
+            return []
+        self._offset += sum(len(line) + 1 for line in lines)
+        if self._in_header:
+            lines = lines[1:]
+            self._in_header = False
+        return _parse_lines(line.decode('utf-8', 'replace') for line in lines)
+
+    def close(self):
+        pass
+
+
+class SocketSource:
+    '''Rows written as `.csv` lines to a Unix domain socket.
+
+    Any number of producers may connect. A producer is only read from while
+    the stream has room for more rows, otherwise its writes block once the
+    kernel buffer fills.
+
+    '''
+
+    def __init__(self, path, backlog=8):
+        self.path = path
+        if os.path.exists(path):
+            os.unlink(path)
+        self._server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._server.bind(path)
+        self._server.listen(backlog)
+        self._server.setblocking(False)
+        self._connections = dict()
+
+    def read(self, timeout, limit, chunk_size=65536):
+        readable, _, _ = select.select(
+            [self._server] + list(self._connections), [], [], timeout)
+        rows = list()
+        for ready in readable:
+            if ready is self._server:
+                connection, _ = self._server.accept()
+                connection.setblocking(False)
+                self._connections[connection] = b''
+                continue
+            if len(rows) >= limit:
+                continue
+            try:
+                data = ready.recv(chunk_size)
+            except BlockingIOError:
+                continue
+            except OSError:
+                data = b''
+            buffered = self._connections.pop(ready) + data
+            if not data:
+                # Closed by the producer, a last line may lack its newline.
+                ready.close()
+                rows.extend(_parse_lines([buffered.decode('utf-8',
+                                                          'replace')]))
+                continue
+            *lines, self._connections[ready] = buffered.split(b'\n')
+            rows.extend(_parse_lines(line.decode('utf-8', 'replace')
+                                     for line in lines))
+        return rows
+
+    def close(self):
+        for connection in self._connections:
+            connection.close()
+        self._connections.clear()
+        self._server.close()
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+
+def source_from_spec(spec):
+    '''Make a source from a `kind:path` spec, `tail:` or `socket:`.
+
+    Each prefork worker (see `isadream.server.prefork`) listens on its own
+    socket, `path.<worker index>`.
+
+    '''
+    kind, _, path = spec.partition(':')
+    if kind == 'tail':
+        return TailSource(path)
+    if kind == 'socket':
+        worker = os.environ.get('IDREAM_WORKER_INDEX')
+        return SocketSource(path if worker is None else f'{path}.{worker}')
+    raise ValueError(f'Unknown stream source {spec!r}, expected '
+                     f'"tail:<path>" or "socket:<path>".')
+
+
+def _to_array(rows):
+    '''Rows of strings or numbers as a float array, NaN for empty fields.
+
+    Returns:
+        tuple: The (rows x columns) array, and the number of rows dropped
+            because a field is not a number.
+
+    '''
+    width = max(len(row) for row in rows)
+    array = np.full((len(rows), width), np.nan)
+    invalid = 0
+    kept = 0
+    for row in rows:
+        try:
+            array[kept, :len(row)] = [np.nan if value == '' else float(value)
+                                      for value in row]
+        except (TypeError, ValueError):
+            invalid += 1
+            continue
+        kept += 1
+    return array[:kept], invalid
+
+
+def _concat(chunks):
+    '''Join chunks of columns, as sent by `Stream._publish`.
+
+    Only the columns of every chunk are kept, an edit of the stream's node
+    may change the columns between chunks.
+
+    '''
+    if len(chunks) == 1:
+        return chunks[0]
+    return {column: np.concatenate([chunk[column] for chunk in chunks])
+            for column in chunks[0]
+            if all(column in chunk for chunk in chunks[1:])}
+
+
+def _tail(chunk, rows):
+    return {column: values[-rows:] for column, values in chunk.items()}
+
+
+def _length(chunk):
+    return len(next(iter(chunk.values()))) if chunk else 0
+
+
+class _Subscriber:
+    '''A session's source and the rows waiting to be sent to it.'''
+
+    def __init__(self, doc, source, rollover):
+        self.doc = doc
+        self.source = source
+        self.rollover = rollover
+        self.pending = list()
+        self.pending_rows = 0
+        self.in_flight = False
+        self.sequence = 0
+        self.closed = False
+
+    def hold(self, chunk):
+        '''Add a chunk of rows, returning the number of rows conflated.'''
+        self.pending.append(chunk)
+        self.pending_rows += _length(chunk)
+        if self.rollover is None or self.pending_rows <= self.rollover:
+            return 0
+        # These rows would scroll out of the source as soon as they arrive.
+        dropped = self.pending_rows - self.rollover
+        self.pending = [_tail(_concat(self.pending), self.rollover)]
+        self.pending_rows = self.rollover
+        return dropped
+
+    def take(self):
+        '''The held rows, with the columns of the session's source.'''
+        chunk = _concat(self.pending)
+        rows = self.pending_rows
+        self.pending, self.pending_rows = list(), 0
+        data = dict()
+        for column in self.source.data.keys():
+            values = chunk.get(column)
+            if values is None:
+                # A column the stream does not provide, such as a colour.
+                values = np.full(rows, None, dtype=object)
+            data[column] = values
+        return data
+
+
+class Stream:
+    '''Read rows from a source and stream them into subscribed sessions.
+
+    See the module docstring for how rows are named and for backpressure.
+
+    '''
+
+    def __init__(self, source, name='stream', node=None, data_file=None,
+                 max_pending=10000, min_interval=0.1, ack_timeout=5.0,
+                 batch_rows=1000, history=1000, poll_interval=0.1):
+        '''
+
+        Args:
+            source: A `QueueSource`, `TailSource` or `SocketSource`.
+            name (str): Labels the stream's metrics.
+            node: A `DrupalNode` or the path of a node `.json` file, which
+                describes the rows.
+            data_file (str): The datafile of node the rows belong to, by
+                default its first.
+            max_pending (int): Rows held for the slowest session before the
+                source is no longer read.
+            min_interval (float): Seconds between the batches sent to a
+                session.
+            ack_timeout (float): Seconds to wait for a browser to acknowledge
+                a batch, before sending the next one regardless.
+            batch_rows (int): The most rows read from the source at once.
+            history (int): Recent rows sent to a session when it subscribes.
+            poll_interval (float): Seconds to wait on an idle source.
+
+        '''
+        self.source = source
+        self.name = name
+        self.json_path = getattr(node, 'json_path', node)
+        self.data_file = data_file
+        self.max_pending = max_pending
+        self.min_interval = min_interval
+        self.ack_timeout = ack_timeout
+        self.batch_rows = batch_rows
+        self.history = history
+        self.poll_interval = poll_interval
+
+        self._subscribers = set()
+        self._recent = collections.deque()
+        self._recent_rows = 0
+        self._lock = threading.Condition()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def subscribe(self, doc, source, rollover=None):
+        '''Stream new rows into source, a `ColumnDataSource` of doc.
+
+        Only the columns of source are sent, columns the stream does not
+        provide are filled with None.
+
+        Args:
+            rollover (int): Passed to `source.stream`, the most rows source
+                keeps. Older held rows are then dropped instead of holding
+                back the stream.
+
+        Returns:
+            callable: A function that removes the subscription.
+
+        '''
+        from bokeh.models import CustomJS
+
+        subscriber = _Subscriber(doc, source, rollover)
+        source.js_on_change('streaming', CustomJS(args=dict(source=source),
+                                                  code=_ACK_CODE))
+        source.on_change('tags', partial(self._acknowledged, subscriber))
+        with self._lock:
+            for chunk in self._recent:
+                subscriber.hold(chunk)
+            self._subscribers.add(subscriber)
+        self._dispatch(subscriber)
+
+        def unsubscribe():
+            with self._lock:
+                subscriber.closed = True
+                self._subscribers.discard(subscriber)
+                self._lock.notify_all()
+
+        return unsubscribe
+
+    def start(self):
+        '''Start reading the source in a background thread.'''
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name=f'isadream-stream-{self.name}',
+            daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        '''Stop the reader thread and close the source.'''
+        if self._thread is None:
+            return
+        self._stop.set()
+        with self._lock:
+            self._lock.notify_all()
+        self._thread.join()
+        self._thread = None
+        self.source.close()
+
+    def _backlog(self):
+        '''Rows held for the slowest session without a rollover.'''
+        return max((subscriber.pending_rows
+                    for subscriber in self._subscribers
+                    if subscriber.rollover is None), default=0)
+
+    def _run(self):
+        while not self._stop.is_set():
+            with self._lock:
+                room = self.max_pending - self._backlog()
+                if room <= 0:
+                    # Backpressure, wait for the slowest session.
+                    self._lock.wait(self.poll_interval)
+                    continue
+            try:
+                rows = self.source.read(self.poll_interval,
+                                        min(room, self.batch_rows))
+                if rows:
+                    self._publish(rows)
+            except Exception:
+                logger.exception('Stream %s iteration failed.', self.name)
+                self._stop.wait(self.poll_interval)
+
+    def _plan(self):
+        if self.json_path is None:
+            return None
+        for plan in query.node_plans(self.json_path):
+            if self.data_file in (None, plan.data_file):
+                return plan
+        return None
+
+    def _columns(self, array):
+        '''Name the columns of array, and attach the node's factors.'''
+        rows, width = array.shape
+        plan = self._plan()
+        if plan is None:
+            return {str(index): array[:, index] for index in range(width)}
+
+        columns = dict()
+        for label, index in plan.csv_columns.items():
+            columns[label] = (array[:, index] if index < width
+                              else np.full(rows, np.nan))
+        for label, value in plan.constants.items():
+            columns[label] = np.full(rows, value, dtype=object
+                                     if isinstance(value, str) else None)
+        columns['metadata_key'] = np.full(rows, self.json_path, dtype=object)
+        columns['data_file'] = np.full(rows, plan.data_file, dtype=object)
+        return columns
+
+    def _publish(self, rows):
+        array, invalid = _to_array(rows)
+        metrics.STREAM_ROWS.inc(len(rows), stream=self.name)
+        if invalid:
+            metrics.STREAM_DROPPED.inc(invalid, stream=self.name,
+                                       reason='invalid')
+        if not len(array):
+            return
+        chunk = self._columns(array)
+
+        with self._lock:
+            self._recent.append(chunk)
+            self._recent_rows += len(array)
+            while self._recent_rows - _length(self._recent[0]) >= \
+                    self.history:
+                self._recent_rows -= _length(self._recent.popleft())
+            subscribers = list(self._subscribers)
+            if not subscribers:
+                metrics.STREAM_DROPPED.inc(len(array), stream=self.name,
+                                           reason='no_session')
+            for subscriber in subscribers:
+                conflated = subscriber.hold(chunk)
+                if conflated:
+                    metrics.STREAM_DROPPED.inc(conflated, stream=self.name,
+                                               reason='rollover')
+            metrics.STREAM_PENDING.set(self._backlog(), stream=self.name)
+
+        for subscriber in subscribers:
+            self._dispatch(subscriber)
+
+    def _dispatch(self, subscriber):
+        '''Send the held rows to a session, unless a batch is in flight.'''
+        with self._lock:
+            if subscriber.closed or subscriber.in_flight \
+                    or not subscriber.pending:
+                return
+            subscriber.in_flight = True
+            subscriber.sequence += 1
+            sequence = subscriber.sequence
+            data = subscriber.take()
+            metrics.STREAM_PENDING.set(self._backlog(), stream=self.name)
+            self._lock.notify_all()
+        subscriber.doc.add_next_tick_callback(
+            partial(self._apply, subscriber, sequence, data))
+
+    def _apply(self, subscriber, sequence, data):
+        # On the session's IOLoop.
+        if subscriber.closed:
+            return
+        subscriber.source.stream(data, rollover=subscriber.rollover)
+        subscriber.doc.add_timeout_callback(
+            partial(self._release, subscriber, sequence),
+            self.ack_timeout * 1000)
+
+    def _acknowledged(self, subscriber, attr, old, new):
+        # The browser has applied the batch in flight.
+        sequence = subscriber.sequence
+        if self.min_interval:
+            subscriber.doc.add_timeout_callback(
+                partial(self._release, subscriber, sequence),
+                self.min_interval * 1000)
+        else:
+            self._release(subscriber, sequence)
+
+    def _release(self, subscriber, sequence):
+        with self._lock:
+            if subscriber.sequence != sequence or not subscriber.in_flight:
+                # Already released, by the acknowledgement or its timeout.
+                return
+            subscriber.in_flight = False
+        self._dispatch(subscriber)
+
+
+_STREAMS = dict()
+_STREAMS_LOCK = threading.Lock()
+
+
+def open_stream(name, source, **kwargs):
+    '''Start (once) and return the process wide `Stream` called name.
+
+    Args:
+        source: A source, or a `kind:path` spec, see `source_from_spec`.
+        kwargs: Passed to `Stream`.
+
+    '''
+    with _STREAMS_LOCK:
+        stream = _STREAMS.get(name)
+        if stream is None:
+            if isinstance(source, str):
+                source = source_from_spec(source)
+            stream = _STREAMS[name] = Stream(source, name=name, **kwargs)
+            stream.start()
+    return stream
+
+
+def get_stream(name):
+    '''Return the open `Stream` called name, or None.'''
+    return _STREAMS.get(name)
+
+
+def close_streams():
+    '''Stop every open `Stream`.'''
+    with _STREAMS_LOCK:
+        streams = list(_STREAMS.values())
+        _STREAMS.clear()
+    for stream in streams:
+        stream.stop()
+
+
+def open_streams(spec=None):
+    '''Open the streams of a spec, by default `IDREAM_STREAMS`.
+
+    Intended to be called from a Bokeh `on_server_loaded` hook. See the
+    module docstring for the format.
+
+    '''
+    spec = STREAMS_SPEC if spec is None else spec
+    streams = list()
+    for entry in filter(None, (entry.strip() for entry in spec.split(';'))):
+        name, _, options = entry.partition('=')
+        source, *options = options.split(',')
+        kwargs = dict(option.split('=', 1) for option in options)
+        try:
+            streams.append(open_stream(name.strip(), source.strip(),
+                                       **kwargs))
+        except (OSError, ValueError, TypeError) as error:
+            logger.warning('Could not open stream %r: %s', entry, error)
+    return streams
@@ -0,0 +1,587 @@
+'''Filesystem watcher for the visualization data mount.
+
+Drupal writes node `.json` files and their `.csv` datafiles into session
+folders below the data mount. This module watches that tree and keeps a
+`NodeIndex` of parsed `DrupalNode` instances current, reparsing only the
+nodes whose files actually changed.
+
+Change detection uses Linux inotify (through ctypes, no extra dependency) and
+falls back to periodic polling of file modification times when inotify is
+not available, or when the kernel event queue overflows.
+
+Live Bokeh sessions subscribe to their session folder and are handed a
+`ChangeSet` whenever nodes in that folder are added, modified or removed::
+
+    from isadream.server import watcher
+
+    def on_server_loaded(server_context):
+        watcher.start_watcher()
+
+    # Within a session, `main.py`:
+    def on_change(changes):
+        for node in changes.added:
+            watcher.stream_frame(curdoc(), source, watcher.node_frame(node))
+
+    # Subscribed to the session's `J` folder until the session is closed.
+    watcher.watch_session(curdoc(), on_change)
+
+Attributes:
+    WATCHED_EXTENSIONS (tuple[str]): File extensions that trigger a reindex.
+
+'''
+
+# Generic Python imports.
+import os
+import errno
+import struct
+import select
+import ctypes
+import ctypes.util
+import time
+import logging
+import threading
+import collections
+from functools import partial
+
+# Local imports.
+from ..models import utils
+from ..models import cache
+from ..models import merge
+from ..models.drupalnode import DrupalNode
+from . import metrics
+from . import sessions
+
+logger = logging.getLogger(__name__)
+
+WATCHED_EXTENSIONS = ('.json', '.csv')
+
+ChangeSet = collections.namedtuple(
+    'ChangeSet', ['folder', 'added', 'modified', 'removed'])
+ChangeSet.__doc__ = '''Nodes that changed within a single session folder.
+
+`added` and `modified` hold `DrupalNode` instances, `removed` holds the
+paths of the node `.json` files that no longer exist.
+'''
+
+# inotify constants, see `man 7 inotify`.
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_DELETE_SELF = 0x00000400
+_IN_Q_OVERFLOW = 0x00004000
+_IN_IGNORED = 0x00008000
+_IN_ISDIR = 0x40000000
+_IN_WATCH_MASK = (_IN_CLOSE_WRITE | _IN_MOVED_FROM | _IN_MOVED_TO
+                  | _IN_CREATE | _IN_DELETE | _IN_DELETE_SELF)
+_EVENT_HEADER = struct.Struct('iIII')
+
+
+def _is_watched(path):
+    return path.endswith(WATCHED_EXTENSIONS)
+
+
+def _stamp(path):
+    '''Return a `(mtime_ns, size)` tuple for a path, or None if it is gone.'''
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def _scan_tree(root):
+    '''Build a `{path: stamp}` snapshot of every watched file below root.'''
+    snapshot = dict()
+    for dirpath, _, filenames in os.walk(root):
+        for name in filenames:
+            path = os.path.join(dirpath, name)
+            if _is_watched(path):
+                stamp = _stamp(path)
+                if stamp is not None:
+                    snapshot[path] = stamp
+    return snapshot
+
+
+class _InotifySource:
+    '''Collects changed paths from the kernel using inotify.
+
+    `read()` returns a set of candidate paths, or None when the event queue
+    overflowed and the caller must rescan the whole tree.
+
+    '''
+
+    def __init__(self, root):
+        libc_name = ctypes.util.find_library('c')
+        if libc_name is None:
+            raise OSError('libc could not be found.')
+        self._libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(self._libc, 'inotify_init1'):
+            raise OSError('inotify is not supported on this platform.')
+
+        self._fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+
+        self._watches = dict()
+        self.add_tree(root)
+
+    def add_tree(self, root):
+        '''Watch root and every directory below it.'''
+        for dirpath, _, _ in os.walk(root):
+            wd = self._libc.inotify_add_watch(
+                self._fd, os.fsencode(dirpath), _IN_WATCH_MASK)
+            if wd < 0:
+                err = ctypes.get_errno()
+                if err == errno.ENOSPC:
+                    raise OSError(err, 'inotify watch limit reached.')
+                continue
+            self._watches[wd] = dirpath
+
+    def read(self, timeout):
+        ready, _, _ = select.select([self._fd], [], [], timeout)
+        if not ready:
+            return set()
+
+        try:
+            buffer = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return set()
+
+        changed = set()
+        offset = 0
+        while offset < len(buffer):
+            wd, mask, _, length = _EVENT_HEADER.unpack_from(buffer, offset)
+            offset += _EVENT_HEADER.size
+            name = buffer[offset:offset + length].rstrip(b'\0')
+            offset += length
+
+            if mask & _IN_Q_OVERFLOW:
+                return None
+            if mask & _IN_IGNORED:
+                self._watches.pop(wd, None)
+                continue
+
+            dirpath = self._watches.get(wd)
+            if dirpath is None:
+                continue
+            path = os.path.join(dirpath, os.fsdecode(name))
+
+            if mask & _IN_ISDIR:
+                if mask & (_IN_CREATE | _IN_MOVED_TO):
+                    # Files may land in a new folder before it is watched.
+                    self.add_tree(path)
+                    changed.update(_scan_tree(path))
+                else:
+                    changed.add(path)
+            elif _is_watched(path):
+                changed.add(path)
+
+        return changed
+
+    def close(self):
+        os.close(self._fd)
+
+
+class _PollingSource:
+    '''Fallback change source that asks for a full rescan every interval.'''
+
+    def __init__(self, interval, stop_event):
+        self._interval = interval
+        self._stop_event = stop_event
+
+    def read(self, timeout):
+        self._stop_event.wait(max(timeout, self._interval))
+        return None
+
+    def close(self):
+        pass
+
+
+class NodeIndex:
+    '''An incrementally maintained index of parsed `DrupalNode` instances.
+
+    Nodes are keyed by the absolute path of their `.json` file, and are
+    additionally indexed by folder and by `experimentSubType`. Nodes that
+    are known but not yet requested are parsed on first access.
+
+    '''
+
+    def __init__(self):
+        self._nodes = dict()
+        self._lock = threading.RLock()
+        self.by_folder = collections.defaultdict(set)
+        self.by_subtype = collections.defaultdict(set)
+
+    def __contains__(self, path):
+        return path in self._nodes
+
+    def __len__(self):
+        return len(self._nodes)
+
+    def get(self, path):
+        '''Return the node for a `.json` path, parsing it if needed.'''
+        with self._lock:
+            node = self._nodes.get(path)
+            if node is None and path in self.by_folder.get(
+                    os.path.dirname(path), ()):
+                node = self.update(path)
+            return node
+
+    def add(self, path):
+        '''Register a node path without parsing it.'''
+        with self._lock:
+            self.by_folder[os.path.dirname(path)].add(path)
+
+    def update(self, path):
+        '''(Re)parse a single node and update the indexes.
+
+        A node parsed before is reloaded with `DrupalNode.reload`.
+
+        Returns:
+            DrupalNode: The new node, or None if the file could not be read.
+
+        '''
+        start = time.perf_counter()
+        with self._lock:
+            old = self._nodes.get(path)
+        try:
+            if old is None:
+                node = DrupalNode(path)
+            else:
+                # Only the sections that changed are rebuilt.
+                node, diff = old.reload()
+                logger.debug('Reingested node %s: %s', path, diff)
+        except (OSError, ValueError, KeyError, TypeError) as error:
+            # Likely a partially written file, it will be picked up by the
+            # next event for this path.
+            logger.warning('Could not parse node %s: %s', path, error)
+            return None
+        metrics.NODE_LOAD.observe_since(start, source='watcher')
+
+        with self._lock:
+            self._drop_subtype(path)
+            self._nodes[path] = node
+            self.by_folder[os.path.dirname(path)].add(path)
+            self.by_subtype[_experiment_subtype(node)].add(path)
+        return node
+
+    def remove(self, path):
+        '''Remove a node from every index.'''
+        with self._lock:
+            self._drop_subtype(path)
+            self._nodes.pop(path, None)
+            folder = os.path.dirname(path)
+            paths = self.by_folder.get(folder, set())
+            paths.discard(path)
+            if not paths:
+                self.by_folder.pop(folder, None)
+
+    def nodes_using(self, csv_path):
+        '''Return the node paths in the same folder that reference a csv.'''
+        folder, name = os.path.split(csv_path)
+        with self._lock:
+            paths = list(self.by_folder.get(folder, ()))
+        return [path for path in paths
+                if name in _data_files(self.get(path))]
+
+    def _drop_subtype(self, path):
+        old = self._nodes.get(path)
+        if old is None:
+            return
+        subtype = _experiment_subtype(old)
+        self.by_subtype[subtype].discard(path)
+        if not self.by_subtype[subtype]:
+            del self.by_subtype[subtype]
+
+
+def _experiment_subtype(node):
+    info = node.json_dict.get('nodeInformation') or dict()
+    return info.get('experimentSubType')
+
+
+def _data_files(node):
+    '''The unique datafile names referenced by the assays of a node.'''
+    if node is None or 'dataFile' not in node._study_assays:
+        return []
+    return list(node._study_assays['dataFile'].dropna().unique())
+
+
+class DataWatcher:
+    '''Watches a data mount and keeps a `NodeIndex` up to date.
+
+    The watcher runs in a daemon thread. Subscribers are called from that
+    thread, so Bokeh sessions must hand any document changes to their IOLoop
+    with `doc.add_next_tick_callback` (see `stream_frame`).
+
+    '''
+
+    def __init__(self, data_mount=utils.DATA_MOUNT, interval=2.0,
+                 use_inotify=True):
+        '''
+
+        Args:
+            data_mount (str): The directory to watch.
+            interval (float): Seconds between polls when polling, and the
+                debounce delay used to batch inotify events.
+            use_inotify (bool): Set False to force the polling fallback.
+
+        '''
+        self.data_mount = os.path.abspath(data_mount)
+        self.interval = interval
+        self.use_inotify = use_inotify
+        self.index = NodeIndex()
+
+        self._stamps = dict()
+        self._subscribers = collections.defaultdict(list)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._source = None
+
+    def folder_path(self, folder):
+        '''Resolve a session folder (such as the `J` argument) to a key.'''
+        return os.path.normpath(os.path.join(self.data_mount, folder))
+
+    def subscribe(self, folder, callback):
+        '''Call callback with a `ChangeSet` whenever folder changes.
+
+        Args:
+            folder (str): The session folder, or None for every folder.
+            callback (callable): Called with each `ChangeSet`.
+
+        Returns:
+            callable: A function that removes the subscription.
+
+        '''
+        key = None if folder is None else self.folder_path(folder)
+        with self._lock:
+            self._subscribers[key].append(callback)
+
+        def unsubscribe():
+            with self._lock:
+                callbacks = self._subscribers.get(key, [])
+                if callback in callbacks:
+                    callbacks.remove(callback)
+                if not callbacks:
+                    self._subscribers.pop(key, None)
+
+        return unsubscribe
+
+    def start(self):
+        '''Snapshot the mount and start the watcher thread.'''
+        if self._thread is not None:
+            return
+
+        os.makedirs(self.data_mount, exist_ok=True)
+        self._stamps = _scan_tree(self.data_mount)
+        for path in self._stamps:
+            if path.endswith('.json'):
+                self.index.add(path)
+
+        self._source = self._make_source()
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name='isadream-watcher', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        '''Stop the watcher thread.'''
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def _make_source(self):
+        if self.use_inotify:
+            try:
+                return _InotifySource(self.data_mount)
+            except OSError as error:
+                logger.info('inotify unavailable (%s), polling %s instead.',
+                            error, self.data_mount)
+        return _PollingSource(self.interval, self._stop)
+
+    def _run(self):
+        try:
+            while not self._stop.is_set():
+                try:
+                    self._poll_once()
+                except Exception:
+                    logger.exception('Data watcher iteration failed.')
+        finally:
+            self._source.close()
+
+    def _poll_once(self):
+        paths = self._source.read(self.interval)
+        if self._stop.is_set():
+            return
+        if paths:
+            # Let a burst of writes settle before reparsing.
+            self._stop.wait(self.interval / 4)
+            more = self._source.read(0)
+            paths = None if more is None else paths | more
+        if paths is None or paths:
+            self.refresh(paths)
+
+    def refresh(self, paths=None):
+        '''Reindex changed files and notify subscribers.
+
+        Args:
+            paths (set[str]): Candidate paths reported by the change source.
+                If None, the whole mount is rescanned.
+
+        Returns:
+            list[ChangeSet]: The changes found, one per folder.
+
+        '''
+        changed, removed = self._diff(paths)
+
+        # Map changed datafiles back to the nodes that reference them.
+        node_paths = {path for path in changed if path.endswith('.json')}
+        for path in changed - node_paths:
+            node_paths.update(self.index.nodes_using(path))
+
+        folders = collections.defaultdict(
+            lambda: ChangeSet(None, [], [], []))
+        for path in sorted(node_paths):
+            existed = path in self.index
+            node = self.index.update(path)
+            if node is None:
+                continue
+            changes = folders[os.path.dirname(path)]
+            (changes.modified if existed else changes.added).append(node)
+
+        for path in sorted(removed):
+            if path.endswith('.json'):
+                self.index.remove(path)
+                folders[os.path.dirname(path)].removed.append(path)
+
+        change_sets = [changes._replace(folder=folder)
+                       for folder, changes in folders.items()]
+        for changes in change_sets:
+            self._notify(changes)
+        return change_sets
+
+    def _diff(self, paths):
+        '''Compare candidate paths against the stored stamps.'''
+        if paths is None:
+            current = _scan_tree(self.data_mount)
+            candidates = set(current) | set(self._stamps)
+        else:
+            candidates = set()
+            for path in paths:
+                if path in self._stamps or _is_watched(path):
+                    candidates.add(path)
+                else:
+                    # A removed directory, expand to the files it held.
+                    prefix = path + os.sep
+                    candidates.update(p for p in self._stamps
+                                      if p.startswith(prefix))
+            current = {path: _stamp(path) for path in candidates}
+
+        changed, removed = set(), set()
+        for path in candidates:
+            stamp = current.get(path)
+            if stamp is None:
+                if self._stamps.pop(path, None) is not None:
+                    removed.add(path)
+            elif self._stamps.get(path) != stamp:
+                self._stamps[path] = stamp
+                changed.add(path)
+        return changed, removed
+
+    def _notify(self, changes):
+        with self._lock:
+            callbacks = (list(self._subscribers.get(changes.folder, ()))
+                         + list(self._subscribers.get(None, ())))
+        for callback in callbacks:
+            try:
+                callback(changes)
+            except Exception:
+                logger.exception('Subscriber for %s failed.', changes.folder)
+
+
+def node_frame(node):
+    '''Build the rows of every assay datafile referenced by a node.
+
+    Each row is tagged with the node path and the datafile it came from, so
+    that streamed rows can be traced back to their metadata.
+
+    '''
+    folder = os.path.dirname(node.json_path)
+    frames, constants = list(), list()
+    for data_file in _data_files(node):
+        # The cached frame is shared, `merge_frames` only reads from it.
+        frame = cache.read_csv(utils.data_file_path(data_file, folder),
+                               skiprows=1, header=None)
+        frames.append(frame.rename(columns=str))
+        constants.append(dict(metadata_key=node.json_path,
+                              data_file=data_file))
+    return merge.merge_frames(frames, constants).to_frame()
+
+
+def stream_frame(doc, source, frame, rollover=None):
+    '''Stream the rows of a frame into a session's ColumnDataSource.
+
+    Only the columns already present in the source are sent. This is safe to
+    call from the watcher thread, the update is scheduled on the document's
+    IOLoop.
+
+    '''
+    columns = list(source.data.keys())
+    if frame.empty or not set(columns).issubset(frame.columns):
+        return
+    new_data = {col: frame[col].values for col in columns}
+    doc.add_next_tick_callback(
+        partial(source.stream, new_data, rollover=rollover))
+
+
+def watch_session(doc, on_change, endpoint_args='J'):
+    '''Subscribe a session to the `ChangeSet`s of its folder.
+
+    The subscription is removed when the session is destroyed. Like any
+    subscriber, on_change is called from the watcher thread.
+
+    Returns:
+        callable: A function that removes the subscription, or None if the
+            watcher is not running or the session has no folder.
+
+    '''
+    folder = sessions.session_folder(doc.session_context, endpoint_args)
+    if _WATCHER is None or folder is None:
+        return None
+    unsubscribe = _WATCHER.subscribe(folder, on_change)
+    doc.on_session_destroyed(lambda session_context: unsubscribe())
+    return unsubscribe
+
+
+_WATCHER = None
+
+
+def start_watcher(data_mount=utils.DATA_MOUNT, **kwargs):
+    '''Start (once) and return the process wide `DataWatcher`.
+
+    Intended to be called from a Bokeh `on_server_loaded` hook.
+
+    '''
+    global _WATCHER
+    if _WATCHER is None:
+        _WATCHER = DataWatcher(data_mount, **kwargs)
+        _WATCHER.start()
+    return _WATCHER
+
+
+def get_watcher():
+    '''Return the running `DataWatcher`, or None if it was never started.'''
+    return _WATCHER
+
+
+def stop_watcher():
+    '''Stop the process wide `DataWatcher`, if running.'''
+    global _WATCHER
+    if _WATCHER is not None:
+        _WATCHER.stop()
+        _WATCHER = None
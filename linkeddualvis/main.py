@@ -5,16 +5,446 @@ Generic Linked Plots
 
 Author: Tyler Biggs
 
+A spectrum view, a trace of each assay's intensity (or of its first other
+numeric column) along the measurement axis, and a factor scatter plot of
+the same assay rows. The points of both figures are drawn from a single
+`ColumnDataSource` through one `CDSView`, so:
+
+    + the data is sent to the browser once, not once per figure,
+    + a selection made in either figure is shown in both, and
+    + the assay and measurement range filters run in the browser, the
+      server never rebuilds or resends the data when they change.
+
+A trend line is fitted to each assay of the scatter plot, all assays in one
+batch, and cached per version of the session's files. Below it, the
+distribution of the scatter plot's x axis within the assay and measurement
+filters is kept by a `crossfilter.CrossFilter`, which only updates the
+counts of the rows a filter change moves.
+
+Opened with a `stream` argument naming a live stream of the server (see
+`isadream.server.streaming`), new rows are appended to the view as they are
+measured, keeping the last `IDREAM_STREAM_ROLLOVER` rows. The trend lines,
+spectrum and distribution are refreshed from the streamed rows at most every
+`REFRESH_DELAY` milliseconds.
+
 '''
 
 # General imports.
+import os
+import math
+import time
 
+# Data science imports.
+import pandas as pd
 
 # Bokeh imports.
 import bokeh
 import bokeh.io
 import bokeh.layouts
 import bokeh.plotting
+from bokeh.models import (ColumnDataSource, CDSView, CustomJS,
+                          CustomJSFilter, Div, RangeSlider, Select)
+from bokeh.models.widgets import DataTable, TableColumn, NumberFormatter
+
+# isaDream imports.
+from isadream.models import cubes
+from isadream.models import crossfilter
+from isadream.models import query
+from isadream.models import fitting
+from isadream.server import loader
+from isadream.server import metrics
+from isadream.server import sessions
+from isadream.server import streaming
+from isadream.server import watcher
+
+APP_NAME = 'linkeddualvis'
+TOOLS = 'pan,wheel_zoom,box_select,lasso_select,tap,reset'
+ALL_ASSAYS = 'All assays'
+# Trend line choices, by polynomial degree.
+TRENDS = {'None': None, 'Linear': 1, 'Quadratic': 2, 'Cubic': 3}
+STREAM_ROLLOVER = int(os.environ.get('IDREAM_STREAM_ROLLOVER', 10000))
+REFRESH_DELAY = 500
+build_start = time.perf_counter()
+
+doc = bokeh.plotting.curdoc()
 
 
 # Gather the data.
+def load_data_frame():
+    '''The assay rows of every node in the session folder, and the
+    `fitting.dataset_version` of those nodes.'''
+    folder = sessions.session_folder(doc.session_context)
+    if folder is not None:
+        json_paths = loader.session_json_files(folder)
+        data_frame = query.select(json_paths).to_frame()
+        if len(data_frame):
+            return data_frame, fitting.dataset_version(json_paths)
+
+    # No session data, show the demo rows.
+    return pd.DataFrame(dict(
+        OH_concentration=[0.89, 2.93, 4.92, 6.85, 9.13, 10.71],
+        Al_ppm=[79.96, 79.90, 79.84, 79.72, 79.66, 79.66],
+        data_file=['demo'] * 6,
+        metadata_key=['demo'] * 6,
+    )), 'demo'
+
+
+data_frame, dataset_version = load_data_frame()
+metrics.track_frame(APP_NAME, doc.session_context.id, data_frame)
+
+if not any(data_frame[col].dtype != object for col in data_frame.columns):
+    # Nothing numeric to draw, plot the rows by position.
+    data_frame['row'] = range(len(data_frame))
+
+columns = sorted(data_frame.columns)
+continuous = [col for col in columns if data_frame[col].dtype != object]
+# The spectrum is drawn along the measurement axis, chemical shift for NMR.
+measurement = next((col for col in continuous
+                    if col.startswith('Measurement (')), continuous[0])
+# Against the intensity, if the assays have one.
+trace = next((col for col in continuous if col != measurement
+              and 'intensity' in col.lower()),
+             next((col for col in continuous if col != measurement),
+                  measurement))
+data_files = sorted(data_frame['data_file'].unique())
+
+source = ColumnDataSource(data=data_frame)
+
+# Filters --------------------------------------------------------------------
+assay_select = Select(title='Assay', value=ALL_ASSAYS,
+                      options=[ALL_ASSAYS] + data_files)
+
+# Missing values are skipped, an all missing column gets a unit range.
+low, high = data_frame[measurement].min(), data_frame[measurement].max()
+if not (math.isfinite(low) and math.isfinite(high)):
+    low, high = 0.0, 1.0
+step = (high - low) / 100 or 1
+range_slider = RangeSlider(title=measurement, start=low, end=high + step,
+                           value=(low, high + step), step=step)
+
+# Evaluated in the browser, returns the indices of the rows to draw.
+row_filter = CustomJSFilter(
+    args=dict(assay_select=assay_select, range_slider=range_slider,
+              measurement=measurement, all_assays=ALL_ASSAYS),
+    code='''
+    var assay = assay_select.value;
+    var low = range_slider.value[0];
+    var high = range_slider.value[1];
+    var values = source.data[measurement];
+    var files = source.data['data_file'];
+    var indices = [];
+    for (var i = 0; i < values.length; i++) {
+        if ((assay == all_assays || files[i] == assay)
+                && values[i] >= low && values[i] <= high) {
+            indices.push(i);
+        }
+    }
+    return indices;
+''')
+
+view = CDSView(source=source, filters=[row_filter])
+
+# Changing a filter widget only asks the browser to recompute the view.
+refilter = CustomJS(args=dict(source=source), code='source.change.emit();')
+assay_select.js_on_change('value', refilter)
+range_slider.js_on_change('value', refilter)
+
+
+# Figures --------------------------------------------------------------------
+def spectrum_lines(frame):
+    '''A line per assay through its points, in measurement order.'''
+    xs, ys, files = list(), list(), list()
+    if measurement not in frame or trace not in frame:
+        return dict(xs=xs, ys=ys, data_file=files)
+    for data_file, rows in frame.groupby('data_file', sort=True):
+        rows = rows.sort_values(measurement)
+        xs.append(rows[measurement].to_numpy())
+        ys.append(rows[trace].to_numpy())
+        files.append(data_file)
+    return dict(xs=xs, ys=ys, data_file=files)
+
+
+spectrum_source = ColumnDataSource(data=spectrum_lines(data_frame))
+
+
+def create_spectrum():
+    '''The trace of every assay along the measurement axis.'''
+    fig = bokeh.plotting.figure(
+        title='Spectrum', width=600, height=300, tools=TOOLS)
+    fig.multi_line(xs='xs', ys='ys', source=spectrum_source,
+                   line_color='grey', line_width=1.5)
+    # The points are linked to the scatter plot, and filtered with it.
+    fig.circle(x=measurement, y=trace, source=source, view=view, size=4,
+               nonselection_alpha=0.2)
+    fig.xaxis.axis_label = measurement
+    fig.yaxis.axis_label = trace
+    return fig
+
+
+def create_scatter():
+    '''A scatter plot of two factors, chosen with the axis selectors.'''
+    fig = bokeh.plotting.figure(
+        title='Factors', width=600, height=400, tools=TOOLS)
+    renderer = fig.circle(x=x_selector.value, y=y_selector.value,
+                          source=source, view=view, size=8,
+                          nonselection_alpha=0.2)
+    fig.multi_line(xs='xs', ys='ys', source=fit_source, line_color='black',
+                   line_dash='dashed', line_width=1.5)
+    fig.xaxis.axis_label = x_selector.value
+    fig.yaxis.axis_label = y_selector.value
+    return fig, renderer
+
+
+x_selector = Select(title='X Axis', options=continuous, value=measurement)
+y_selector = Select(title='Y Axis', options=continuous,
+                    value=next((col for col in continuous
+                                if col != measurement), measurement))
+
+trend_select = Select(title='Trend', options=list(TRENDS), value='Linear')
+fit_source = ColumnDataSource(data=dict(xs=[], ys=[], group=[],
+                                        r_squared=[]))
+
+spectrum_figure = create_spectrum()
+scatter_figure, scatter_renderer = create_scatter()
+
+
+def update_fits():
+    '''Fit the scatter axes for every assay, reusing cached fits.'''
+    degree = TRENDS[trend_select.value]
+    if degree is None or x_selector.value == y_selector.value:
+        fit_source.data = dict(xs=[], ys=[], group=[], r_squared=[])
+        return
+    fits = fitting.fit_frame(data_frame, x_selector.value, y_selector.value,
+                             by='data_file', degree=degree,
+                             version=dataset_version)
+    fit_source.data = fits.lines()
+
+
+update_fits()
+
+
+@metrics.timed_callback(APP_NAME)
+def update_axes(attr, old, new):
+    '''Point the scatter glyph at other columns, the data is not resent.'''
+    scatter_renderer.glyph.x = x_selector.value
+    scatter_renderer.glyph.y = y_selector.value
+    scatter_figure.xaxis.axis_label = x_selector.value
+    scatter_figure.yaxis.axis_label = y_selector.value
+    update_fits()
+
+
+@metrics.timed_callback(APP_NAME)
+def update_trend(attr, old, new):
+    update_fits()
+    update_histogram()
+
+
+x_selector.on_change('value', update_axes)
+y_selector.on_change('value', update_axes)
+trend_select.on_change('value', update_trend)
+
+
+def build_selection_div(indices=()):
+    '''Summarize the selected rows by assay.'''
+    if not indices:
+        return 'No data points selected.'
+    # The source, not `data_frame`, holds any rows streamed in since.
+    data_file = source.data['data_file']
+    selected = pd.Series([data_file[index] for index in indices
+                          if index < len(data_file)]).value_counts()
+    rows = ''.join(f'<li>{name}: {count}</li>'
+                   for name, count in selected.items())
+    return f'<b>{len(indices)} points selected</b><ul>{rows}</ul>'
+
+
+selection_div = Div(text=build_selection_div(), width=300)
+
+
+@metrics.timed_callback(APP_NAME)
+def selection_callback(attr, old, new):
+    selection_div.text = build_selection_div(new)
+
+
+# The selection is shared by both figures, as they share the source.
+source.selected.on_change('indices', selection_callback)
+
+# Distribution ---------------------------------------------------------------
+ASSAY_DIMENSION = 'assay'
+assay_codes = {name: code for code, name in enumerate(data_files)}
+
+
+def build_crossfilter(frame):
+    '''A crossfilter of the numeric columns, and of the assay of each row.'''
+    columns = {col: frame[col].to_numpy(dtype=float)
+               for col in continuous if col in frame}
+    columns[ASSAY_DIMENSION] = frame['data_file'].map(
+        assay_codes).to_numpy(dtype=float)
+    return crossfilter.CrossFilter(columns)
+
+
+hist_source = ColumnDataSource(data=dict(left=[], right=[], top=[]))
+hist_figure = bokeh.plotting.figure(title='Distribution', width=600,
+                                    height=200, tools='')
+hist_figure.quad(left='left', right='right', top='top', bottom=0,
+                 source=hist_source, fill_alpha=0.6)
+
+
+def update_histogram():
+    '''The distribution of the scatter's x axis, within the filters.'''
+    if x_selector.value not in engine.columns:
+        hist_source.data = dict(left=[], right=[], top=[])
+        return
+    counts, edges = engine.dimension(x_selector.value, bins=30).histogram()
+    hist_source.data = dict(left=edges[:-1], right=edges[1:], top=counts)
+    hist_figure.xaxis.axis_label = x_selector.value
+
+
+def filter_engine():
+    '''Apply the assay and measurement filters to the crossfilter.'''
+    if measurement in engine.columns:
+        engine.dimension(measurement).filter_range(*range_slider.value)
+    assay = engine.dimension(ASSAY_DIMENSION)
+    if assay_select.value in assay_codes:
+        code = assay_codes[assay_select.value]
+        assay.filter_range(code, code)
+    else:
+        assay.filter_all()
+    update_histogram()
+
+
+@metrics.timed_callback(APP_NAME)
+def update_filters(attr, old, new):
+    filter_engine()
+
+
+engine = build_crossfilter(data_frame)
+filter_engine()
+assay_select.on_change('value', update_filters)
+range_slider.on_change('value', update_filters)
+
+# Summary panel --------------------------------------------------------------
+# Read from the cubes aggregated at ingest, no rows are scanned here.
+node_cubes = cubes.get_cubes() or cubes.CubeSet(())
+summary_source = ColumnDataSource(data=dict(
+    group=[], count=[], mean=[], std=[], min=[], max=[]))
+number = NumberFormatter(format='0.000')
+summary_table = DataTable(
+    source=summary_source, width=600, height=200, index_position=None,
+    columns=[TableColumn(field='group', title='Group'),
+             TableColumn(field='count', title='Count'),
+             TableColumn(field='mean', title='Mean', formatter=number),
+             TableColumn(field='std', title='Std', formatter=number),
+             TableColumn(field='min', title='Min', formatter=number),
+             TableColumn(field='max', title='Max', formatter=number)])
+cube_select = Select(title='Summary', options=list(node_cubes),
+                     value=next(iter(node_cubes), ''))
+
+
+@metrics.timed_callback(APP_NAME)
+def update_summary(attr=None, old=None, new=None):
+    if cube_select.value in node_cubes:
+        summary = node_cubes[cube_select.value].summary()
+        summary_source.data = {name: summary[name].tolist()
+                               for name in summary.columns}
+
+
+update_summary()
+cube_select.on_change('value', update_summary)
+
+# Layout ---------------------------------------------------------------------
+title_div = Div(text='<h1>Linked Assay Views</h1>')
+controls = bokeh.layouts.widgetbox(
+    [assay_select, range_slider, x_selector, y_selector, trend_select,
+     cube_select, selection_div])
+
+layout = bokeh.layouts.layout(
+    children=[
+        title_div,
+        [controls, bokeh.layouts.column(spectrum_figure, scatter_figure,
+                                        hist_figure, summary_table)],
+    ],
+    sizing_mode='fixed'
+)
+
+# Live updates ---------------------------------------------------------------
+replacing_rows = False
+refresh_pending = False
+showing_demo = dataset_version == 'demo'
+
+
+def show_frame(frame, version):
+    '''Point the views computed on the server at new rows.'''
+    global data_frame, dataset_version, engine
+    data_frame, dataset_version = frame, version
+    metrics.track_frame(APP_NAME, doc.session_context.id, data_frame)
+    for name in sorted(data_frame['data_file'].dropna().unique()):
+        assay_codes.setdefault(name, len(assay_codes))
+    assay_select.options = [ALL_ASSAYS] + list(assay_codes)
+    spectrum_source.data = spectrum_lines(data_frame)
+    engine = build_crossfilter(data_frame)
+    filter_engine()
+    update_fits()
+
+
+def reload_source():
+    '''Rebuild the rows of every node in the session folder.'''
+    global replacing_rows, showing_demo
+    frame, version = load_data_frame()
+    showing_demo = version == 'demo'
+    replacing_rows = True
+    try:
+        source.data = ColumnDataSource.from_df(frame)
+    finally:
+        replacing_rows = False
+    show_frame(frame, version)
+
+
+def refresh_rows():
+    '''Take in the rows streamed into the source since the last refresh.'''
+    global refresh_pending
+    refresh_pending = False
+    frame = pd.DataFrame({col: list(source.data[col])
+                          for col in data_frame.columns})
+    for col in continuous:
+        frame[col] = pd.to_numeric(frame[col], errors='coerce')
+    show_frame(frame, fitting.frame_version(frame))
+
+
+def on_rows_changed(attr, old, new):
+    '''Called when rows are streamed in, by the watcher or a live stream.'''
+    global refresh_pending
+    if replacing_rows or refresh_pending:
+        return
+    refresh_pending = True
+    doc.add_timeout_callback(refresh_rows, REFRESH_DELAY)
+
+
+source.on_change('data', on_rows_changed)
+
+
+def on_folder_change(changes):
+    '''Called from the watcher thread when nodes of the session folder
+    change. The rows of added nodes are streamed in, an edited or removed
+    node reloads the session's rows.'''
+    if changes.modified or changes.removed or showing_demo:
+        doc.add_next_tick_callback(reload_source)
+        return
+    frame = query.select([node.json_path for node in changes.added]).to_frame()
+    if len(frame):
+        watcher.stream_frame(doc, source,
+                             frame.reindex(columns=list(source.data)))
+
+
+watcher.watch_session(doc, on_folder_change)
+
+# Append the rows of a live stream, if one is asked for.
+stream_name = sessions.session_folder(doc.session_context, 'stream')
+live_stream = stream_name and streaming.get_stream(stream_name)
+if live_stream:
+    unsubscribe = live_stream.subscribe(doc, source, rollover=STREAM_ROLLOVER)
+    doc.on_session_destroyed(lambda session_context: unsubscribe())
+
+doc.add_root(layout)
+doc.title = 'Linked Assay Views'
+
+metrics.DOCUMENT_BUILD.observe_since(build_start, app=APP_NAME)
@@ -0,0 +1,36 @@
+import logging
+
+from isadream.server import lifecycle
+from isadream.server import metrics
+from isadream.server import sessions
+
+logger = logging.getLogger(__name__)
+
+
+def on_server_loaded(server_context):
+    ''' If present, this function is called when the server first starts. '''
+    # The watcher, catalog, cubes, session manager, metrics and streams are
+    # shared with the other apps of this server.
+    lifecycle.server_loaded()
+
+def on_server_unloaded(server_context):
+    ''' If present, this function is called when the server shuts down. '''
+    lifecycle.server_unloaded()
+
+def on_session_created(session_context):
+    ''' If present, this function is called when a session is created.
+    '''
+    metrics.session_created('linkeddualvis')
+    try:
+        sessions.get_manager().acquire(sessions.session_folder(session_context))
+    except ValueError as error:
+        logger.warning('Rejected session folder: %s', error)
+
+def on_session_destroyed(session_context):
+    ''' If present, this function is called when a session is closed. '''
+    metrics.session_destroyed('linkeddualvis', session_context.id)
+    # The folder is only deleted once no other open session points at it.
+    try:
+        sessions.get_manager().release(sessions.session_folder(session_context))
+    except ValueError as error:
+        logger.warning('Rejected session folder: %s', error)
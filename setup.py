@@ -7,5 +7,9 @@ setup(
     version='0.1',
     packages=find_packages(),
     include_package_data=True,
+    extras_require={
+        # Optional, faster JSON parsers for node ingestion.
+        'fastjson': ['orjson', 'pysimdjson', 'ujson'],
+    },
     py_modules=['isadream']
 )
@@ -4,6 +4,8 @@ import os
 import sys
 import glob
 import json
+import time
+from functools import partial
 
 # Bokeh imports
 from bokeh.layouts import layout, widgetbox
@@ -13,6 +15,21 @@ from bokeh.models.widgets import Div, Tabs, Panel
 from bokeh.palettes import Category10
 from bokeh.transform import factor_cmap
 
+# isaDream imports.
+from isadream.models import query
+from isadream.server import metrics
+from isadream.server import watcher
+
+APP_NAME = 'testvis'
+build_start = time.perf_counter()
+doc = curdoc()
+
+# The plot columns, by the factor labels `query.select` gives them.
+FACTOR_COLUMNS = {
+    query.factor_label('Measurement Condition', 'Molar'): 'OH_concentration',
+    query.factor_label('Measurement', 'ppm'): 'Al_ppm',
+}
+
 metadata_dict = dict()
 
 '''
@@ -120,6 +137,12 @@ data_frame = pd.DataFrame(
 data_frame['metadata_key'] = 'failure'
 metadata_dict['failure'] = "This is a failure."
 
+metrics.track_frame(APP_NAME, doc.session_context.id, data_frame)
+
+# The demo rows, and the rows of each node of the session folder.
+demo_frame = data_frame
+node_frames = dict()
+
 # print(data_frame)
 # print(metadata_dict)
 
@@ -161,6 +184,7 @@ def update_data():
     # print(data_frame)
 
 
+@metrics.timed_callback(APP_NAME)
 def tap_select_callback(attr, old, new):
     """The callback function for when a user uses the TapTool to
     select a single data point.
@@ -247,6 +271,7 @@ def create_figure():
     return tabs
 
 
+@metrics.timed_callback(APP_NAME)
 def update_plot(attr, old, new):
     """
     Define the function to be run upon an update call.
@@ -265,12 +290,56 @@ def build_metadata_paragraph(md_key=None):
         )
     else:
         new_paragarph = Div(
-            text=str(metadata_dict[md_key]),
+            text=str(metadata_dict.get(md_key, md_key)),
             width=300,
         )
         return new_paragarph
 
 
+def add_rows(frame):
+    """Append rows to the dataframe and stream them into the plot."""
+    global data_frame
+    data_frame = pd.concat([data_frame, frame], ignore_index=True)
+    frame = frame.assign(x=frame[x_selector.value], y=frame[y_selector.value])
+    source.stream({col: frame[col].values for col in source.data})
+
+
+def replace_rows(frame):
+    """Replace the dataframe, and the data of the plot."""
+    global data_frame
+    data_frame = frame
+    update_data()
+
+
+def node_rows(json_path):
+    """The rows of a node, named like the columns of the dataframe."""
+    frame = query.select([json_path]).to_frame()
+    return frame.rename(columns=FACTOR_COLUMNS).reindex(
+        columns=list(demo_frame.columns))
+
+
+def on_folder_change(changes):
+    """Called from the watcher thread when nodes of the session folder
+    change. The rows of added nodes are streamed in, an edited or removed
+    node rebuilds the rows on the document's IOLoop."""
+    added = {node.json_path: node_rows(node.json_path)
+             for node in changes.added}
+    node_frames.update(added)
+    for node in changes.modified:
+        node_frames[node.json_path] = node_rows(node.json_path)
+    for json_path in changes.removed:
+        node_frames.pop(json_path, None)
+
+    if changes.modified or changes.removed:
+        frame = pd.concat([demo_frame] + list(node_frames.values()),
+                          ignore_index=True)
+        doc.add_next_tick_callback(partial(replace_rows, frame))
+    elif added:
+        frame = pd.concat(list(added.values()), ignore_index=True)
+        if len(frame):
+            doc.add_next_tick_callback(partial(add_rows, frame))
+
+
 # HTML Elements ---------------------------------------------------------------
 title_div = Div(text="<h1>Aluminate CrossFilter</h1>")
 
@@ -299,5 +368,10 @@ layout = layout(
     sizing_mode='fixed'
 )
 
-curdoc().add_root(layout)
-curdoc().title = "test vis"
+# Stream in the rows of nodes added to the session folder.
+watcher.watch_session(doc, on_folder_change)
+
+doc.add_root(layout)
+doc.title = "test vis"
+
+metrics.DOCUMENT_BUILD.observe_since(build_start, app=APP_NAME)
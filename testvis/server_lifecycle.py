@@ -1,33 +1,36 @@
-import shutil
-import os
+import logging
+
+from isadream.server import lifecycle
+from isadream.server import metrics
+from isadream.server import sessions
+
+logger = logging.getLogger(__name__)
 
 
 def on_server_loaded(server_context):
     ''' If present, this function is called when the server first starts. '''
-    pass
+    # The watcher, catalog, cubes, session manager, metrics and streams are
+    # shared with the other apps of this server.
+    lifecycle.server_loaded()
 
 def on_server_unloaded(server_context):
     ''' If present, this function is called when the server shuts down. '''
-    pass
+    lifecycle.server_unloaded()
 
 def on_session_created(session_context):
     ''' If present, this function is called when a session is created.
     '''
-    pass
+    metrics.session_created('testvis')
+    try:
+        sessions.get_manager().acquire(sessions.session_folder(session_context))
+    except ValueError as error:
+        logger.warning('Rejected session folder: %s', error)
 
 def on_session_destroyed(session_context):
     ''' If present, this function is called when a session is closed. '''
-    # Try to read the filepath.
+    metrics.session_destroyed('testvis', session_context.id)
+    # The folder is only deleted once no other open session points at it.
     try:
-        # Get the filepath of the generated json files for this vis instance.
-        args = session_context.request.arguments
-        filepath = args.get('J')[0].decode("utf-8")
-        filepath = os.path.join('data', filepath)
-        # # Remove the folder and all its contents.
-        shutil.rmtree(filepath)
-        print(f'I REMOVED THE FOLDER {filepath} AND ALL ITS CONTENTS.')
-
-    except:
-        # TODO: Use better form on this exception. At least throw or log
-        # the error that occurs.
-        pass
+        sessions.get_manager().release(sessions.session_folder(session_context))
+    except ValueError as error:
+        logger.warning('Rejected session folder: %s', error)